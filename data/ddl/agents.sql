@@ -2,6 +2,7 @@ CREATE TABLE agents (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     name TEXT NOT NULL,
     prompt_file TEXT NOT NULL,
+    parser_spec TEXT DEFAULT NULL,  -- JSON column mapping of the bank's CSV (see bank_parser.py)
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(name)
 );
@@ -0,0 +1,13 @@
+-- Files stored in an archive, with their digests for verify_archive
+CREATE TABLE archive_members (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    archive_id INTEGER NOT NULL,
+    csvfile_id INTEGER NOT NULL,
+    name TEXT NOT NULL,             -- Name in the archive
+    size INTEGER NOT NULL,          -- Size of the file
+    crc32 INTEGER NOT NULL,         -- CRC-32 of the file
+    sha256 TEXT NOT NULL,           -- SHA-256 of the file (blob hash in the blob store)
+    FOREIGN KEY(archive_id) REFERENCES archives(id),
+    FOREIGN KEY(csvfile_id) REFERENCES csvfiles(id)
+);
+CREATE INDEX idx_archive_members_archive_id ON archive_members(archive_id);
@@ -1,5 +1,6 @@
 CREATE TABLE archives (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     filename TEXT NOT NULL,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    codec TEXT NOT NULL DEFAULT 'deflate'
 );
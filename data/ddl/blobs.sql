@@ -0,0 +1,9 @@
+-- Content-addressed blob store (archive store = blob)
+-- Each object is stored once in blob_dir/<hash[:2]>/<hash>
+CREATE TABLE blobs (
+    hash TEXT PRIMARY KEY,          -- SHA-256 of the content
+    size INTEGER NOT NULL,          -- Size of the content
+    stored_size INTEGER NOT NULL,   -- Size of the compressed object file
+    codec TEXT NOT NULL,            -- Compression of the object file
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
@@ -7,6 +7,10 @@ CREATE TABLE csvfiles (
     archive_id INTEGER DEFAULT NULL,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     loaded_date DATETIME DEFAULT NULL,
+    blob_hash TEXT DEFAULT NULL,      -- Content in the blob store while archived (store = blob)
+    org_blob_hash TEXT DEFAULT NULL,  -- Same for the org_name file
     FOREIGN KEY(agent_id) REFERENCES agents(id),
-    FOREIGN KEY(archive_id) REFERENCES archive(id)
+    FOREIGN KEY(archive_id) REFERENCES archive(id),
+    FOREIGN KEY(blob_hash) REFERENCES blobs(hash),
+    FOREIGN KEY(org_blob_hash) REFERENCES blobs(hash)
 );
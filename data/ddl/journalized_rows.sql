@@ -0,0 +1,9 @@
+CREATE TABLE journalized_rows (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    agent_id INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,      -- SHA-256 of the normalized source line (see source_reader.py)
+    output TEXT NOT NULL,           -- JSON list of the rows journalized from the line
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(agent_id) REFERENCES agents(id)
+);
+CREATE UNIQUE INDEX idx_journalized_rows_agent_fingerprint ON journalized_rows(agent_id, fingerprint);
@@ -0,0 +1,2 @@
+-- Migration script to add the parser spec (JSON column mapping of the bank's CSV) to agents
+ALTER TABLE agents ADD COLUMN parser_spec TEXT DEFAULT NULL;
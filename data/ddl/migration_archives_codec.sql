@@ -0,0 +1,3 @@
+-- Migration script to add codec column to existing archives table
+-- (archives created before this column existed are deflate zip files)
+ALTER TABLE archives ADD COLUMN codec TEXT NOT NULL DEFAULT 'deflate';
@@ -0,0 +1,10 @@
+-- Migration script to add the blob store to an existing database
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    codec TEXT NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+ALTER TABLE csvfiles ADD COLUMN blob_hash TEXT DEFAULT NULL REFERENCES blobs(hash);
+ALTER TABLE csvfiles ADD COLUMN org_blob_hash TEXT DEFAULT NULL REFERENCES blobs(hash);
@@ -0,0 +1,14 @@
+-- Migration script for transfer matching (match_transfers) on an existing database
+CREATE INDEX IF NOT EXISTS idx_transactions_account_amount_date ON transactions(account_id, amount, transaction_date);
+CREATE INDEX IF NOT EXISTS idx_transactions_ref_transaction_id ON transactions(ref_transaction_id);
+CREATE INDEX IF NOT EXISTS idx_transactions_transfer_id ON transactions(transfer_id);
+
+-- Mark the counter-legs created by load_csv as inferred: the second row of a transfer
+-- whose two rows were loaded together points to the first one
+UPDATE transactions
+SET ref_transaction_id = (SELECT MIN(o.id) FROM transactions o WHERE o.transfer_id = transactions.transfer_id)
+WHERE transfer_id IS NOT NULL
+  AND ref_transaction_id IS NULL
+  AND id > (SELECT MIN(o.id) FROM transactions o WHERE o.transfer_id = transactions.transfer_id)
+  AND (SELECT COUNT(*) FROM transactions o
+       WHERE o.transfer_id = transactions.transfer_id AND o.log_id IS transactions.log_id) = 2;
@@ -17,3 +17,7 @@ CREATE TABLE transactions (
     FOREIGN KEY(ref_transaction_id) REFERENCES transactions(id),
     FOREIGN KEY(transfer_id) REFERENCES transfers(id)
 );
+-- (account, amount, date) is the sort order of transfer matching (match_transfers)
+CREATE INDEX idx_transactions_account_amount_date ON transactions(account_id, amount, transaction_date);
+CREATE INDEX idx_transactions_ref_transaction_id ON transactions(ref_transaction_id);
+CREATE INDEX idx_transactions_transfer_id ON transactions(transfer_id);
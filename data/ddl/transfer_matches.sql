@@ -0,0 +1,17 @@
+-- Rows linked by match_transfers, with their state before the match (restored by rollback_csv_files)
+CREATE TABLE transfer_matches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    transaction_id INTEGER NOT NULL,        -- the real row that joined the transfer
+    partner_id INTEGER NOT NULL,            -- the real row the dropped inferred leg was made from
+    transfer_id INTEGER NOT NULL,           -- the transfer the row joined
+    original_category_id INTEGER NOT NULL,  -- category of the row before the match
+    original_transfer_id INTEGER,           -- its own transfer (inferred leg dropped) or NULL for income/expense
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(transaction_id) REFERENCES transactions(id),
+    FOREIGN KEY(partner_id) REFERENCES transactions(id),
+    FOREIGN KEY(transfer_id) REFERENCES transfers(id),
+    FOREIGN KEY(original_category_id) REFERENCES categories(id),
+    FOREIGN KEY(original_transfer_id) REFERENCES transfers(id)
+);
+CREATE INDEX idx_transfer_matches_transaction_id ON transfer_matches(transaction_id);
+CREATE INDEX idx_transfer_matches_partner_id ON transfer_matches(partner_id);
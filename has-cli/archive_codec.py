@@ -0,0 +1,602 @@
+#!/usr/bin/env python3
+"""
+Archive Codecs
+==============
+
+Containers and compression used by archive_csv / extract.
+
+Codec specs ([archive] codec in config.ini, recorded in archives.codec):
+  deflate[:LEVEL]  zip, DEFLATE (LEVEL 0-9)                      -> .zip
+  store            zip without compression (e.g. PDF statements)   -> .zip
+  xz[:PRESET]      tar + xz (PRESET 0-9, default 6)               -> .tar.xz
+  zstd[:LEVEL]     tar + zstd (LEVEL 1-22, default 3)             -> .tar.zst
+                   (requires the zstandard package)
+
+Members of tar archives are compressed in parallel worker threads (lzma and
+zstandard release the GIL while compressing). Each member (header, data and
+padding) is compressed independently into a temporary file as its own xz
+stream / zstd frame, and the results are appended to the archive in order;
+concatenated streams form a valid .tar.xz/.tar.zst. zip archives are written
+one member at a time with ZipFile.write: zipfile has no public API for
+appending members compressed elsewhere.
+
+Extraction streams members in BLOCK_SIZE blocks, so memory use does not
+depend on the size of the archived files. open_member / open_blob give a
+reader over a single member, so load_csv / journalize can read archived
+files without extracting them.
+
+SHA-256, size and CRC-32 of every member are computed while it is
+compressed (MemberDigest); verify_archive / verify_blobs check an archive
+against them without writing any files.
+
+Blob store ([archive] store = blob):
+  Instead of one archive file per archive_csv call, every file is stored once
+  as a content-addressed object BLOB_DIR/<sha256[:2]>/<sha256>, compressed
+  with the codec as a single stream (deflate: gzip, xz: xz, zstd: zstd frame,
+  store: raw). Archiving a file whose content is already stored is a metadata
+  operation only.
+"""
+
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from pathlib import Path
+from typing import IO, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+# Read/write block size for compression and extraction
+BLOCK_SIZE = 1024 * 1024
+
+DEFAULT_CODEC = "deflate"
+
+# name -> (container, archive suffix, level range, default level)
+CODECS = {
+    "deflate": ("zip", ".zip", (0, 9), None),
+    "store": ("zip", ".zip", None, None),
+    "xz": ("tar", ".tar.xz", (0, 9), 6),
+    "zstd": ("tar", ".tar.zst", (1, 22), 3),
+}
+
+
+class MemberDigest(NamedTuple):
+    """Content digest of an archived file (stored in the archive_members table)"""
+    sha256: str
+    size: int
+    crc32: int
+
+
+class _Hasher:
+    """Accumulates SHA-256, size and CRC-32 over blocks"""
+
+    def __init__(self):
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.crc32 = 0
+
+    def update(self, block: bytes):
+        self.sha256.update(block)
+        self.size += len(block)
+        self.crc32 = zlib.crc32(block, self.crc32)
+
+    def digest(self) -> MemberDigest:
+        return MemberDigest(self.sha256.hexdigest(), self.size, self.crc32)
+
+
+def hash_stream(stream: IO[bytes]) -> MemberDigest:
+    """Digest of a binary stream, read in BLOCK_SIZE blocks"""
+    hasher = _Hasher()
+    while True:
+        block = stream.read(BLOCK_SIZE)
+        if not block:
+            break
+        hasher.update(block)
+    return hasher.digest()
+
+
+class ArchiveCodec:
+    """A parsed codec spec"""
+
+    def __init__(self, name: str, level: Optional[int] = None):
+        self.name = name
+        self.level = level
+        self.container, self.suffix, _, default_level = CODECS[name]
+        if self.level is None:
+            self.level = default_level
+
+    @property
+    def spec(self) -> str:
+        """Normalized spec string (stored in archives.codec)"""
+        return self.name if self.level is None else f"{self.name}:{self.level}"
+
+    def archive_name(self, filename: str) -> str:
+        """Give filename the suffix of this codec (e.g. 1_20250101.zip -> 1_20250101.tar.xz)"""
+        if filename.endswith(self.suffix):
+            return filename
+        for _, suffix, _, _ in CODECS.values():
+            if filename.endswith(suffix):
+                filename = filename[:-len(suffix)]
+                break
+        return filename + self.suffix
+
+    def compressor(self):
+        """New compressor object (compress/flush) for one tar member"""
+        if self.name == "xz":
+            return lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=self.level)
+        if self.name == "zstd":
+            return _zstandard().ZstdCompressor(level=self.level).compressobj()
+        return None
+
+
+def parse_codec(spec: Optional[str]) -> ArchiveCodec:
+    """Parse a codec spec such as "deflate:9", "store", "xz" or "zstd:10"
+
+    Raises:
+        ValueError: Unknown codec, bad level, or zstd without the zstandard package
+    """
+    spec = (spec or DEFAULT_CODEC).strip().lower()
+    name, _, level_str = spec.partition(":")
+    if name not in CODECS:
+        raise ValueError(f"unknown archive codec '{spec}' (available: {', '.join(CODECS)})")
+    level_range = CODECS[name][2]
+    level = None
+    if level_str:
+        if level_range is None:
+            raise ValueError(f"archive codec '{name}' has no level")
+        if not level_str.isdigit() or not level_range[0] <= int(level_str) <= level_range[1]:
+            raise ValueError(f"archive codec level must be {level_range[0]}-{level_range[1]}: '{spec}'")
+        level = int(level_str)
+    if name == "zstd":
+        _zstandard()
+    return ArchiveCodec(name, level)
+
+
+def _zstandard():
+    if zstandard is None:
+        raise ValueError("archive codec 'zstd' requires the zstandard package (pip install zstandard)")
+    return zstandard
+
+
+def _compress_member(codec: ArchiveCodec, src: Path, header: bytes, trailer: bytes,
+                     tmp_dir: Path) -> Tuple[IO[bytes], MemberDigest]:
+    """Compress header + file + trailer into a temporary file
+
+    Returns:
+        (temporary file positioned at 0, digest of the file data)
+    """
+    out = tempfile.TemporaryFile(dir=tmp_dir)
+    try:
+        comp = codec.compressor()
+        hasher = _Hasher()
+        out.write(comp.compress(header))
+        with open(src, 'rb') as f:
+            while True:
+                block = f.read(BLOCK_SIZE)
+                if not block:
+                    break
+                hasher.update(block)
+                out.write(comp.compress(block))
+        out.write(comp.compress(trailer))
+        out.write(comp.flush())
+        out.seek(0)
+        return out, hasher.digest()
+    except BaseException:
+        out.close()
+        raise
+
+
+def _tar_header(src: Path, arcname: str) -> Tuple[bytes, bytes]:
+    """tar header and end padding for one regular file"""
+    st = src.stat()
+    info = tarfile.TarInfo(arcname)
+    info.size = st.st_size
+    info.mtime = int(st.st_mtime)
+    info.mode = 0o644
+    padding = (-st.st_size) % tarfile.BLOCKSIZE
+    return info.tobuf(format=tarfile.PAX_FORMAT), tarfile.NUL * padding
+
+
+def write_archive(archive_path: Path, codec: ArchiveCodec, members: List[Tuple[Path, str]],
+                  workers: Optional[int] = None) -> Dict[str, MemberDigest]:
+    """Create an archive
+
+    Args:
+        archive_path: Archive file to create
+        codec: Codec
+        members: (source file, name in the archive) in archive order
+        workers: Number of compression threads for tar archives (default: min(4, CPU count))
+
+    Returns:
+        Name in the archive -> digest of the member
+
+    The partially written archive is removed if anything fails.
+    """
+    workers = workers or min(4, os.cpu_count() or 1)
+    tmp_dir = archive_path.parent
+    try:
+        if codec.container == "zip":
+            compression = zipfile.ZIP_STORED if codec.name == "store" else zipfile.ZIP_DEFLATED
+            with zipfile.ZipFile(archive_path, 'w', compression, compresslevel=codec.level) as zipf:
+                for src, arcname in members:
+                    zipf.write(src, arcname)
+            return {arcname: hash_file(src) for src, arcname in members}
+
+        futures = []
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for src, arcname in members:
+                    header, trailer = _tar_header(src, arcname)
+                    futures.append(executor.submit(_compress_member, codec, src, header, trailer, tmp_dir))
+                try:
+                    _append_members(archive_path, codec, futures)
+                    return {arcname: future.result()[1] for (_, arcname), future in zip(members, futures)}
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            # Close the temporary files of members that were not appended
+            for future in futures:
+                if not future.cancelled() and future.exception() is None:
+                    future.result()[0].close()
+    except BaseException:
+        archive_path.unlink(missing_ok=True)
+        raise
+
+
+def _append_members(archive_path: Path, codec: ArchiveCodec, futures):
+    """Write the compressed tar members to the archive in order as the workers finish them"""
+    with open(archive_path, 'wb') as out:
+        for future in futures:
+            data, _ = future.result()
+            with data:
+                shutil.copyfileobj(data, out, BLOCK_SIZE)
+        # End-of-archive marker (two zero blocks) as the last stream
+        comp = codec.compressor()
+        out.write(comp.compress(tarfile.NUL * tarfile.BLOCKSIZE * 2))
+        out.write(comp.flush())
+
+
+@contextmanager
+def _open_tar(archive_path: Path, codec: ArchiveCodec) -> Iterator[tarfile.TarFile]:
+    """Open a tar archive for sequential reading"""
+    with ExitStack() as stack:
+        if codec.name == "xz":
+            raw = stack.enter_context(lzma.open(archive_path, 'rb'))
+        else:
+            fh = stack.enter_context(open(archive_path, 'rb'))
+            raw = stack.enter_context(
+                _zstandard().ZstdDecompressor().stream_reader(fh, read_size=BLOCK_SIZE, read_across_frames=True))
+        yield stack.enter_context(tarfile.open(fileobj=raw, mode='r|'))
+
+
+def iter_members(archive_path: Path, codec: ArchiveCodec,
+                 names: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, IO[bytes]]]:
+    """Iterate over the members of an archive as binary streams
+
+    Args:
+        archive_path: Archive file
+        codec: Codec the archive was written with
+        names: Only these members if given
+
+    Yields:
+        (name, stream); a stream is only valid until the next member is requested
+    """
+    wanted = set(names) if names is not None else None
+    if codec.container == "zip":
+        with zipfile.ZipFile(archive_path, 'r') as zipf:
+            for info in zipf.infolist():
+                if info.is_dir() or (wanted is not None and info.filename not in wanted):
+                    continue
+                with zipf.open(info) as stream:
+                    yield info.filename, stream
+        return
+    with _open_tar(archive_path, codec) as tar:
+        for info in tar:
+            if not info.isfile() or (wanted is not None and info.name not in wanted):
+                continue
+            stream = tar.extractfile(info)
+            yield info.name, stream
+
+
+def extract_members(archive_path: Path, codec: ArchiveCodec,
+                    targets: Dict[str, Path]) -> Dict[str, Optional[Exception]]:
+    """Extract members to the given paths, streaming BLOCK_SIZE blocks
+
+    Args:
+        archive_path: Archive file
+        codec: Codec the archive was written with
+        targets: Name in the archive -> destination path
+
+    Returns:
+        Name -> None if extracted or the exception raised while writing it.
+        Members missing from the archive are not included.
+
+    Errors reading the archive itself are raised.
+    """
+    results: Dict[str, Optional[Exception]] = {}
+    for name, stream in iter_members(archive_path, codec, targets):
+        target = targets[name]
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with open(target, 'wb') as out:
+                shutil.copyfileobj(stream, out, BLOCK_SIZE)
+            results[name] = None
+        except OSError as e:
+            results[name] = e
+    return results
+
+
+class _MemberReader(io.RawIOBase):
+    """Plain reader over a tar member of a stream-mode tar
+
+    The member file object of a stream-mode TarFile fails on seekable(),
+    which io.TextIOWrapper calls.
+    """
+
+    def __init__(self, stream: IO[bytes]):
+        self.stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+@contextmanager
+def open_member(archive_path: Path, codec: ArchiveCodec, name: str) -> Iterator[IO[bytes]]:
+    """Open one member of an archive for reading, without extracting it
+
+    Zip members are opened directly; tar archives are read sequentially up to
+    the member, since they have no index.
+
+    Raises:
+        KeyError: The member is not in the archive
+    """
+    if codec.container == "zip":
+        with zipfile.ZipFile(archive_path, 'r') as zipf, zipf.open(name) as stream:
+            yield stream
+        return
+    with _open_tar(archive_path, codec) as tar:
+        for info in tar:
+            if info.isfile() and info.name == name:
+                yield io.BufferedReader(_MemberReader(tar.extractfile(info)), BLOCK_SIZE)
+                return
+    raise KeyError(f"There is no item named {name!r} in the archive")
+
+
+def hash_file(path: Path) -> MemberDigest:
+    """Digest of a file, read in BLOCK_SIZE blocks"""
+    with open(path, 'rb') as f:
+        return hash_stream(f)
+
+
+def blob_path(blob_dir: Path, digest: str) -> Path:
+    """Object file of a blob"""
+    return blob_dir / digest[:2] / digest
+
+
+def _blob_writer(raw: IO[bytes], codec: ArchiveCodec):
+    """Compressing writer over raw (raw is not closed)"""
+    if codec.name == "deflate":
+        level = 6 if codec.level is None else codec.level
+        return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=level, mtime=0)
+    if codec.name == "xz":
+        return lzma.LZMAFile(raw, 'wb', format=lzma.FORMAT_XZ, preset=codec.level)
+    if codec.name == "zstd":
+        return _zstandard().ZstdCompressor(level=codec.level).stream_writer(raw, closefd=False)
+    return nullcontext(raw)
+
+
+def _blob_reader(raw: IO[bytes], codec: ArchiveCodec):
+    """Decompressing reader over raw (raw is not closed)"""
+    if codec.name == "deflate":
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if codec.name == "xz":
+        return lzma.LZMAFile(raw, 'rb')
+    if codec.name == "zstd":
+        return _zstandard().ZstdDecompressor().stream_reader(raw, read_size=BLOCK_SIZE,
+                                                             read_across_frames=True, closefd=False)
+    return nullcontext(raw)
+
+
+def write_blob(blob_dir: Path, codec: ArchiveCodec, src: Path, digest: str) -> int:
+    """Store src as the blob digest (replacing a leftover object file)
+
+    The object is written to a temporary file and renamed, so a blob file is
+    either complete or absent.
+
+    Returns:
+        Size of the object file
+    """
+    path = blob_path(blob_dir, digest)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix=f"{digest}.", suffix=".tmp", dir=path.parent)
+    try:
+        with open(fd, 'wb') as raw:
+            with _blob_writer(raw, codec) as out, open(src, 'rb') as f:
+                shutil.copyfileobj(f, out, BLOCK_SIZE)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+    return path.stat().st_size
+
+
+@contextmanager
+def open_blob(blob_dir: Path, codec: ArchiveCodec, digest: str) -> Iterator[IO[bytes]]:
+    """Open a blob for reading its (decompressed) content"""
+    with open(blob_path(blob_dir, digest), 'rb') as raw, _blob_reader(raw, codec) as stream:
+        yield stream
+
+
+def extract_blob(blob_dir: Path, codec: ArchiveCodec, digest: str, target: Path):
+    """Write the content of a blob to target, streaming BLOCK_SIZE blocks"""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with open_blob(blob_dir, codec, digest) as stream, open(target, 'wb') as out:
+        shutil.copyfileobj(stream, out, BLOCK_SIZE)
+
+
+def store_blobs(blob_dir: Path, codec: ArchiveCodec, files: List[Path], known: Callable[[List[str]], Iterable[str]],
+                workers: Optional[int] = None) -> Tuple[Dict[Path, MemberDigest], Dict[str, int]]:
+    """Hash files and store the blobs that are not stored yet, in parallel threads
+
+    Args:
+        blob_dir: Blob store directory
+        codec: Codec for new blobs
+        files: Files to store
+        known: Given digests, returns those already in the store
+        workers: Number of threads (default: min(4, CPU count))
+
+    Returns:
+        ({file: digest}, {SHA-256 of each new blob: object file size})
+    """
+    workers = workers or min(4, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        hashes = dict(zip(files, executor.map(hash_file, files)))
+        # A registered blob whose object file has gone missing is written again
+        existing = {digest for digest in known(sorted({d.sha256 for d in hashes.values()}))
+                    if blob_path(blob_dir, digest).exists()}
+        new_sources: Dict[str, Path] = {}
+        for path, digest in hashes.items():
+            if digest.sha256 not in existing:
+                new_sources.setdefault(digest.sha256, path)
+        futures = {digest: executor.submit(write_blob, blob_dir, codec, path, digest)
+                   for digest, path in new_sources.items()}
+        stored = {digest: future.result() for digest, future in futures.items()}
+    return hashes, stored
+
+
+def extract_blobs(blob_dir: Path, refs: Dict[str, Tuple[Optional[str], Optional[str]]],
+                  targets: Dict[str, Path]) -> Dict[str, Optional[Exception]]:
+    """Write blobs to the given paths (counterpart of extract_members for the blob store)
+
+    Args:
+        blob_dir: Blob store directory
+        refs: Name -> (digest, codec spec of the blob)
+        targets: Name -> destination path
+
+    Returns:
+        Name -> None if extracted or the exception raised while writing it.
+        Names without a stored blob are not included.
+    """
+    results: Dict[str, Optional[Exception]] = {}
+    for name, (digest, codec_spec) in refs.items():
+        if digest is None or codec_spec is None or not blob_path(blob_dir, digest).exists():
+            continue
+        try:
+            extract_blob(blob_dir, parse_codec(codec_spec), digest, targets[name])
+            results[name] = None
+        except OSError as e:
+            results[name] = e
+    return results
+
+
+def _check_digest(expected: MemberDigest, actual: MemberDigest) -> Optional[str]:
+    if actual.size != expected.size:
+        return "size"
+    if actual.crc32 != expected.crc32:
+        return "crc"
+    if actual.sha256 != expected.sha256:
+        return "sha256"
+    return None
+
+
+def verify_archive(archive_path: Path, codec: ArchiveCodec, expected: Dict[str, MemberDigest],
+                   quick: bool = False) -> Dict[str, str]:
+    """Check an archive file against the recorded member digests without writing files
+
+    Args:
+        archive_path: Archive file
+        codec: Codec the archive was written with
+        expected: Name in the archive -> recorded digest
+        quick: zip: only compare size and CRC in the central directory;
+               tar: only compare sizes in the member headers
+
+    Returns:
+        Name -> problem ("missing", "size", "crc" or "sha256") for the members that do not match
+
+    Errors reading the archive itself are raised.
+    """
+    problems: Dict[str, str] = {}
+    if codec.container == "zip":
+        with zipfile.ZipFile(archive_path, 'r') as zipf:
+            for name, digest in expected.items():
+                try:
+                    info = zipf.getinfo(name)
+                except KeyError:
+                    problems[name] = "missing"
+                    continue
+                problem = _check_digest(digest, MemberDigest(digest.sha256, info.file_size, info.CRC))
+                if problem is None and not quick:
+                    try:
+                        with zipf.open(info) as stream:
+                            problem = _check_digest(digest, hash_stream(stream))
+                    except zipfile.BadZipFile:
+                        # zipfile checks the CRC at the end of the member
+                        problem = "crc"
+                if problem is not None:
+                    problems[name] = problem
+        return problems
+
+    seen = set()
+    with _open_tar(archive_path, codec) as tar:
+        for info in tar:
+            if info.name not in expected or not info.isfile():
+                continue
+            seen.add(info.name)
+            digest = expected[info.name]
+            if quick:
+                problem = "size" if info.size != digest.size else None
+            else:
+                problem = _check_digest(digest, hash_stream(tar.extractfile(info)))
+            if problem is not None:
+                problems[info.name] = problem
+    for name in expected:
+        if name not in seen:
+            problems[name] = "missing"
+    return problems
+
+
+def verify_blobs(blob_dir: Path, expected: Dict[str, Tuple[MemberDigest, Optional[str], Optional[int]]],
+                 quick: bool = False) -> Dict[str, str]:
+    """Check blobs against the recorded member digests (counterpart of verify_archive)
+
+    Args:
+        blob_dir: Blob store directory
+        expected: Name -> (recorded digest, codec spec of the blob, object file size)
+        quick: Only compare the object file sizes
+
+    Returns:
+        Name -> problem ("missing", "size", "crc" or "sha256") for the members that do not match
+    """
+    problems: Dict[str, str] = {}
+    for name, (digest, codec_spec, stored_size) in expected.items():
+        path = blob_path(blob_dir, digest.sha256)
+        if codec_spec is None or not path.exists():
+            problems[name] = "missing"
+            continue
+        if quick:
+            if path.stat().st_size != stored_size:
+                problems[name] = "size"
+            continue
+        with open_blob(blob_dir, parse_codec(codec_spec), digest.sha256) as stream:
+            problem = _check_digest(digest, hash_stream(stream))
+        if problem is not None:
+            problems[name] = problem
+    return problems
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Bank CSV Parser Specs
+=====================
+
+Deterministic column mapping for a bank's CSV export, stored per agent in
+agents.parser_spec (JSON). With a spec, journalize parses dates, amounts and
+descriptions locally and asks the LLM only for the categorization fields.
+
+Spec keys (column indexes are 0-based):
+  encoding     Source encoding (optional; detected when omitted)
+  delimiter    Field delimiter (default ",")
+  date         Date column, parsed with date_format (e.g. "%Y/%m/%d")
+  time         Time column, parsed with time_format (optional)
+  amount       Signed amount column, multiplied by sign (1 or -1; -1 for
+               card statements listing purchases as positive amounts)
+  debit        Withdrawal column (stored as negative)  } instead of amount
+  credit       Deposit column (stored as positive)     }
+  item         Columns joined into item_name
+  desc, memo   Columns joined into desc / memo (optional)
+  account      Account name of every row (optional; asked of the LLM when omitted)
+
+Lines whose date column does not parse (preamble, header, totals) are
+skipped, so no header row count is needed.
+
+Example (a Shift_JIS bank export "日付,摘要,お支払金額,お預り金額,残高"):
+  {"encoding": "cp932", "date": 0, "date_format": "%Y/%m/%d", "item": [1],
+   "debit": 2, "credit": 3, "account": "三井住友銀行"}
+"""
+
+import csv
+import json
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Union
+
+KEYS = {"encoding", "delimiter", "date", "date_format", "time", "time_format", "amount", "sign",
+        "debit", "credit", "item", "desc", "memo", "account"}
+
+
+class ParsedRow(NamedTuple):
+    """A transaction parsed from a CSV line"""
+    date: str
+    amount: Union[int, float]
+    item_name: str
+    desc: str
+    memo: str
+    account: Optional[str]
+
+
+def parse_amount(text: str) -> Optional[Union[int, float]]:
+    """Parse an amount such as "1,234", "¥1,234", "1234円", "-500", "△500" or "(500)"
+
+    Returns:
+        The amount (int if integral), or None if text is empty or not a number
+    """
+    text = text.strip().replace(",", "").replace("，", "").replace("¥", "").replace("￥", "").replace("円", "")
+    text = text.replace(" ", "").replace("　", "")
+    negative = False
+    if text[:1] in ("△", "▲", "-", "−"):
+        negative, text = True, text[1:]
+    elif text.startswith("(") and text.endswith(")"):
+        negative, text = True, text[1:-1]
+    if not re.fullmatch(r"\d+(\.\d+)?", text):
+        return None
+    value = float(text)
+    if value.is_integer():
+        value = int(value)
+    return -value if negative else value
+
+
+def _columns(value: Any, name: str) -> List[int]:
+    if value is None:
+        return []
+    columns = value if isinstance(value, list) else [value]
+    if not all(isinstance(col, int) and col >= 0 for col in columns):
+        raise ValueError(f"parser spec '{name}' must be a column index or a list of column indexes")
+    return columns
+
+
+class ParserSpec:
+    """A validated parser spec
+
+    Raises:
+        ValueError: Unknown keys, missing date/amount columns or bad formats
+    """
+
+    def __init__(self, spec: Dict[str, Any]):
+        unknown = set(spec) - KEYS
+        if unknown:
+            raise ValueError(f"unknown parser spec keys: {', '.join(sorted(unknown))}")
+        self.spec = spec
+        self.encoding: Optional[str] = spec.get("encoding") or None
+        self.delimiter: str = spec.get("delimiter") or ","
+        self.date = _columns(spec.get("date"), "date")
+        if len(self.date) != 1:
+            raise ValueError("parser spec needs one 'date' column")
+        self.date_format: str = spec.get("date_format") or "%Y/%m/%d"
+        self.time = _columns(spec.get("time"), "time")
+        self.time_format: str = spec.get("time_format") or "%H:%M"
+        self.amount = _columns(spec.get("amount"), "amount")
+        self.debit = _columns(spec.get("debit"), "debit")
+        self.credit = _columns(spec.get("credit"), "credit")
+        if not self.amount and not (self.debit or self.credit):
+            raise ValueError("parser spec needs an 'amount' column or 'debit'/'credit' columns")
+        self.sign = spec.get("sign", 1)
+        if self.sign not in (1, -1):
+            raise ValueError("parser spec 'sign' must be 1 or -1")
+        self.item = _columns(spec.get("item"), "item")
+        self.desc = _columns(spec.get("desc"), "desc")
+        self.memo = _columns(spec.get("memo"), "memo")
+        self.account: Optional[str] = spec.get("account") or None
+
+    @classmethod
+    def from_json(cls, text: str) -> "ParserSpec":
+        try:
+            spec = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"parser spec is not valid JSON: {e}")
+        if not isinstance(spec, dict):
+            raise ValueError("parser spec must be a JSON object")
+        return cls(spec)
+
+    def to_json(self) -> str:
+        return json.dumps(self.spec, ensure_ascii=False, sort_keys=True)
+
+    def _text(self, fields: List[str], columns: List[int]) -> str:
+        return " ".join(fields[col].strip() for col in columns if col < len(fields) and fields[col].strip())
+
+    def _amount(self, fields: List[str], columns: List[int]) -> Optional[Union[int, float]]:
+        for col in columns:
+            if col < len(fields):
+                value = parse_amount(fields[col])
+                if value is not None:
+                    return value
+        return None
+
+    def parse_fields(self, fields: List[str]) -> Optional[ParsedRow]:
+        """Parse the fields of one line (None if it is not a transaction line)"""
+        date_col = self.date[0]
+        if date_col >= len(fields):
+            return None
+        try:
+            date = datetime.strptime(fields[date_col].strip(), self.date_format)
+            if self.time and self.time[0] < len(fields) and fields[self.time[0]].strip():
+                time = datetime.strptime(fields[self.time[0]].strip(), self.time_format)
+                date = date.replace(hour=time.hour, minute=time.minute, second=time.second)
+        except ValueError:
+            return None
+
+        if self.amount:
+            amount = self._amount(fields, self.amount)
+            if amount is not None:
+                amount *= self.sign
+        else:
+            debit = self._amount(fields, self.debit)
+            credit = self._amount(fields, self.credit)
+            amount = None if debit is None and credit is None else (credit or 0) - (debit or 0)
+        if amount is None:
+            return None
+
+        return ParsedRow(date.strftime("%Y-%m-%d %H:%M:%S"), amount, self._text(fields, self.item),
+                         self._text(fields, self.desc), self._text(fields, self.memo), self.account)
+
+    def parse_lines(self, lines: Iterable[str]) -> List[ParsedRow]:
+        """Parse CSV lines, skipping lines that are not transactions"""
+        rows = []
+        for fields in csv.reader(lines, delimiter=self.delimiter):
+            row = self.parse_fields(fields)
+            if row is not None:
+                rows.append(row)
+        return rows
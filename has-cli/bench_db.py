@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+db_lib Benchmark Suite
+======================
+
+Times the DatabaseManager operations against a synthetic ledger
+(see synth_ledger.py) and writes the results as JSON so runs of different
+versions can be compared.
+
+Benchmarks: load_csv_file, rollback_csv_files, cmd_summary / cmd_summary_account /
+cmd_summary_category (day, month, year), cmd_pivot, cmd_balance, cmd_print_table,
+archive_csv and extract.
+
+All work happens on a copy of the database in a temporary directory, so the
+source database and the current directory are never modified.
+
+Usage:
+  python synth_ledger.py db ./bench_1m.sqlite --rows 1000000
+  python bench_db.py --db ./bench_1m.sqlite --out bench_v1.json
+  python bench_db.py --db ./bench_1m.sqlite --out bench_v2.json --compare bench_v1.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from rich.console import Console
+from rich.table import Table
+
+from db_lib import DatabaseManager
+import synth_ledger
+
+
+def git_version() -> Optional[str]:
+    """`git describe` of the source tree, or None outside a git checkout"""
+    try:
+        out = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=Path(__file__).resolve().parent,
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def result_rows(result: Any) -> Optional[int]:
+    """Number of rows/items in a db_lib return value ((err, rows), (msgs, n) or dict)"""
+    if isinstance(result, dict):
+        return result.get("transactions_inserted")
+    if isinstance(result, tuple) and len(result) == 2:
+        value = result[1]
+        if isinstance(value, int):
+            return value
+        if hasattr(value, "__len__"):
+            return len(value)
+    return None
+
+
+def check(result: Any) -> Any:
+    """Raise if a db_lib call reported failure, so broken benchmarks are not timed as fast ones"""
+    if isinstance(result, dict) and not result.get("success"):
+        raise RuntimeError(result.get("error"))
+    if isinstance(result, tuple) and len(result) == 2:
+        err, value = result
+        if value is None or (isinstance(err, str) and err):
+            raise RuntimeError(err)
+    return result
+
+
+class Bench:
+    """Collect timings of named benchmarks"""
+
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.results: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, name: str, elapsed: float, rows: Optional[int]):
+        entry = self.results.setdefault(name, {"name": name, "times": [], "rows": rows})
+        entry["times"].append(round(elapsed, 6))
+        if rows is not None:
+            entry["rows"] = rows
+
+    def run(self, name: str, func: Callable[[], Any]):
+        """Run func `repeat` times"""
+        for _ in range(self.repeat):
+            self.timed(name, func)
+
+    def timed(self, name: str, func: Callable[[], Any]) -> Any:
+        """Run func once and record its time"""
+        start = time.perf_counter()
+        result = check(func())
+        self.record(name, time.perf_counter() - start, result_rows(result))
+        return result
+
+    def summary(self) -> List[Dict[str, Any]]:
+        rows = []
+        for entry in self.results.values():
+            times = entry["times"]
+            rows.append(dict(entry, min=min(times), median=statistics.median(times), max=max(times)))
+        return rows
+
+
+def run_benchmarks(dm: DatabaseManager, bench: Bench, csv_paths: List[Path], print_limit: int, balance_date: str):
+    """Run all benchmarks on a connected DatabaseManager"""
+    for period in ["day", "month", "year"]:
+        bench.run(f"cmd_summary {period}", lambda: dm.cmd_summary(period, None, None))
+        bench.run(f"cmd_summary_account {period}", lambda: dm.cmd_summary_account(period, None, balance_date))
+        bench.run(f"cmd_summary_category {period}", lambda: dm.cmd_summary_category(period, None, balance_date))
+    bench.run("cmd_pivot category month", lambda: dm.cmd_pivot("category", "month", "total", 12, balance_date))
+    bench.run("cmd_balance", lambda: dm.cmd_balance(balance_date))
+    bench.run(f"cmd_print_table transactions {print_limit}", lambda: dm.cmd_print_table("transactions", print_limit))
+
+    # Register the generated CSV files once, then load/rollback and archive/extract them repeatedly
+    csvfile_ids = []
+    for path in csv_paths:
+        _, csvfile_id = dm.register_csvfile(str(path), "bench")
+        if csvfile_id is None:
+            raise RuntimeError(f"register_csvfile failed: {path}")
+        csvfile_ids.append(csvfile_id)
+
+    for _ in range(bench.repeat):
+        loaded = 0
+        start = time.perf_counter()
+        for csvfile_id in csvfile_ids:
+            loaded += check(dm.load_csv_file(csvfile_id))["transactions_inserted"]
+        bench.record("load_csv_file", time.perf_counter() - start, loaded)
+
+        start = time.perf_counter()
+        for csvfile_id in csvfile_ids:
+            check(dm.rollback_csv_files(csvfile_id))
+        bench.record("rollback_csv_files", time.perf_counter() - start, len(csvfile_ids))
+
+        start = time.perf_counter()
+        _, archive_id = check(dm.archive_csv(csvfile_ids))
+        bench.record("archive_csv", time.perf_counter() - start, len(csvfile_ids))
+        bench.timed("extract", lambda: dm.extract(archive_id))
+
+
+def print_results(console: Console, rows: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]]):
+    """Print the results (with the ratio to the baseline run if given)"""
+    base = {r["name"]: r for r in baseline["results"]} if baseline else {}
+    table = Table(title="db_lib benchmark")
+    table.add_column("benchmark", style="cyan")
+    table.add_column("rows", justify="right")
+    table.add_column("min (ms)", justify="right", style="green")
+    table.add_column("median (ms)", justify="right", style="green")
+    if baseline:
+        table.add_column(f"vs {baseline.get('version') or 'baseline'}", justify="right")
+    for row in rows:
+        cells = [row["name"], f"{row['rows']:,}" if row["rows"] is not None else "-",
+                 f"{row['min'] * 1000:,.1f}", f"{row['median'] * 1000:,.1f}"]
+        if baseline:
+            old = base.get(row["name"])
+            if old and old["median"] > 0:
+                ratio = row["median"] / old["median"]
+                style = "red" if ratio > 1.1 else "green" if ratio < 0.9 else ""
+                cells.append(f"[{style}]{ratio:.2f}x[/{style}]" if style else f"{ratio:.2f}x")
+            else:
+                cells.append("-")
+        table.add_row(*cells)
+    console.print(table)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='db_lib のベンチマーク (結果をJSONで出力)')
+    parser.add_argument('--db', type=str, help='synth_ledger.py で生成したDB (省略時は --rows で生成)')
+    parser.add_argument('--rows', type=int, default=100000, help='--db 省略時に生成する取引行数 (デフォルト: 100000)')
+    parser.add_argument('--load-rows', type=int, default=10000, help='load_csv/archive に使うCSVの行数 (デフォルト: 10000)')
+    parser.add_argument('--print-limit', type=int, default=100000, help='cmd_print_table のLIMIT (デフォルト: 100000)')
+    parser.add_argument('--repeat', type=int, default=3, help='各ベンチマークの繰り返し回数 (デフォルト: 3)')
+    parser.add_argument('--out', type=str, default='bench_results.json', help='結果のJSONファイル (デフォルト: bench_results.json)')
+    parser.add_argument('--compare', type=str, help='比較する以前の結果のJSONファイル')
+    parser.add_argument('--codec', type=str, default='deflate', help='archive_csv の圧縮形式 (deflate[:N]/store/xz[:N]/zstd[:N])')
+    parser.add_argument('--store', choices=['file', 'blob'], default='file', help='archive_csv の保存先 (デフォルト: file)')
+    parser.add_argument('--ddl-dir', type=str, default=str(synth_ledger.DEFAULT_DDL_DIR), help='DDLディレクトリ')
+    args = parser.parse_args(argv)
+
+    console = Console()
+    out_path = Path(args.out).resolve()
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    cwd = os.getcwd()
+    workdir = Path(tempfile.mkdtemp(prefix="has_bench_"))
+    try:
+        db_path = workdir / "bench.sqlite"
+        accounts, categories, tags = synth_ledger.make_master(8, 16, 10)
+        if args.db:
+            shutil.copyfile(args.db, db_path)
+        else:
+            console.print(f"[cyan]合成DBを生成中 ({args.rows:,} 行)...[/cyan]")
+            rows = synth_ledger.generate_rows(args.rows, accounts, categories, tags,
+                                              start=datetime(2015, 1, 1), days=3650)
+            synth_ledger.build_database(db_path, Path(args.ddl_dir), rows, accounts, categories, tags)
+
+        with sqlite3.connect(db_path) as conn:
+            counts = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                      for t in ["transactions", "accounts", "categories", "tags", "transfers", "csvfiles"]}
+            last_date = conn.execute("SELECT MAX(transaction_date) FROM transactions").fetchone()[0]
+        balance_date = (last_date or datetime.now().strftime("%Y-%m-%d"))[:10]
+
+        # CSV files for load/rollback/archive/extract, dated after the existing ledger
+        csv_rows = synth_ledger.generate_rows(args.load_rows, accounts, categories, tags,
+                                              start=datetime.strptime(balance_date, "%Y-%m-%d"), days=90, seed=2)
+        csv_paths = synth_ledger.write_csv_files(workdir / "csv", csv_rows, prefix="bench")
+
+        # archive_csv writes to data/arch relative to the current directory
+        os.chdir(workdir)
+        dm = DatabaseManager(str(db_path), "{id}_{time}.zip", args.codec, archive_store=args.store)
+        err = dm.connect()
+        if err is not None:
+            console.print(err)
+            return 1
+        bench = Bench(args.repeat)
+        console.print(f"[cyan]ベンチマーク実行中 ({counts['transactions']:,} 取引, 繰り返し {args.repeat} 回)...[/cyan]")
+        try:
+            run_benchmarks(dm, bench, csv_paths, args.print_limit, balance_date)
+        finally:
+            dm.disconnect()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = bench.summary()
+    report = {
+        "version": git_version(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "params": {"db": args.db, "rows": args.rows, "load_rows": args.load_rows,
+                   "print_limit": args.print_limit, "repeat": args.repeat, "codec": args.codec, "store": args.store},
+        "counts": counts,
+        "results": results,
+    }
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print_results(console, results, baseline)
+    console.print(f"[green]結果を保存しました: {out_path}[/green]")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Category Classifier
+===================
+
+Local classifier for journalize, trained on the ledger (`train_classifier`
+command). It predicts the (type, category, transfer account, tags) of a
+parsed row from its item name / description and the sign of the amount; rows
+predicted with a confidence at or above the threshold skip the LLM. The tags
+are part of the label, so a payee whose rows are tagged inconsistently gets
+a low confidence and goes to the LLM instead of losing its tags.
+
+Model: multinomial naive Bayes over character n-grams (1-3) of the
+NFKC-normalized text, with binary (per row) counts and the amount sign as an
+extra feature. Short, noisy bank descriptions ("ｾﾌﾞﾝｲﾚﾌﾞﾝ 123店") are handled
+well by character n-grams, and training on tens of thousands of rows takes a
+second on a CPU. The model is saved as JSON (no pickle).
+
+The confidence is the posterior probability of the predicted label. Naive
+Bayes posteriors are overconfident, so the threshold should be chosen from
+the held-out bypass rate / accuracy reported by `train_classifier`.
+"""
+
+import json
+import math
+import os
+import re
+import tempfile
+import unicodedata
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+DEFAULT_MODEL_FILE = "./data/classifier.json"
+DEFAULT_THRESHOLD = 0.9
+
+MODEL_VERSION = 2
+NGRAM_MAX = 3
+ALPHA = 0.1
+
+# Every HOLDOUT_MOD-th row is held out for evaluation (recurring payees appear
+# on both sides, as they do between the ledger and a new statement)
+HOLDOUT_MOD = 5
+
+
+class Label(NamedTuple):
+    """A journalize categorization"""
+    type: str
+    category: str
+    transfer: Optional[str]
+    # Tag names joined with "|" in name order (the tags column of the journalized CSV)
+    tags: str = ""
+
+
+class Sample(NamedTuple):
+    """A labeled ledger row"""
+    text: str
+    amount: float
+    label: Label
+
+
+class Evaluation(NamedTuple):
+    """Held-out evaluation of a model"""
+    samples: int
+    accuracy: Optional[float]
+    bypass_rate: Optional[float]
+    bypass_accuracy: Optional[float]
+
+
+def model_file(classifier_config: Mapping[str, str]) -> Path:
+    """Return the model file path for a [classifier] section"""
+    return Path(classifier_config.get('model_file') or DEFAULT_MODEL_FILE)
+
+
+def threshold(classifier_config: Mapping[str, str]) -> float:
+    """Return the confidence threshold for a [classifier] section"""
+    return float(classifier_config.get('threshold') or DEFAULT_THRESHOLD)
+
+
+def features(text: str, amount: float) -> List[str]:
+    """Distinct features of a row (character n-grams and the amount sign)"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    # Store numbers, dates and card digits vary between rows of the same payee
+    text = re.sub(r"\d+", "0", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    grams = {"sign:" + ("+" if amount > 0 else "-")}
+    padded = f" {text} "
+    for n in range(1, NGRAM_MAX + 1):
+        for i in range(len(padded) - n + 1):
+            gram = padded[i:i + n]
+            if gram.strip():
+                grams.add(gram)
+    return sorted(grams)
+
+
+class NaiveBayesClassifier:
+    """Multinomial naive Bayes over character n-grams"""
+
+    def __init__(self):
+        self.labels: List[Label] = []
+        self.doc_counts: List[int] = []
+        self.feature_counts: List[Dict[str, int]] = []
+        self.totals: List[int] = []
+        self.vocabulary: set = set()
+
+    def fit(self, samples: Iterable[Sample]) -> "NaiveBayesClassifier":
+        index: Dict[Label, int] = {}
+        for sample in samples:
+            if sample.label not in index:
+                index[sample.label] = len(self.labels)
+                self.labels.append(sample.label)
+                self.doc_counts.append(0)
+                self.feature_counts.append({})
+                self.totals.append(0)
+            k = index[sample.label]
+            self.doc_counts[k] += 1
+            counts = self.feature_counts[k]
+            for feature in features(sample.text, sample.amount):
+                counts[feature] = counts.get(feature, 0) + 1
+                self.totals[k] += 1
+                self.vocabulary.add(feature)
+        return self
+
+    def predict(self, text: str, amount: float) -> Tuple[Optional[Label], float]:
+        """Predict the label of a row
+
+        Returns:
+            (label, posterior probability); (None, 0.0) for an empty model
+        """
+        if not self.labels:
+            return None, 0.0
+        # Features never seen in training carry no information
+        row = [f for f in features(text, amount) if f in self.vocabulary]
+        n_docs = sum(self.doc_counts)
+        vocab = len(self.vocabulary)
+        scores = []
+        for k in range(len(self.labels)):
+            counts = self.feature_counts[k]
+            denom = math.log(self.totals[k] + ALPHA * vocab)
+            score = math.log(self.doc_counts[k] / n_docs)
+            for feature in row:
+                score += math.log(counts.get(feature, 0) + ALPHA) - denom
+            scores.append(score)
+        best = max(range(len(scores)), key=scores.__getitem__)
+        total = sum(math.exp(score - scores[best]) for score in scores)
+        return self.labels[best], 1.0 / total
+
+    def evaluate(self, samples: List[Sample], min_confidence: float) -> Evaluation:
+        """Accuracy, and the share / accuracy of rows at or above min_confidence"""
+        if not samples:
+            return Evaluation(0, None, None, None)
+        correct = bypassed = bypassed_correct = 0
+        for sample in samples:
+            label, confidence = self.predict(sample.text, sample.amount)
+            hit = label == sample.label
+            correct += hit
+            if confidence >= min_confidence:
+                bypassed += 1
+                bypassed_correct += hit
+        return Evaluation(len(samples), correct / len(samples), bypassed / len(samples),
+                          bypassed_correct / bypassed if bypassed else None)
+
+    def save(self, path: Path):
+        """Write the model as JSON (atomically)"""
+        model = {
+            "version": MODEL_VERSION,
+            "labels": [list(label) for label in self.labels],
+            "doc_counts": self.doc_counts,
+            "feature_counts": self.feature_counts,
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(prefix=f"{path.name}.", suffix=".tmp", dir=path.parent)
+        try:
+            with open(fd, 'w', encoding='utf-8') as f:
+                json.dump(model, f, ensure_ascii=False)
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+    @classmethod
+    def load(cls, path: Path) -> "NaiveBayesClassifier":
+        """Read a model written by save
+
+        Raises:
+            ValueError: Not a model of this version
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            model = json.load(f)
+        if not isinstance(model, dict) or model.get("version") != MODEL_VERSION:
+            raise ValueError(f"unsupported classifier model: {path}")
+        clf = cls()
+        clf.labels = [Label(*label) for label in model["labels"]]
+        clf.doc_counts = model["doc_counts"]
+        clf.feature_counts = model["feature_counts"]
+        clf.totals = [sum(counts.values()) for counts in clf.feature_counts]
+        clf.vocabulary = {feature for counts in clf.feature_counts for feature in counts}
+        return clf
+
+
+def train(samples: List[Sample], min_confidence: float) -> Tuple[NaiveBayesClassifier, Evaluation]:
+    """Train on all samples, evaluating on a held-out split first
+
+    Returns:
+        (model trained on all samples, evaluation of a model trained without the held-out rows)
+    """
+    held_out = samples[::HOLDOUT_MOD]
+    trained = [sample for i, sample in enumerate(samples) if i % HOLDOUT_MOD]
+    evaluation = NaiveBayesClassifier().fit(trained).evaluate(held_out, min_confidence)
+    return NaiveBayesClassifier().fit(samples), evaluation
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+has-cli デーモンモード
+======================
+
+`has-cli --serve` で HasCLI インスタンス（DB接続・SQLキャッシュ・仕訳エージェント）を
+常駐させ、Unixソケット経由で `-c` のコマンドを受け付ける。
+クライアント側はこのモジュールの forward_command のみを使用するため、
+デーモン起動中は設定読み込みやDB接続・LLMクライアントの生成を省略できる。
+
+プロトコル（1接続1コマンド、JSON Lines）:
+  client -> server: {"command": "...", "width": 120, "color": true, "format": "table",
+                     "cwd": "/path", "config": "/path/config.ini", "database": "/path/db.sqlite"}
+                    または {"stop": true}
+
+クライアントの作業ディレクトリ (cwd) はコマンド中の相対パスの解決に使う。
+設定ファイルまたはDBがデーモンと異なる要求は実行せずにエラーを返す。
+  server -> client: {"out": "..."} を0回以上、最後に {"exit": 0|1}
+"""
+
+import configparser
+import json
+import os
+import shutil
+import socket
+import socketserver
+import sys
+from pathlib import Path
+from typing import Any, Optional
+
+DEFAULT_SOCKET_PATH = "~/.has_cli.sock"
+
+
+def socket_path_from_config(config_path_str: str) -> str:
+    """設定ファイルからデーモンのソケットパスを取得
+
+    Args:
+        config_path_str: 設定ファイルのパス
+
+    Returns:
+        ソケットファイルのパス ([server] socket、未設定時は ~/.has_cli.sock)
+    """
+    config = configparser.ConfigParser()
+    config.read(config_path_str)
+    return str(Path(config.get("server", "socket", fallback=DEFAULT_SOCKET_PATH)).expanduser())
+
+
+def database_path_from_config(config_path_str: str) -> Optional[str]:
+    """設定ファイルのDBパスを現在の作業ディレクトリ基準の絶対パスで取得
+
+    Args:
+        config_path_str: 設定ファイルのパス
+
+    Returns:
+        DBファイルの絶対パス ([database] database が未設定の場合はNone)
+    """
+    config = configparser.ConfigParser()
+    config.read(config_path_str)
+    database = config.get("database", "database", fallback=None)
+    return os.path.realpath(database) if database else None
+
+
+def _connect(socket_path: str) -> Optional[socket.socket]:
+    """デーモンへ接続。起動していない場合はNone"""
+    if not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        sock.close()
+        return None
+    return sock
+
+
+def forward_command(socket_path: str, command: str, output_format: str = "table",
+                    config_path_str: str = "config.ini") -> Optional[bool]:
+    """コマンドをデーモンへ転送し、出力をそのまま標準出力へ書き出す
+
+    Args:
+        socket_path: ソケットファイルのパス
+        command: 実行するコマンド文字列
+        output_format: 表示形式 (table/tsv/csv/json)
+        config_path_str: クライアントの設定ファイルのパス (デーモンと同じDBかの確認に使う)
+
+    Returns:
+        コマンドの成否。デーモンが起動していない場合はNone
+    """
+    sock = _connect(socket_path)
+    if sock is None:
+        return None
+
+    request = {
+        "command": command,
+        "width": shutil.get_terminal_size().columns,
+        "color": sys.stdout.isatty(),
+        "format": output_format,
+        "cwd": os.getcwd(),
+        "config": os.path.realpath(config_path_str),
+        "database": database_path_from_config(config_path_str),
+    }
+    with sock, sock.makefile("rwb") as stream:
+        stream.write((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if "out" in message:
+                sys.stdout.write(message["out"])
+                sys.stdout.flush()
+            elif "exit" in message:
+                return message["exit"] == 0
+    # 応答の途中で切断された場合
+    return False
+
+
+def stop_server(socket_path: str) -> bool:
+    """デーモンへ停止要求を送信
+
+    Returns:
+        停止要求を送信できた場合True
+    """
+    sock = _connect(socket_path)
+    if sock is None:
+        return False
+    with sock:
+        sock.sendall(b'{"stop": true}\n')
+        sock.recv(64)
+    return True
+
+
+class _StreamWriter:
+    """rich.Consoleの出力先。書き込みを {"out": ...} メッセージとしてクライアントへ送る
+
+    クライアントが切断した後の出力は捨てる (rich は BrokenPipeError で SystemExit を送出し、
+    デーモンごと終了してしまうため)。
+    """
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.closed = False
+
+    def write(self, text: str) -> int:
+        if text and not self.closed:
+            try:
+                self.wfile.write((json.dumps({"out": text}, ensure_ascii=False) + "\n").encode("utf-8"))
+            except (BrokenPipeError, ConnectionResetError):
+                self.closed = True
+        return len(text)
+
+    def flush(self):
+        if self.closed:
+            return
+        try:
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.closed = True
+
+    def write_exit(self, code: int):
+        """終了コードのメッセージを送る"""
+        if self.closed:
+            return
+        try:
+            self.wfile.write((json.dumps({"exit": code}) + "\n").encode("utf-8"))
+        except (BrokenPipeError, ConnectionResetError):
+            self.closed = True
+
+    def isatty(self) -> bool:
+        return False
+
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+    """1接続につき1コマンドを実行するハンドラ"""
+
+    def handle(self):
+        from rich.console import Console
+
+        line = self.rfile.readline()
+        if not line:
+            return
+        request = json.loads(line)
+        server: Any = self.server
+
+        if request.get("stop"):
+            self.wfile.write(b'{"exit": 0}\n')
+            server.stop_requested = True
+            return
+
+        cli = server.cli
+        writer = _StreamWriter(self.wfile)
+        color = bool(request.get("color"))
+        console = Console(file=writer, width=request.get("width") or 120,
+                          force_terminal=color, color_system="256" if color else None)
+
+        # 別の設定ファイル・DBを使うクライアントのコマンドを、このデーモンのDBで実行しない
+        if request.get("config") != server.config_path or request.get("database") != server.database:
+            console.print(f"[red]エラー: デーモンの設定ファイル・DBと異なります "
+                          f"(デーモン: {server.config_path}, {server.database} / "
+                          f"要求: {request.get('config')}, {request.get('database')})[/red]")
+            console.print("[yellow]--no-daemon で実行するか、\\[server] socket に別のソケットを指定してください[/yellow]")
+            writer.write_exit(1)
+            return
+
+        saved_console, saved_format, saved_cwd = cli.console, cli.output_format, cli.cwd
+        cli.console = console
+        cli.output_format = request.get("format") or saved_format
+        cli.cwd = request.get("cwd")
+        try:
+            success = cli.execute_command(request.get("command", ""))
+        except Exception as e:
+            cli.console.print(f"[red]エラー: {e}[/red]")
+            success = False
+        finally:
+            cli.console, cli.output_format, cli.cwd = saved_console, saved_format, saved_cwd
+        writer.write_exit(0 if success else 1)
+
+
+class _UnixServer(socketserver.UnixStreamServer):
+    """HasCLIインスタンスを保持するUnixソケットサーバ（コマンドは1つずつ順に実行）"""
+
+    def __init__(self, socket_path: str, cli, config_path: str, database: Optional[str]):
+        self.cli = cli
+        self.config_path = config_path
+        self.database = database
+        self.stop_requested = False
+        super().__init__(socket_path, _CommandHandler)
+
+    def service_actions(self):
+        if self.stop_requested:
+            # serve_forever のループ内から shutdown() を呼ぶとデッドロックするため例外で抜ける
+            raise KeyboardInterrupt
+
+
+def serve(cli, socket_path: str, config_path_str: str) -> int:
+    """HasCLIを常駐させてコマンドを受け付ける
+
+    Args:
+        cli: DBに接続済みのHasCLIインスタンス
+        socket_path: ソケットファイルのパス
+        config_path_str: デーモンの設定ファイルのパス
+
+    Returns:
+        終了コード
+    """
+    if os.path.exists(socket_path):
+        sock = _connect(socket_path)
+        if sock is not None:
+            sock.close()
+            cli.console.print(f"[red]エラー: デーモンは既に起動しています: {socket_path}[/red]")
+            return 1
+        # 前回の異常終了で残ったソケットファイル
+        os.unlink(socket_path)
+
+    Path(socket_path).parent.mkdir(parents=True, exist_ok=True)
+    server = _UnixServer(socket_path, cli, os.path.realpath(config_path_str),
+                         database_path_from_config(config_path_str))
+    os.chmod(socket_path, 0o600)
+    cli.console.print(f"[cyan]デーモンを起動しました: {socket_path} (終了: Ctrl-C または --stop)[/cyan]")
+    try:
+        server.serve_forever(poll_interval=0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        cli.finish_jobs()
+        cli.console.print("[cyan]デーモンを終了しました[/cyan]")
+    return 0
@@ -1,15 +1,39 @@
 
 import sqlite3
 import csv
+import io
 from pathlib import Path
-import zipfile
 import os
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import datetime
 from datetime import datetime
 
-from typing import Tuple, List, Dict,Optional
+from typing import IO, Callable, ContextManager, Tuple, List, Dict,Optional,Any
+
+import archive_codec
+import transfer_match
+
+
+# pivotコマンドで指定できる集計軸と集計値
+PIVOT_DIMENSIONS = {
+    "category": "COALESCE(c.name, '（未分類）')",
+    "type": "COALESCE(c.type, '（未分類）')",
+    "account": "a.name",
+    "day": "DATE(t.transaction_date)",
+    "month": "strftime('%Y-%m', t.transaction_date)",
+    "year": "strftime('%Y', t.transaction_date)",
+}
+PIVOT_MEASURES = {
+    "expense": "SUM(CASE WHEN t.amount < 0 AND t.transfer_id is null THEN t.amount ELSE 0 END)",
+    "income": "SUM(CASE WHEN t.amount > 0 AND t.transfer_id is null THEN t.amount ELSE 0 END)",
+    "total": "SUM(CASE WHEN t.transfer_id is null THEN t.amount ELSE 0 END)",
+    "transfer": "SUM(CASE WHEN t.transfer_id is not null THEN t.amount ELSE 0 END)",
+    "balance": "SUM(t.amount)",
+    "count": "COUNT(t.id)",
+}
 
 
 class transferNameClass:
@@ -79,6 +103,18 @@ class db_loader:
     def do_disconnect(self,conn: sqlite3.Connection) -> None:
         conn.close()
 
+    def do_begin(self, cursor: sqlite3.Cursor) -> None:
+        """Begin a transaction."""
+        cursor.execute("BEGIN TRANSACTION")
+
+    def do_commit(self, conn: sqlite3.Connection) -> None:
+        """Commit the current transaction."""
+        conn.commit()
+
+    def do_rollback(self, conn: sqlite3.Connection) -> None:
+        """Roll back the current transaction."""
+        conn.rollback()
+
     def get_csv_filename(self, csvfile_id: int) -> Optional[str]:
         """Get the filename of a CSV file by its ID."""
         conn = self.get_connect()
@@ -95,6 +131,64 @@ class db_loader:
         else:
             return None
 
+    def csvfile_source(self, csvfile_id: int, original: bool = False) -> Tuple[Optional[str], Optional[Tuple[str, Callable[[], ContextManager[IO[bytes]]]]]]:
+        """Locate the content of a CSV file, on disk or in its archive.
+
+        Archived files are read straight from the archive member (or blob), so
+        reprocessing them neither extracts files nor modifies the archive.
+
+        Args:
+            csvfile_id: The ID of the CSV file
+            original: The original file (org_name) instead of the journalized CSV
+
+        Returns:
+            Tuple of (error message or None, (path, opener) or None); opener()
+            is a context manager yielding a binary stream of the content
+        """
+        conn = self.get_connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT c.name, c.org_name, c.archive_id, a.filename, a.codec,
+                       c.blob_hash, b.codec, c.org_blob_hash, o.codec
+                FROM csvfiles c
+                LEFT JOIN archives a ON a.id = c.archive_id
+                LEFT JOIN blobs b ON b.hash = c.blob_hash
+                LEFT JOIN blobs o ON o.hash = c.org_blob_hash
+                WHERE c.id = ?
+            """, (csvfile_id,))
+            result = cursor.fetchone()
+        finally:
+            cursor.close()
+            self.do_disconnect(conn)
+        if not result:
+            return f"CSV file not found for ID: {csvfile_id}", None
+
+        name, org_name, archive_id, archive_filename, archive_codec_spec = result[:5]
+        path_str = org_name if original else name
+        if not path_str:
+            return f"No original file recorded for CSV file ID: {csvfile_id}", None
+        if archive_id is None:
+            if not Path(path_str).exists():
+                return f"File not found: {path_str}", None
+            return None, (path_str, lambda: open(path_str, 'rb'))
+
+        archive_path = Path(archive_filename)
+        if archive_codec_spec == "blob":
+            digest, blob_codec_spec = result[7:9] if original else result[5:7]
+            if digest is None or blob_codec_spec is None:
+                return f"File is not in archive {archive_id}: {path_str}", None
+            if not archive_codec.blob_path(archive_path, digest).exists():
+                return f"Blob not found: {archive_codec.blob_path(archive_path, digest)}", None
+            blob_codec = archive_codec.parse_codec(blob_codec_spec)
+            return None, (path_str, lambda: archive_codec.open_blob(archive_path, blob_codec, digest))
+
+        if not archive_path.exists():
+            return f"Archive file not found: {archive_path}", None
+        codec = archive_codec.parse_codec(archive_codec_spec)
+        arcname = f"org_{csvfile_id}_{Path(path_str).name}" if original else Path(path_str).name
+        return None, (path_str, lambda: archive_codec.open_member(archive_path, codec, arcname))
+
     def insert_record(self, table_name: str, data: dict) -> Optional[int]:
         """Insert a record into the specified table.
         
@@ -113,11 +207,11 @@ class db_loader:
         
             sql = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
             cursor.execute(sql, tuple(data.values()))
-            conn.commit()
+            self.do_commit(conn)
             last_row_id = cursor.lastrowid
             return last_row_id
         except Exception as e:
-            conn.rollback()
+            self.do_rollback(conn)
             raise e
         finally:
             cursor.close()
@@ -138,11 +232,11 @@ class db_loader:
         if not csv_filename:
             return {"success": False, "error": f"CSV file not found for ID: {csvfile_id}"}
 
-        #csv_path = Path("data/csv") / csv_filename
-        csv_path = Path(csv_filename)
-
-        if not csv_path.exists():
-            return {"success": False, "error": f"File not found: {csv_filename}"}
+        # Archived files are streamed from the archive without extracting them
+        err, source = self.csvfile_source(csvfile_id)
+        if source is None:
+            return {"success": False, "error": err}
+        _, open_source = source
         
         # Parse collector and date from filename
         conn = self.get_connect()
@@ -154,7 +248,7 @@ class db_loader:
         try:
             
             # Begin transaction
-            cursor.execute("BEGIN TRANSACTION")
+            self.do_begin(cursor)
                 
             # Insert into data_logs
             log_data = {
@@ -168,7 +262,7 @@ class db_loader:
             transactions_inserted = 0
             tags_inserted = 0
                 
-            with open(csv_path, 'r', encoding='utf-8') as csvfile:
+            with open_source() as raw, io.TextIOWrapper(raw, encoding='utf-8', newline='') as csvfile:
                 reader = csv.reader(csvfile)
                 _ = next(reader)  # Skip header row
 
@@ -211,7 +305,7 @@ class db_loader:
                             return local_result[0]
                         else:
                             account_data = {
-                                "name": account_name,
+                                "name": local_account_name,
                                 "account_type": "その他"  # Default type
                             }
                             return insert_record_withCur_notCommit(cursor, "accounts", account_data)
@@ -242,12 +336,13 @@ class db_loader:
                         
                     tnc.estimate(tnc_date)
 
-                    def insert_transaction_data(aid, tid,  amnt):
+                    def insert_transaction_data(aid, tid,  amnt, ref_id=None):
                         """Helper function to insert transaction data."""
                         transaction_data = {
                             "account_id": aid,
                             "category_id": category_id,
                             "log_id": log_id,
+                            "ref_transaction_id": ref_id,
                             "transfer_id": tid,
                             "amount": amnt,
                             "item_name": item_name,
@@ -285,7 +380,10 @@ class db_loader:
                         transaction_id = insert_transaction_data(account_id, transfer_id, amount)
                         tags_inserted += insert_tag_data(tags, transaction_id)
 
-                        transfer_transaction_id = insert_transaction_data(transfer_account_id, transfer_id, - amount)
+                        # The counter-leg is inferred (ref_transaction_id = the real row) until
+                        # match_transfers links the row of the other account's statement instead
+                        transfer_transaction_id = insert_transaction_data(transfer_account_id, transfer_id, - amount,
+                                                                          transaction_id)
                         tags_inserted += insert_tag_data(tags, transfer_transaction_id)
                         transactions_inserted += 2
                         tnc.count_up()
@@ -301,7 +399,7 @@ class db_loader:
                            (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), csvfile_id))
             
             # Commit the transaction
-            conn.commit()
+            self.do_commit(conn)
                 
             return {
                 "success": True, 
@@ -311,13 +409,89 @@ class db_loader:
                 "filename": csv_filename
             }
         except Exception as e:
-            conn.rollback()
+            self.do_rollback(conn)
             print(f"Error occurred after processing {valid_count} valid rows: {e}")
             return {"success": False, "error": str(e)}
         finally:
             cursor.close()
             self.do_disconnect(conn)
 
+    def match_transfers(self, window_days: float = transfer_match.DEFAULT_WINDOW_DAYS
+                        ) -> Tuple[Optional[str], Optional[transfer_match.MatchResult]]:
+        """Link inferred transfer legs to the rows of the other account's statement.
+
+        Each inferred counter-leg (ref_transaction_id set by load_csv_file) that
+        matches exactly one real row of its account (see transfer_match.py) is
+        deleted, and the real row joins its transfer. If the real row was
+        inferred as a transfer from its own statement, its inferred leg is
+        deleted too. The real row's category and transfer before the match are
+        kept in transfer_matches, for rollback_csv_files.
+
+        Args:
+            window_days (float): Maximum distance between the dates of the two legs.
+
+        Returns:
+            Tuple of (error message or None, match result)
+        """
+        leg_columns = """t.id, t.account_id, t.amount, julianday(t.transaction_date), t.category_id,
+               t.transfer_id, o.id, o.account_id"""
+        # Inferred legs, with the real row they were inferred from. "> 0" (rather than IS NOT NULL)
+        # lets SQLite read them through idx_transactions_ref_transaction_id; sorting the few
+        # inferred legs is cheaper than walking the whole table in index order.
+        inferred_query = f"""
+        SELECT {leg_columns}
+        FROM transactions t
+        JOIN transactions o ON o.id = t.ref_transaction_id
+        WHERE t.ref_transaction_id > 0
+        ORDER BY +t.account_id, t.amount, t.transaction_date
+        """
+        # Real rows with the account and amount of an inferred leg (idx_transactions_account_amount_date)
+        # that are not linked yet, with their own inferred leg if any
+        real_query = f"""
+        SELECT {leg_columns}
+        FROM transactions f
+        CROSS JOIN transactions t ON t.account_id = f.account_id AND t.amount = f.amount
+        LEFT JOIN transactions o ON o.ref_transaction_id = t.id
+        WHERE f.ref_transaction_id > 0
+          AND t.ref_transaction_id IS NULL
+          AND (t.transfer_id IS NULL OR o.id IS NOT NULL)
+        GROUP BY t.id
+        ORDER BY t.account_id, t.amount, t.transaction_date
+        """
+        conn = self.get_connect()
+        cursor = conn.cursor()
+        try:
+            inferred = [transfer_match.Leg(*row) for row in cursor.execute(inferred_query)]
+            real = [transfer_match.Leg(*row) for row in cursor.execute(real_query)]
+            result = transfer_match.match(inferred, real, window_days)
+
+            self.do_begin(cursor)
+            dropped = [(leg.id,) for leg, _ in result.pairs]
+            dropped += [(row.counter_id,) for _, row in result.pairs if row.counter_id is not None]
+            cursor.executemany("DELETE FROM transaction_tags WHERE transaction_id = ?", dropped)
+            cursor.executemany("DELETE FROM transactions WHERE id = ?", dropped)
+            cursor.executemany(
+                """INSERT INTO transfer_matches (transaction_id, partner_id, transfer_id,
+                                                 original_category_id, original_transfer_id)
+                VALUES (?, ?, ?, ?, ?)""",
+                [(row.id, leg.counter_id, leg.transfer_id, row.category_id, row.transfer_id)
+                 for leg, row in result.pairs])
+            # A row loaded as an expense/income becomes a transfer with the inferred leg's category
+            # (the row's own transfers record is kept for rollback)
+            cursor.executemany(
+                """UPDATE transactions
+                SET transfer_id = ?, category_id = CASE WHEN transfer_id IS NULL THEN ? ELSE category_id END
+                WHERE id = ?""",
+                [(leg.transfer_id, leg.category_id, row.id) for leg, row in result.pairs])
+            self.do_commit(conn)
+            return None, result
+        except Exception as e:
+            self.do_rollback(conn)
+            return str(e), None
+        finally:
+            cursor.close()
+            self.do_disconnect(conn)
+
     def register_agent(self, agent_name: str, prompt: Optional[str]) -> Tuple[str, Optional[int]]:
         """Register a new agent if it doesn't exist.
 
@@ -340,11 +514,11 @@ class db_loader:
                 # 新しいエージェントを登録
                 insert_agent_query = "INSERT INTO agents (name, prompt_file) VALUES (?, ?)"
                 cursor.execute(insert_agent_query, (agent_name, prompt))
-                conn.commit()
+                self.do_commit(conn)
                 new_agent_id = cursor.lastrowid
                 return f"[green]新しいエージェント '{agent_name}' (ID: {new_agent_id}) を登録しました[/green]", new_agent_id
         except Exception as e:
-            conn.rollback()
+            self.do_rollback(conn)
             return f"[red]エラーが発生しました: {e}[/red]", None
         finally:
             cursor.close()
@@ -362,10 +536,10 @@ class db_loader:
             # エージェントを削除
             delete_agent_query = "DELETE FROM agents WHERE id = ?"
             res = cursor.execute(delete_agent_query, (agent_id,))
-            conn.commit()
+            self.do_commit(conn)
             return f"[green]エージェント '{agent_id}' を削除しました[/green]", res.rowcount
         except Exception as e:
-            conn.rollback()
+            self.do_rollback(conn)
             return f"[red]エラーが発生しました: {e}[/red]", None
         finally:
             cursor.close()
@@ -419,13 +593,13 @@ class db_loader:
                 cursor.execute(insert_csv_query, (agent_id, filename, orgname))
                 new_csvfile_id = cursor.lastrowid
                 #print(f"DEBUG: New CSV file ID: {new_csvfile_id}, filename: {filename}, agent_id: {agent_id}")
-                conn.commit()
+                self.do_commit(conn)
                 #print("DEBUG: Commit successful")
                 ret_str.append(f"[green]新しいCSVファイル '{filename}' (ID: {new_csvfile_id}) を登録しました[/green]")
                 return ret_str, new_csvfile_id
 
         except Exception as e:
-            conn.rollback()
+            self.do_rollback(conn)
             return [f"[red]エラーが発生しました: {e}[/red]"], None
         finally:
             cursor.close()
@@ -443,10 +617,10 @@ class db_loader:
             # エージェントを削除
             delete_agent_query = "DELETE FROM csvfiles WHERE id = ?"
             res = cursor.execute(delete_agent_query, (csvfile_id,))
-            conn.commit()
+            self.do_commit(conn)
             return f"[green]csvfile '{csvfile_id}' を削除しました[/green]", res.rowcount
         except Exception as e:
-            conn.rollback()
+            self.do_rollback(conn)
             return f"[red]エラーが発生しました: {e}[/red]", None
         finally:
             cursor.close()
@@ -473,11 +647,116 @@ class db_loader:
             # Insert new agent
             insert_agent_query = "INSERT INTO agents (name, prompt_file) VALUES (?, ?)"
             cursor.execute(insert_agent_query, (agent_name, prompt_file))
-            conn.commit()
+            self.do_commit(conn)
             new_agent_id = cursor.lastrowid
             return f"[green]エージェント '{agent_name}' を追加しました (ID: {new_agent_id})[/green]", new_agent_id
         except Exception as e:
-            conn.rollback()
+            self.do_rollback(conn)
+            return f"[red]エラーが発生しました: {e}[/red]", None
+        finally:
+            cursor.close()
+            self.do_disconnect(conn)
+
+    def get_parser_spec(self, agent_name: str) -> Tuple[Optional[str], Optional[str]]:
+        """Get the parser spec (JSON) of an agent.
+
+        Returns:
+            Tuple of (error message if the agent does not exist, parser spec or None)
+        """
+        conn = self.get_connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT parser_spec FROM agents WHERE name = ?", (agent_name,))
+            result = cursor.fetchone()
+        except sqlite3.Error as e:
+            return f"クエリ実行エラー: {e}", None
+        finally:
+            cursor.close()
+            self.do_disconnect(conn)
+        if not result:
+            return f"エージェント '{agent_name}' が見つかりません", None
+        return None, result[0]
+
+    def set_parser_spec(self, agent_name: str, parser_spec: Optional[str]) -> Tuple[str, Optional[int]]:
+        """Set (or clear with None) the parser spec (JSON) of an agent.
+
+        Returns:
+            Tuple of (message, agent_id or None if failed)
+        """
+        conn = self.get_connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id FROM agents WHERE name = ?", (agent_name,))
+            agent_result = cursor.fetchone()
+            if not agent_result:
+                return f"[red]エージェント '{agent_name}' が見つかりません[/red]", None
+            cursor.execute("UPDATE agents SET parser_spec = ? WHERE id = ?", (parser_spec, agent_result[0]))
+            self.do_commit(conn)
+            action = "削除" if parser_spec is None else "保存"
+            return f"[green]エージェント '{agent_name}' のパーサー定義を{action}しました[/green]", agent_result[0]
+        except Exception as e:
+            self.do_rollback(conn)
+            return f"[red]エラーが発生しました: {e}[/red]", None
+        finally:
+            cursor.close()
+            self.do_disconnect(conn)
+
+    def get_journalized_rows(self, agent_name: str, fingerprints: List[str]) -> Tuple[Optional[str], Dict[str, str]]:
+        """Get the journalized output of source lines seen before by an agent.
+
+        Args:
+            agent_name (str): The name of the agent.
+            fingerprints (List[str]): Line fingerprints (see source_reader.line_fingerprint).
+
+        Returns:
+            Tuple of (error message or None, {fingerprint: JSON list of rows} for the lines found)
+        """
+        conn = self.get_connect()
+        cursor = conn.cursor()
+        found = {}
+        try:
+            # Bounded batches (SQLite limits the number of host parameters)
+            for i in range(0, len(fingerprints), 500):
+                batch = fingerprints[i:i + 500]
+                query = f"""
+                SELECT r.fingerprint, r.output
+                FROM journalized_rows r
+                JOIN agents a ON a.id = r.agent_id
+                WHERE a.name = ? AND r.fingerprint IN ({','.join(['?'] * len(batch))})
+                """
+                found.update(cursor.execute(query, [agent_name] + batch).fetchall())
+        except sqlite3.Error as e:
+            return f"クエリ実行エラー: {e}", {}
+        finally:
+            cursor.close()
+            self.do_disconnect(conn)
+        return None, found
+
+    def save_journalized_rows(self, agent_name: str, rows: Dict[str, str]) -> Tuple[str, Optional[int]]:
+        """Record the journalized output of source lines for reuse by later runs of an agent.
+
+        Args:
+            agent_name (str): The name of the agent.
+            rows (Dict[str, str]): {line fingerprint: JSON list of rows}
+
+        Returns:
+            Tuple of (message, number of lines recorded or None if failed)
+        """
+        conn = self.get_connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT id FROM agents WHERE name = ?", (agent_name,))
+            agent_result = cursor.fetchone()
+            if not agent_result:
+                return f"[red]エージェント '{agent_name}' が見つかりません[/red]", None
+            self.do_begin(cursor)
+            cursor.executemany(
+                "INSERT OR REPLACE INTO journalized_rows (agent_id, fingerprint, output) VALUES (?, ?, ?)",
+                [(agent_result[0], fingerprint, output) for fingerprint, output in rows.items()])
+            self.do_commit(conn)
+            return f"[green]仕訳済みの行を記録しました: {len(rows)}行[/green]", len(rows)
+        except Exception as e:
+            self.do_rollback(conn)
             return f"[red]エラーが発生しました: {e}[/red]", None
         finally:
             cursor.close()
@@ -504,11 +783,11 @@ class db_loader:
             # Insert new account
             insert_account_query = "INSERT INTO accounts (name, account_type) VALUES (?, ?)"
             cursor.execute(insert_account_query, (account_name, account_type))
-            conn.commit()
+            self.do_commit(conn)
             new_account_id = cursor.lastrowid
             return f"[green]アカウント '{account_name}' を追加しました (ID: {new_account_id})[/green]", new_account_id
         except Exception as e:
-            conn.rollback()
+            self.do_rollback(conn)
             return f"[red]エラーが発生しました: {e}[/red]", None
         finally:
             cursor.close()
@@ -534,14 +813,14 @@ class db_loader:
             # Delete account
             delete_account_query = "DELETE FROM accounts WHERE id = ?"
             res = cursor.execute(delete_account_query, (account_id,))
-            conn.commit()
+            self.do_commit(conn)
             
             if res.rowcount > 0:
                 return f"[green]アカウント ID {account_id} を削除しました[/green]", res.rowcount
             else:
                 return f"[yellow]アカウント ID {account_id} が見つかりません[/yellow]", None
         except Exception as e:
-            conn.rollback()
+            self.do_rollback(conn)
             return f"[red]エラーが発生しました: {e}[/red]", None
         finally:
             cursor.close()
@@ -582,11 +861,70 @@ class db_loader:
             ret_str.append(f"  対象log_id数: {len(log_ids)}")
 
             # Begin transaction
-            cursor.execute("BEGIN TRANSACTION")
+            self.do_begin(cursor)
 
             ret_str.append(f"ロールバックしました  ログID: {', '.join(map(str, log_ids))}")
+            log_params = ','.join(['?']*len(log_ids))
+
+            # Rows of other files linked by match_transfers to rows of this file get back their
+            # state before the match (transfer_matches), as if the other file had been loaded alone
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM transactions")
+            max_id = cursor.fetchone()[0]
+            # The partner (source of the dropped inferred leg) stays: recreate its inferred leg
+            # in the account of the matched row
+            restore_query = f"""
+            INSERT INTO transactions (account_id, category_id, log_id, ref_transaction_id, transfer_id, amount,
+                                      item_name, description, transaction_date, memo)
+            SELECT d.account_id, p.category_id, p.log_id, p.id, p.transfer_id, -p.amount,
+                   p.item_name, p.description, p.transaction_date, p.memo
+            FROM transfer_matches m
+            JOIN transactions d ON d.id = m.transaction_id
+            JOIN transactions p ON p.id = m.partner_id
+            WHERE d.log_id IN ({log_params}) AND p.log_id NOT IN ({log_params})
+            """
+            restored = cursor.execute(restore_query, log_ids + log_ids).rowcount
+            # The matched row stays: recreate its own inferred leg (in the partner's account) if it
+            # had one, then give it back its category and transfer
+            restored += cursor.execute(f"""
+            INSERT INTO transactions (account_id, category_id, log_id, ref_transaction_id, transfer_id, amount,
+                                      item_name, description, transaction_date, memo)
+            SELECT p.account_id, m.original_category_id, d.log_id, d.id, m.original_transfer_id, -d.amount,
+                   d.item_name, d.description, d.transaction_date, d.memo
+            FROM transfer_matches m
+            JOIN transactions d ON d.id = m.transaction_id
+            JOIN transactions p ON p.id = m.partner_id
+            WHERE p.log_id IN ({log_params}) AND d.log_id NOT IN ({log_params})
+              AND m.original_transfer_id IS NOT NULL
+            """, log_ids + log_ids).rowcount
+            reverted = cursor.execute(f"""
+            UPDATE transactions
+            SET (category_id, transfer_id) = (
+                SELECT m.original_category_id, m.original_transfer_id FROM transfer_matches m
+                WHERE m.transaction_id = transactions.id)
+            WHERE id IN (
+                SELECT m.transaction_id FROM transfer_matches m
+                JOIN transactions p ON p.id = m.partner_id
+                WHERE p.log_id IN ({log_params}))
+              AND log_id NOT IN ({log_params})
+            """, log_ids + log_ids).rowcount
+            cursor.execute(f"""
+            DELETE FROM transfer_matches
+            WHERE transaction_id IN (SELECT id FROM transactions WHERE log_id IN ({log_params}))
+               OR partner_id IN (SELECT id FROM transactions WHERE log_id IN ({log_params}))
+            """, log_ids + log_ids)
+            cursor.execute("""
+            INSERT INTO transaction_tags (transaction_id, tag_id)
+            SELECT t.id, tt.tag_id FROM transactions t
+            JOIN transaction_tags tt ON tt.transaction_id = t.ref_transaction_id
+            WHERE t.id > ?
+            """, (max_id,))
+            if restored:
+                ret_str.append(f"  振替の相手側を復元: {restored}")
+            if reverted:
+                ret_str.append(f"  照合前の状態に戻した取引: {reverted}")
+
             # Delete transactions associated with these log IDs
-            delete_trans_query = f"DELETE FROM transactions WHERE log_id IN ({','.join(['?']*len(log_ids))})"
+            delete_trans_query = f"DELETE FROM transactions WHERE log_id IN ({log_params})"
             delete_trans_results = cursor.execute(delete_trans_query, log_ids)
             ret_str.append(f"  削除された取引数: {delete_trans_results.rowcount}")
 
@@ -602,11 +940,11 @@ class db_loader:
             ret_str.append(f"[green]ロールバックが完了しました[/green]")
 
             # Commit the transaction
-            conn.commit()
+            self.do_commit(conn)
             return ret_str, len(log_ids)
 
         except Exception as e:
-            conn.rollback()
+            self.do_rollback(conn)
             return [f"[red]エラーが発生しました: {e}[/red]"], None
         finally:
             cursor.close()
@@ -619,11 +957,13 @@ class db_reporter:
         self.db_path = db_path
         self.conn = None
         self.cursor = None
+        # Connection class passed to sqlite3.connect (e.g. profiler.ProfilingConnection)
+        self.connection_factory = sqlite3.Connection
         
     def connect(self) -> Optional[str]:
         """Connect to the SQLite database."""
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            self.conn = sqlite3.connect(self.db_path, factory=self.connection_factory)
             self.cursor = self.conn.cursor()
             return None
         except sqlite3.Error as e:
@@ -663,6 +1003,25 @@ class db_reporter:
         except sqlite3.Error as e:
             return f"[red]クエリ実行エラー: {e}[/red]", []
 
+    def execute_query_cursor(self, query: str, params: Tuple = ()) -> Tuple[Optional[str], Optional[sqlite3.Cursor]]:
+        """Execute a query on a dedicated cursor without fetching the results.
+
+        The caller iterates the cursor (e.g. with fetchmany) and closes it,
+        so memory use stays bounded for large result sets.
+        """
+        if not self.conn:
+            return "[red]データベースに接続されていません[/red]", None
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(query, params)
+            return None, cursor
+        except sqlite3.Error as e:
+            return f"[red]クエリ実行エラー: {e}[/red]", None
+
+    def explain_query(self, query: str, params: Tuple = ()) -> Tuple[Optional[str], List[Tuple]]:
+        """Return the EXPLAIN QUERY PLAN rows (id, parent, notused, detail) of a query."""
+        return self.execute_query(f"EXPLAIN QUERY PLAN {query}", params)
+
     def cmd_tables(self) -> Tuple[Optional[str], List[Tuple]]:
         """List all tables in the database."""
         query = "SELECT name FROM sqlite_master WHERE type='table';"
@@ -861,6 +1220,72 @@ class db_reporter:
         return self.execute_query(query)
 
 
+    def cmd_pivot(self, rows: str, cols: str, measure: str = "total",
+                  number: Optional[int] = None, date_str: Optional[str] = None) -> Tuple[Optional[str], Any]:
+        """Get a cross table (rows x cols) of a measure.
+
+        The grouped aggregate is fetched with a single query and pivoted with pandas,
+        so the number of columns does not affect the number of scans.
+
+        Args:
+            rows: 行の集計軸 (PIVOT_DIMENSIONSのキー)
+            cols: 列の集計軸 (PIVOT_DIMENSIONSのキー)
+            measure: 集計値 (PIVOT_MEASURESのキー)
+            number: 直近の期間数 (rows/colsのどちらかが期間の場合のみ有効)
+            date_str: 起点となる日付 (YYYY-MM-DD形式)
+
+        Returns:
+            Tuple of (error message or None, pandas.DataFrame with totals or None if no data)
+        """
+        if rows not in PIVOT_DIMENSIONS or cols not in PIVOT_DIMENSIONS:
+            return f"[red]無効な集計軸: {rows} {cols} ({'/'.join(PIVOT_DIMENSIONS)})[/red]", None
+        if rows == cols:
+            return f"[red]行と列に同じ集計軸は指定できません: {rows}[/red]", None
+        if measure not in PIVOT_MEASURES:
+            return f"[red]無効な集計値: {measure} ({'/'.join(PIVOT_MEASURES)})[/red]", None
+
+        where = "t.transaction_date IS NOT NULL"
+        params: List[Any] = []
+        if number:
+            period = next((d for d in (rows, cols) if d in ("day", "month", "year")), None)
+            if period is None:
+                return f"[red]期間数を指定する場合は day/month/year のいずれかを集計軸にしてください[/red]", None
+            if date_str is not None:
+                if self.strptime(date_str) is None:
+                    return f"[red]日付の形式が不正です。YYYY-MM-DD形式で指定してください。[/red]", None
+                target_date = date_str
+            else:
+                target_date = datetime.now().strftime("%Y-%m-%d")
+            where += f" AND t.transaction_date < ? AND t.transaction_date >= date(?, '-{int(number)} {period}s')"
+            params.extend([target_date, target_date])
+
+        query = f"""
+        SELECT
+            {PIVOT_DIMENSIONS[rows]} as row_key,
+            {PIVOT_DIMENSIONS[cols]} as col_key,
+            {PIVOT_MEASURES[measure]} as value
+        FROM transactions t
+        JOIN accounts a ON t.account_id = a.id
+        LEFT JOIN categories c ON t.category_id = c.id
+        WHERE {where}
+        GROUP BY row_key, col_key
+        """
+        err, results = self.execute_query(query, tuple(params))
+        if err is not None:
+            return err, None
+        if not results:
+            return None, None
+
+        import pandas as pd
+
+        df = pd.DataFrame(results, columns=["row_key", "col_key", "value"])
+        pivot = df.pivot_table(index="row_key", columns="col_key", values="value",
+                               aggfunc="sum", fill_value=0, margins=True, margins_name="合計")
+        pivot.index.name = rows
+        pivot.columns.name = cols
+        return None, pivot
+
+
     def cmd_sum_logs(self, csvfile_id: int) -> Tuple[Optional[str], List[Tuple]]:
         """Get a summary of transactions for a specific CSV file ID."""
         query = """
@@ -876,6 +1301,34 @@ class db_reporter:
         """
         return self.execute_query(query, (csvfile_id,))
 
+    def classifier_samples(self) -> Tuple[Optional[str], List[Tuple]]:
+        """Labeled rows for the category classifier, oldest first.
+
+        Counter-legs created by load_csv (ref_transaction_id) are not statement rows
+        and are left out.
+
+        Returns:
+            Tuple of (error message or None, rows of (item_name, description, amount,
+            category type, category name, transfer account name or None,
+            tag names joined with "|" in name order or None))
+        """
+        query = """
+        SELECT t.item_name, t.description, t.amount, c.type, c.name, ta.name,
+               (SELECT group_concat(name, '|') FROM (
+                    SELECT tg.name FROM transaction_tags tt
+                    JOIN tags tg ON tg.id = tt.tag_id
+                    WHERE tt.transaction_id = t.id
+                    ORDER BY tg.name))
+        FROM transactions t
+        JOIN categories c ON c.id = t.category_id
+        LEFT JOIN transactions o ON o.transfer_id = t.transfer_id AND o.id <> t.id
+        LEFT JOIN accounts ta ON ta.id = o.account_id
+        WHERE t.ref_transaction_id IS NULL
+          AND (COALESCE(t.item_name, '') <> '' OR COALESCE(t.description, '') <> '')
+        ORDER BY t.transaction_date, t.id
+        """
+        return self.execute_query(query)
+
 
     def cmd_balance(self, as_of_date: str) -> Tuple[Optional[str], List[Tuple]]:
         """Get the balance of each account as of a specific date.
@@ -914,11 +1367,47 @@ class db_reporter:
         """
         return self.execute_query(query, (csvfile_id,))
 
+    # Queries for tab completion candidates (key -> query returning one text column)
+    COMPLETION_QUERIES = {
+        "tables": "SELECT name FROM sqlite_master WHERE type='table' ORDER BY name",
+        "agents": "SELECT name FROM agents ORDER BY name",
+        "agent_ids": "SELECT id FROM agents ORDER BY id",
+        "accounts": "SELECT name FROM accounts ORDER BY name",
+        "account_ids": "SELECT id FROM accounts ORDER BY id",
+        "csvfiles": "SELECT id FROM csvfiles ORDER BY id",
+        "unloaded_csvfiles": "SELECT id FROM csvfiles WHERE loaded_date IS NULL ORDER BY id",
+        "loaded_csvfiles": "SELECT id FROM csvfiles WHERE loaded_date IS NOT NULL ORDER BY id",
+        "archives": "SELECT id FROM archives ORDER BY id",
+    }
+
+    def completion_candidates(self) -> Dict[str, List[str]]:
+        """Collect tab completion candidates (table names, agents, accounts, ids).
+
+        A query that fails (e.g. a table missing in an older database) yields no
+        candidates for its key instead of an error.
+        """
+        candidates = {}
+        for key, query in self.COMPLETION_QUERIES.items():
+            err, rows = self.execute_query(query)
+            candidates[key] = [] if err is not None else [str(row[0]) for row in rows]
+        return candidates
+
 
 class DatabaseManager(db_reporter, db_loader):
-    def __init__(self, db_path="./db/database.sqlite", archive_file_format="archive_{id}_{time}.zip"):
+    def __init__(self, db_path="./db/database.sqlite", archive_file_format="archive_{id}_{time}.zip",
+                 archive_codec_spec=archive_codec.DEFAULT_CODEC, archive_workers=None,
+                 archive_store="file", blob_dir="data/blobs"):
         super().__init__(db_path)
         self.archive_file_format = archive_file_format
+        # Compression of new archives (see archive_codec.py) and number of compression threads
+        self.archive_codec_spec = archive_codec_spec
+        self.archive_workers = archive_workers
+        # "file": one archive file per archive_csv, "blob": content-addressed blob store in blob_dir
+        self.archive_store = archive_store
+        self.blob_dir = blob_dir
+        # atomicモード: 複数コマンドの書き込みを1トランザクションにまとめる
+        self.atomic = False
+        self.atomic_failed = False
 
     def get_connect(self):
         if self.conn is None:
@@ -929,6 +1418,59 @@ class DatabaseManager(db_reporter, db_loader):
     def do_disconnect(self,conn: sqlite3.Connection):
         pass
 
+    def do_begin(self, cursor: sqlite3.Cursor) -> None:
+        if not self.atomic:
+            super().do_begin(cursor)
+
+    def do_commit(self, conn: sqlite3.Connection) -> None:
+        if not self.atomic:
+            super().do_commit(conn)
+
+    def do_rollback(self, conn: sqlite3.Connection) -> None:
+        if self.atomic:
+            # 失敗したコマンドの書き込みは end_atomic でまとめてロールバックする
+            self.atomic_failed = True
+        else:
+            super().do_rollback(conn)
+
+    def begin_atomic(self) -> Optional[str]:
+        """Start atomic mode: writes of following commands share one transaction
+        until end_atomic() is called.
+
+        Returns:
+            Error message or None
+        """
+        conn = self.get_connect()
+        if conn is None:
+            return "[red]データベースに接続できません[/red]"
+        if self.atomic:
+            return "[red]既にatomicモードで実行中です[/red]"
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN TRANSACTION")
+        self.atomic = True
+        self.atomic_failed = False
+        return None
+
+    def end_atomic(self, commit: bool) -> bool:
+        """Finish atomic mode.
+
+        Args:
+            commit: Commit the transaction if True (and no command failed), otherwise roll back
+
+        Returns:
+            True if the transaction was committed
+        """
+        conn = self.get_connect()
+        self.atomic = False
+        if conn is None:
+            return False
+        if commit and not self.atomic_failed:
+            conn.commit()
+            return True
+        conn.rollback()
+        return False
+
     def archive_csv(self, csvfile_ids: List[int]) -> Tuple[List[str], Optional[int]]:
         """Archive CSV files to a zip file
         
@@ -942,6 +1484,10 @@ class DatabaseManager(db_reporter, db_loader):
         
         if not csvfile_ids:
             return [f"[red]有効なCSVファイルIDが指定されていません[/red]"], None
+        if self.atomic:
+            # The originals are deleted once the archive is committed; a rollback at the end
+            # of the script would leave them deleted with only unregistered archive files
+            return [f"[red]archive_csv はatomicモードでは実行できません[/red]"], None
             
         conn = self.get_connect()
         if conn is None:
@@ -949,11 +1495,12 @@ class DatabaseManager(db_reporter, db_loader):
         cursor = conn.cursor()
         
         try:
-            # Get archive file format from config
+            # Get archive file format and codec from config
             archive_format = self.archive_file_format
+            codec = archive_codec.parse_codec(self.archive_codec_spec)
             
             # Begin transaction
-            cursor.execute("BEGIN TRANSACTION")
+            self.do_begin(cursor)
             
             # Get CSV files info (including org_name)
             csv_files = []
@@ -974,7 +1521,7 @@ class DatabaseManager(db_reporter, db_loader):
                 csv_files.append((result[0], result[1], result[3]))
             
             if not csv_files:
-                conn.rollback()
+                self.do_rollback(conn)
                 return ret_str + [f"[red]アーカイブ対象のCSVファイルがありません[/red]"], None
             
             # Create archive record
@@ -982,51 +1529,81 @@ class DatabaseManager(db_reporter, db_loader):
                 "filename": "",  # Will update after creating the file
                 "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
-            cursor.execute("INSERT INTO archives (filename, created_at) VALUES (?, ?)", 
-                         (archive_data["filename"], archive_data["created_at"]))
+            # Blob store archives are recorded with codec 'blob' (each blob has its own codec)
+            use_blobs = self.archive_store == "blob"
+            cursor.execute("INSERT INTO archives (filename, created_at, codec) VALUES (?, ?, ?)", 
+                         (archive_data["filename"], archive_data["created_at"],
+                          "blob" if use_blobs else codec.spec))
             archive_id = cursor.lastrowid
             
-            # Generate archive filename
-            time_str = datetime.now().strftime("%Y%m%d_%H%M%S")
-            archive_filename = archive_format.format(id=archive_id, time=time_str)
-            archive_path = Path("data/arch") / archive_filename
+            # Generate archive filename (the blob store directory for blob archives)
+            if use_blobs:
+                archive_path = Path(self.blob_dir)
+                archive_dir = archive_path
+            else:
+                time_str = datetime.now().strftime("%Y%m%d_%H%M%S")
+                archive_filename = archive_format.format(id=archive_id, time=time_str)
+                archive_path = Path("data/arch") / codec.archive_name(archive_filename)
+                archive_dir = archive_path.parent
             
             # Create archive directory if it doesn't exist
-            archive_path.parent.mkdir(parents=True, exist_ok=True)
+            archive_dir.mkdir(parents=True, exist_ok=True)
             
-            # Create zip file
+            # Collect the files to archive
             archived_files = []
-            with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for csv_id, csv_path_str, org_path_str in csv_files:
-                    csv_path = Path(csv_path_str)
-                    
-                    # Archive the main CSV file
-                    if csv_path.exists():
-                        # Add file to zip with its relative path
-                        arcname = csv_path.name  # Store just the filename in the archive
-                        zipf.write(csv_path, arcname)
-                        archived_files.append((csv_id, csv_path_str, None))
-                        ret_str.append(f"[cyan]アーカイブ中: {csv_path_str}[/cyan]")
+            members = []
+            for csv_id, csv_path_str, org_path_str in csv_files:
+                csv_path = Path(csv_path_str)
+                
+                # Archive the main CSV file
+                if csv_path.exists():
+                    arcname = csv_path.name  # Store just the filename in the archive
+                    members.append((csv_path, arcname))
+                    archived_files.append((csv_id, csv_path_str, None))
+                    ret_str.append(f"[cyan]アーカイブ中: {csv_path_str}[/cyan]")
+                else:
+                    ret_str.append(f"[yellow]ファイルが見つかりません: {csv_path_str}[/yellow]")
+                
+                # Archive the org_name file if it exists
+                if org_path_str:
+                    org_path = Path(org_path_str)
+                    if org_path.exists():
+                        # Store org_name file with a prefix to distinguish it
+                        org_arcname = f"org_{csv_id}_{org_path.name}"
+                        members.append((org_path, org_arcname))
+                        archived_files.append((csv_id, None, org_path_str))
+                        ret_str.append(f"[cyan]アーカイブ中 (元ファイル): {org_path_str}[/cyan]")
                     else:
-                        ret_str.append(f"[yellow]ファイルが見つかりません: {csv_path_str}[/yellow]")
-                    
-                    # Archive the org_name file if it exists
-                    if org_path_str:
-                        org_path = Path(org_path_str)
-                        if org_path.exists():
-                            # Store org_name file with a prefix to distinguish it
-                            org_arcname = f"org_{csv_id}_{org_path.name}"
-                            zipf.write(org_path, org_arcname)
-                            archived_files.append((csv_id, None, org_path_str))
-                            ret_str.append(f"[cyan]アーカイブ中 (元ファイル): {org_path_str}[/cyan]")
-                        else:
-                            ret_str.append(f"[yellow]元ファイルが見つかりません: {org_path_str}[/yellow]")
+                        ret_str.append(f"[yellow]元ファイルが見つかりません: {org_path_str}[/yellow]")
+            
+            # Create the archive (members are compressed in parallel threads)
+            hashes = {}
+            if use_blobs:
+                hashes, new_blobs = archive_codec.store_blobs(
+                    archive_path, codec, [path for path, _ in members],
+                    lambda digests: self.known_blobs(cursor, digests), self.archive_workers)
+                sizes = {digest.sha256: digest.size for digest in hashes.values()}
+                for digest, stored_size in new_blobs.items():
+                    cursor.execute("INSERT INTO blobs (hash, size, stored_size, codec) VALUES (?, ?, ?, ?)",
+                                   (digest, sizes[digest], stored_size, codec.spec))
+                ret_str.append(f"[cyan]新規blob: {len(new_blobs)} 件 ({sum(new_blobs.values()):,} bytes), "
+                               f"既存blobを再利用: {len(sizes) - len(new_blobs)} 件[/cyan]")
+                member_digests = {arcname: hashes[path] for path, arcname in members}
+            else:
+                member_digests = archive_codec.write_archive(archive_path, codec, members, self.archive_workers)
+            
+            # Record the members with their digests (checked by verify_archive)
+            cursor.executemany(
+                "INSERT INTO archive_members (archive_id, csvfile_id, name, size, crc32, sha256) VALUES (?, ?, ?, ?, ?, ?)",
+                [(archive_id, csv_id, arcname, member_digests[arcname].size, member_digests[arcname].crc32,
+                  member_digests[arcname].sha256)
+                 for (_, arcname), (csv_id, _, _) in zip(members, archived_files)])
             
             # Update archive record with filename
             cursor.execute("UPDATE archives SET filename = ? WHERE id = ?", 
                          (str(archive_path), archive_id))
             
-            # Update csvfiles records and delete original files
+            # Update csvfiles records (the original files are deleted after the commit)
             processed_ids = set()
             for csv_id, csv_path_str, org_path_str in archived_files:
                 # Update archive_id in csvfiles (only once per csv_id)
@@ -1035,32 +1612,34 @@ class DatabaseManager(db_reporter, db_loader):
                                  (archive_id, csv_id))
                     processed_ids.add(csv_id)
                 
-                # Delete the original CSV file
-                if csv_path_str:
-                    csv_path = Path(csv_path_str)
-                    if csv_path.exists():
-                        csv_path.unlink()
-                        ret_str.append(f"[green]削除: {csv_path_str}[/green]")
-                
-                # Delete the original org_name file
-                if org_path_str:
-                    org_path = Path(org_path_str)
-                    if org_path.exists():
-                        org_path.unlink()
-                        ret_str.append(f"[green]削除 (元ファイル): {org_path_str}[/green]")
+                # Reference the stored blobs
+                if use_blobs:
+                    column, path_str = ("blob_hash", csv_path_str) if csv_path_str else ("org_blob_hash", org_path_str)
+                    cursor.execute(f"UPDATE csvfiles SET {column} = ? WHERE id = ?",
+                                   (hashes[Path(path_str)].sha256, csv_id))
             
             # Commit transaction
-            conn.commit()
+            self.do_commit(conn)
+            
+            # Delete the original files only once the archive is recorded
+            for csv_id, csv_path_str, org_path_str in archived_files:
+                if csv_path_str:
+                    Path(csv_path_str).unlink(missing_ok=True)
+                    ret_str.append(f"[green]削除: {csv_path_str}[/green]")
+                if org_path_str:
+                    Path(org_path_str).unlink(missing_ok=True)
+                    ret_str.append(f"[green]削除 (元ファイル): {org_path_str}[/green]")
             
             ret_str.append(f"[green]アーカイブが完了しました[/green]")
             ret_str.append(f"  アーカイブID: {archive_id}")
             ret_str.append(f"  アーカイブファイル: {archive_path}")
+            ret_str.append(f"  圧縮形式: {f'blob ({codec.spec})' if use_blobs else codec.spec}")
             ret_str.append(f"  アーカイブされたファイル数: {len(archived_files)}")
             
             return ret_str, archive_id
             
         except Exception as e:
-            conn.rollback()
+            self.do_rollback(conn)
             return ret_str + [f"[red]アーカイブ中にエラーが発生しました: {e}[/red]"], None
         finally:
             cursor.close()
@@ -1082,10 +1661,10 @@ class DatabaseManager(db_reporter, db_loader):
         
         try:
             # Begin transaction
-            cursor.execute("BEGIN TRANSACTION")
+            self.do_begin(cursor)
             
             # Get archive info
-            query = "SELECT id, filename FROM archives WHERE id = ?"
+            query = "SELECT id, filename, codec FROM archives WHERE id = ?"
             cursor.execute(query, (archive_id,))
             archive_result = cursor.fetchone()
             
@@ -1093,74 +1672,86 @@ class DatabaseManager(db_reporter, db_loader):
                 return [f"[red]アーカイブID {archive_id} が見つかりません[/red]"], None
             
             archive_path = Path(archive_result[1])
+            # Blob store archives: archive_path is the blob store directory
+            use_blobs = archive_result[2] == "blob"
+            codec = None if use_blobs else archive_codec.parse_codec(archive_result[2])
             
             if not archive_path.exists():
                 return [f"[red]アーカイブファイルが見つかりません: {archive_path}[/red]"], None
             
             # Get CSV files associated with this archive (including org_name)
-            query = "SELECT id, name, org_name FROM csvfiles WHERE archive_id = ?"
+            query = """
+                SELECT c.id, c.name, c.org_name, c.blob_hash, b.codec, c.org_blob_hash, o.codec
+                FROM csvfiles c
+                LEFT JOIN blobs b ON b.hash = c.blob_hash
+                LEFT JOIN blobs o ON o.hash = c.org_blob_hash
+                WHERE c.archive_id = ?
+            """ if use_blobs else "SELECT id, name, org_name FROM csvfiles WHERE archive_id = ?"
             cursor.execute(query, (archive_id,))
-            csv_files = cursor.fetchall()
+            rows = cursor.fetchall()
+            csv_files = [row[:3] for row in rows]
             
             if not csv_files:
                 return [f"[yellow]このアーカイブに関連するCSVファイルが見つかりません[/yellow]"], None
             
-            # Extract files
+            # Extract files (streamed in blocks, so large files do not have to fit in memory)
+            targets = {}
+            blob_refs = {}
+            for csv_id, csv_path_str, org_path_str, *blobs in rows:
+                targets[Path(csv_path_str).name] = Path(csv_path_str)
+                if use_blobs:
+                    blob_refs[Path(csv_path_str).name] = (blobs[0], blobs[1])
+                if org_path_str:
+                    org_arcname = f"org_{csv_id}_{Path(org_path_str).name}"
+                    targets[org_arcname] = Path(org_path_str)
+                    if use_blobs:
+                        blob_refs[org_arcname] = (blobs[2], blobs[3])
+            if use_blobs:
+                results = archive_codec.extract_blobs(archive_path, blob_refs, targets)
+            else:
+                results = archive_codec.extract_members(archive_path, codec, targets)
+
             extracted_count = 0
-            with zipfile.ZipFile(archive_path, 'r') as zipf:
-                for csv_id, csv_path_str, org_path_str in csv_files:
-                    # Extract the main CSV file
-                    csv_path = Path(csv_path_str)
-                    try:
-                        # Get the archived name (just the filename)
-                        arcname = csv_path.name
-                        # Create parent directory if it doesn't exist
-                        csv_path.parent.mkdir(parents=True, exist_ok=True)
-                        # Extract to the original location
-                        with zipf.open(arcname) as source, open(csv_path, 'wb') as target:
-                            target.write(source.read())
-                        ret_str.append(f"[green]復元: {csv_path_str}[/green]")
-                        extracted_count += 1
-                    except KeyError:
-                        ret_str.append(f"[yellow]アーカイブ内にファイルが見つかりません: {arcname}[/yellow]")
-                    except Exception as e:
-                        ret_str.append(f"[yellow]ファイルの復元に失敗しました: {csv_path_str} - {e}[/yellow]")
-                    
-                    # Extract the org_name file if it exists
-                    if org_path_str:
-                        org_path = Path(org_path_str)
-                        org_arcname = f"org_{csv_id}_{org_path.name}"
-                        try:
-                            # Create parent directory if it doesn't exist
-                            org_path.parent.mkdir(parents=True, exist_ok=True)
-                            # Extract to the original org_name location
-                            with zipf.open(org_arcname) as source, open(org_path, 'wb') as target:
-                                target.write(source.read())
+            for csv_id, csv_path_str, org_path_str in csv_files:
+                # The main CSV file
+                arcname = Path(csv_path_str).name
+                if arcname not in results:
+                    ret_str.append(f"[yellow]アーカイブ内にファイルが見つかりません: {arcname}[/yellow]")
+                elif results[arcname] is not None:
+                    ret_str.append(f"[yellow]ファイルの復元に失敗しました: {csv_path_str} - {results[arcname]}[/yellow]")
+                else:
+                    ret_str.append(f"[green]復元: {csv_path_str}[/green]")
+                    extracted_count += 1
+                
+                # The org_name file (might not be in the archive if it didn't exist during archiving)
+                if org_path_str:
+                    org_arcname = f"org_{csv_id}_{Path(org_path_str).name}"
+                    if org_arcname in results:
+                        if results[org_arcname] is not None:
+                            ret_str.append(f"[yellow]元ファイルの復元に失敗しました: {org_path_str} - {results[org_arcname]}[/yellow]")
+                        else:
                             ret_str.append(f"[green]復元 (元ファイル): {org_path_str}[/green]")
                             extracted_count += 1
-                        except KeyError:
-                            # org_name file might not be in the archive if it didn't exist during archiving
-                            pass
-                        except Exception as e:
-                            ret_str.append(f"[yellow]元ファイルの復元に失敗しました: {org_path_str} - {e}[/yellow]")
-                    
-                    # Update csvfiles record
-                    cursor.execute("UPDATE csvfiles SET archive_id = NULL WHERE id = ?", 
-                                 (csv_id,))
+                
+                # Update csvfiles record (blobs no longer referenced are dropped by gc)
+                cursor.execute("UPDATE csvfiles SET archive_id = NULL, blob_hash = NULL, org_blob_hash = NULL WHERE id = ?", 
+                             (csv_id,))
             
             if extracted_count == 0:
-                conn.rollback()
+                self.do_rollback(conn)
                 return ret_str + [f"[red]ファイルを復元できませんでした[/red]"], None
             
             # Delete archive file
-            archive_path.unlink()
-            ret_str.append(f"[cyan]アーカイブファイルを削除: {archive_path}[/cyan]")
+            if not use_blobs:
+                archive_path.unlink()
+                ret_str.append(f"[cyan]アーカイブファイルを削除: {archive_path}[/cyan]")
             
             # Delete archive record
+            cursor.execute("DELETE FROM archive_members WHERE archive_id = ?", (archive_id,))
             cursor.execute("DELETE FROM archives WHERE id = ?", (archive_id,))
             
             # Commit transaction
-            conn.commit()
+            self.do_commit(conn)
             
             ret_str.append(f"[green]復元が完了しました[/green]")
             ret_str.append(f"  復元されたファイル数: {extracted_count}")
@@ -1168,7 +1759,166 @@ class DatabaseManager(db_reporter, db_loader):
             return ret_str, extracted_count
             
         except Exception as e:
-            conn.rollback()
+            self.do_rollback(conn)
             return [f"[red]復元中にエラーが発生しました: {e}[/red]"], None
         finally:
             cursor.close()
+
+    # verify_archives の問題の表示名
+    VERIFY_PROBLEMS = {
+        "missing": "見つかりません",
+        "size": "サイズ不一致",
+        "crc": "CRC不一致",
+        "sha256": "SHA-256不一致",
+    }
+
+    def verify_archives(self, archive_ids: Optional[List[int]] = None,
+                        quick: bool = False) -> Tuple[Optional[str], Optional[List[Tuple]]]:
+        """Check archives against the member digests recorded at archive time
+
+        Archives are checked in parallel threads; no files are written.
+
+        Args:
+            archive_ids: Archives to check (all if None)
+            quick: Only compare sizes/CRCs from the zip central directory
+                   (tar: member headers, blob store: object file sizes)
+
+        Returns:
+            Tuple of (error message or None,
+                      rows of (archive_id, filename, codec, members, status, detail))
+        """
+        conn = self.get_connect()
+        if conn is None:
+            return "[red]データベースに接続できません[/red]", None
+        cursor = conn.cursor()
+        try:
+            query = "SELECT id, filename, codec FROM archives"
+            if archive_ids is not None:
+                query += f" WHERE id IN ({','.join('?' * len(archive_ids))})"
+            cursor.execute(query + " ORDER BY id", archive_ids or [])
+            archives = cursor.fetchall()
+            if archive_ids is not None:
+                missing = set(archive_ids) - {row[0] for row in archives}
+                if missing:
+                    return f"[red]アーカイブID {', '.join(map(str, sorted(missing)))} が見つかりません[/red]", None
+
+            expected = {}
+            for archive_id, _, codec_spec in archives:
+                cursor.execute("""
+                    SELECT m.name, m.sha256, m.size, m.crc32, b.codec, b.stored_size
+                    FROM archive_members m
+                    LEFT JOIN blobs b ON b.hash = m.sha256
+                    WHERE m.archive_id = ?
+                """, (archive_id,))
+                expected[archive_id] = {
+                    name: (archive_codec.MemberDigest(sha256, size, crc32), blob_codec, stored_size)
+                    for name, sha256, size, crc32, blob_codec, stored_size in cursor.fetchall()
+                }
+        except sqlite3.Error as e:
+            return f"[red]クエリ実行エラー: {e}[/red]", None
+        finally:
+            cursor.close()
+
+        def verify(archive_id: int, filename: str, codec_spec: str) -> Dict[str, str]:
+            members = expected[archive_id]
+            if codec_spec == "blob":
+                return archive_codec.verify_blobs(Path(filename), members, quick)
+            return archive_codec.verify_archive(Path(filename), archive_codec.parse_codec(codec_spec),
+                                                {name: digest for name, (digest, _, _) in members.items()}, quick)
+
+        rows = []
+        workers = self.archive_workers or min(4, os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(archive, executor.submit(verify, *archive))
+                       for archive in archives if expected[archive[0]]]
+            results = {archive[0]: future for archive, future in futures}
+            for archive_id, filename, codec_spec in archives:
+                members = len(expected[archive_id])
+                if archive_id not in results:
+                    rows.append((archive_id, filename, codec_spec, 0, "SKIP", "メンバー情報なし (整合性情報の記録前に作成)"))
+                    continue
+                try:
+                    problems = results[archive_id].result()
+                except Exception as e:
+                    rows.append((archive_id, filename, codec_spec, members, "NG", f"読み込みエラー: {e}"))
+                    continue
+                if problems:
+                    detail = ", ".join(f"{name}: {self.VERIFY_PROBLEMS.get(problem, problem)}"
+                                       for name, problem in sorted(problems.items()))
+                    rows.append((archive_id, filename, codec_spec, members, "NG", detail))
+                else:
+                    rows.append((archive_id, filename, codec_spec, members, "OK", ""))
+        return None, rows
+
+    def known_blobs(self, cursor: sqlite3.Cursor, digests: List[str]) -> List[str]:
+        """Digests among the given ones that are registered in the blobs table"""
+        known = []
+        for digest in digests:
+            cursor.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,))
+            if cursor.fetchone():
+                known.append(digest)
+        return known
+
+    # Object files without a blobs row younger than this (seconds) are kept by gc: they may
+    # belong to an archive_csv that has not committed yet
+    GC_ORPHAN_GRACE = 24 * 60 * 60
+
+    def gc_blobs(self, dry_run: bool = False) -> Tuple[List[str], Optional[int]]:
+        """Drop blobs that no csvfiles row references, and object files without a blobs row
+        older than GC_ORPHAN_GRACE
+
+        Args:
+            dry_run: Only report what would be removed
+
+        Returns:
+            Tuple of (list of messages, number of removed blobs or None if failed)
+        """
+        conn = self.get_connect()
+        if conn is None:
+            return [f"[red]データベースに接続できません[/red]"], None
+        cursor = conn.cursor()
+        blob_dir = Path(self.blob_dir)
+        try:
+            if not dry_run:
+                self.do_begin(cursor)
+            cursor.execute("""
+                SELECT hash, stored_size FROM blobs
+                WHERE hash NOT IN (SELECT blob_hash FROM csvfiles WHERE blob_hash IS NOT NULL)
+                  AND hash NOT IN (SELECT org_blob_hash FROM csvfiles WHERE org_blob_hash IS NOT NULL)
+            """)
+            unreferenced = cursor.fetchall()
+            cursor.execute("SELECT hash FROM blobs")
+            registered = {row[0] for row in cursor.fetchall()}
+            # Object files left by an archive_csv that failed (temporary files may be in use).
+            # Recent ones may be written by an archive_csv still running, and are kept.
+            cutoff = time.time() - self.GC_ORPHAN_GRACE
+            unregistered = [(path, path.stat()) for path in blob_dir.glob("??/*")
+                            if path.is_file() and not path.name.endswith(".tmp") and path.name not in registered]
+            orphans = [path for path, stat in unregistered if stat.st_mtime < cutoff]
+            recent = len(unregistered) - len(orphans)
+            orphan_bytes = sum(stat.st_size for path, stat in unregistered if stat.st_mtime < cutoff)
+            unreferenced_bytes = sum(size for _, size in unreferenced)
+
+            ret_str = [f"[cyan]参照されていないblob: {len(unreferenced)} 件 ({unreferenced_bytes:,} bytes)[/cyan]",
+                       f"[cyan]DBに登録されていないオブジェクトファイル: {len(orphans)} 件 ({orphan_bytes:,} bytes)[/cyan]"]
+            if recent:
+                ret_str.append(f"[yellow]作成から{self.GC_ORPHAN_GRACE // 3600}時間以内の未登録オブジェクトファイル {recent} 件は削除しません[/yellow]")
+            if dry_run:
+                return ret_str + ["[yellow]--dry-run のため削除していません[/yellow]"], 0
+
+            cursor.executemany("DELETE FROM blobs WHERE hash = ?", [(digest,) for digest, _ in unreferenced])
+            self.do_commit(conn)
+            if self.atomic:
+                # Files are removed by the next gc once the transaction is committed
+                return ret_str + ["[yellow]atomicモードのためオブジェクトファイルは次回の gc で削除します[/yellow]"], len(unreferenced)
+
+            for path in [archive_codec.blob_path(blob_dir, digest) for digest, _ in unreferenced] + orphans:
+                path.unlink(missing_ok=True)
+            ret_str.append(f"[green]{len(unreferenced) + len(orphans)} 件 ({unreferenced_bytes + orphan_bytes:,} bytes) を削除しました[/green]")
+            return ret_str, len(unreferenced)
+
+        except Exception as e:
+            self.do_rollback(conn)
+            return [f"[red]gc中にエラーが発生しました: {e}[/red]"], None
+        finally:
+            cursor.close()
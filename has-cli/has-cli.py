@@ -1,10 +1,22 @@
 #!/usr/bin/env python3
 """
 家計簿データベース CLIインターフェースアプリケーション
+
+起動中のデーモンへ -c のコマンドを転送する場合は、標準ライブラリと cli_server だけを
+読み込んで転送する。rich や db_lib などCLIの実行に必要なモジュールは、このプロセスで
+コマンドを実行する場合に load_modules で読み込む。
 """
 
+from __future__ import annotations
+
+import time
+_T_START = time.perf_counter()
+
 import os
 import sys
+import copy
+import csv
+import json
 import argparse
 import readline  # コマンド履歴機能のため
 from pathlib import Path
@@ -12,16 +24,84 @@ from typing import Optional,Any,List,Tuple
 import platform
 
 import configparser
-
-from rich.console import Console
-from rich.table import Table
-#from rich.prompt import Prompt
-from rich.panel import Panel
-
-# db_lib.pyから必要なクラスをインポート
-from db_lib import DatabaseManager
-from transaction_journalizer import TransactionJournalizer
-from init_db import init_database
+# デーモンへの転送は標準ライブラリだけで行う
+import cli_server
+_T_STDLIB = time.perf_counter()
+
+# 起動処理の所要時間 (--timings で表示)
+STARTUP_TIMINGS: List[Tuple[str, float]] = [
+    ("import stdlib/readline/cli_server", _T_STDLIB - _T_START),
+]
+
+
+def record_timing(label: str, start: float) -> float:
+    """起動処理の所要時間を記録
+
+    Args:
+        label: 処理名
+        start: 開始時刻 (time.perf_counter)
+
+    Returns:
+        記録時点の時刻 (次の処理の開始時刻として使用)
+    """
+    now = time.perf_counter()
+    STARTUP_TIMINGS.append((label, now - start))
+    return now
+
+
+def load_modules():
+    """CLIの実行に必要なモジュールを初回使用時にインポート
+
+    デーモンへ転送する -c では呼ばれない。pdf_extract のワーカー (spawn で __mp_main__ として
+    このファイルを読み込む) もこれらを読み込まない。
+    (transaction_journalizerはLLM関連の重い依存を含むため journalize 実行時に読み込む)
+    """
+    global Console, Table, Panel, DatabaseManager, PIVOT_DIMENSIONS, PIVOT_MEASURES, init_database
+    global profiler, jobs, journalize_metrics, pdf_extract, bank_parser, classifier, transfer_match
+    if "Console" in globals():
+        return
+    start = time.perf_counter()
+    from rich.console import Console
+    from rich.table import Table
+    from rich.panel import Panel
+    start = record_timing("import rich", start)
+    from db_lib import DatabaseManager, PIVOT_DIMENSIONS, PIVOT_MEASURES
+    from init_db import init_database
+    import profiler
+    import jobs
+    import journalize_metrics
+    import pdf_extract
+    import bank_parser
+    import classifier
+    import transfer_match
+    record_timing("import db_lib/init_db", start)
+
+
+def print_timings():
+    """起動処理・コマンド実行の所要時間を表示 (標準エラー出力)"""
+    # 表示のための rich の読み込みは合計に含めない
+    total = time.perf_counter() - _T_START
+    from rich.console import Console
+    from rich.table import Table
+    table = Table(title="起動時間")
+    table.add_column("処理", style="cyan")
+    table.add_column("時間 (ms)", justify="right", style="green")
+    for label, elapsed in STARTUP_TIMINGS:
+        table.add_row(label, f"{elapsed * 1000:,.1f}")
+    table.add_row("合計", f"{total * 1000:,.1f}", style="yellow")
+    Console(stderr=True).print(table)
+
+
+def import_journalizer():
+    """TransactionJournalizerクラスを初回使用時にインポート"""
+    first = "transaction_journalizer" not in sys.modules
+    start = time.perf_counter()
+    # sys.modules を直接参照すると、バックグラウンドジョブがインポート中の未初期化の
+    # モジュールを掴むことがある (import 文は初期化の完了を待つ)
+    from transaction_journalizer import TransactionJournalizer
+    if first:
+        record_timing("import transaction_journalizer", start)
+    return TransactionJournalizer
 
 
 class UniversalTabCompleter:
@@ -72,6 +152,61 @@ class UniversalTabCompleter:
         return None
 
 
+class CompletionIndex:
+    """DBから取得した補完候補（テーブル名・エージェント・アカウント・ID）のキャッシュ
+
+    初回の補完時にまとめて読み込み、書き込みコマンドの実行後 (invalidate) は
+    次の補完時に読み込み直す。
+    """
+
+    def __init__(self, loader):
+        """初期化
+
+        Args:
+            loader: 候補を {キー: 候補リスト} で返す関数
+        """
+        self.loader = loader
+        self.candidates: Optional[dict[str, List[str]]] = None
+
+    def invalidate(self):
+        """キャッシュを破棄（次の補完時に再読み込み）"""
+        self.candidates = None
+
+    def match(self, key: str, text: str) -> List[str]:
+        """キーの候補のうち text で始まるものを返す"""
+        if self.candidates is None:
+            try:
+                self.candidates = self.loader()
+            except Exception:
+                return []
+        return [c for c in self.candidates.get(key, []) if c.startswith(text)]
+
+    def completer(self, key: str):
+        """UniversalTabCompleter の "completer" に指定する関数を返す"""
+        return lambda text: self.match(key, text)
+
+
+# ディレクトリごとの (mtime_ns, [(名前, ディレクトリか)]) のキャッシュ
+_LISTDIR_CACHE: dict[str, Tuple[int, List[Tuple[str, bool]]]] = {}
+
+
+def cached_listdir(path: str) -> List[Tuple[str, bool]]:
+    """ディレクトリの内容を返す（更新時刻が変わらない間はキャッシュを使用）"""
+    mtime = os.stat(path).st_mtime_ns
+    cached = _LISTDIR_CACHE.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                entries.append((entry.name, entry.is_dir()))
+            except OSError:
+                entries.append((entry.name, False))
+    _LISTDIR_CACHE[path] = (mtime, entries)
+    return entries
+
+
 def complete_files(text):
     """ファイル名の補完"""
     matches = []
@@ -92,23 +227,33 @@ def complete_files(text):
     try:
         # ディレクトリ内のファイルを検索
         if os.path.exists(search_path):
-            for item in os.listdir(search_path):
+            for item, is_dir in cached_listdir(search_path):
                 if item.startswith(file_prefix):
                     full_path = os.path.join(search_path, item) if search_path != '.' else item
-                    if os.path.isdir(full_path):
+                    if is_dir:
                         matches.append(full_path + '/')
                     #elif item.endswith('.csv'):
                     else:
                         matches.append(full_path)
-    except PermissionError:
+    except (PermissionError, FileNotFoundError, NotADirectoryError):
         pass
         
     return sorted(matches)
 
 
+# 表示形式 (--format / format コマンド)
+OUTPUT_FORMATS = ["table", "tsv", "csv", "json"]
+
+
 class HasCLI:
     """家計簿データベースCLIアプリケーション"""
 
+    # DBの内容を変更するコマンド (実行時に補完候補のキャッシュを破棄する)
+    WRITE_COMMANDS = {
+        "register", "load_csv", "rollback_csv", "journalize", "ins_agent", "del_agent",
+        "ins_account", "del_account", "del_csvfile", "archive_csv", "extract", "dosql",
+    }
+
     def __init__(self, config_path_str: str = "./config.ini"):
         """初期化
         
@@ -118,6 +263,12 @@ class HasCLI:
         self.console = Console()
         self.history_file = Path.home() / ".has_cli_history"
         self.jornalizers = {}
+        self.sql_cache = {}
+        self.show_timings = False
+        # 表示形式 (table: richのテーブル, tsv/csv/json: 標準出力へそのまま書き出す)
+        self.output_format = "table"
+        # デーモンで実行中のクライアントの作業ディレクトリ (コマンド中の相対パスの基準)
+        self.cwd: Optional[str] = None
 
         self.config = configparser.ConfigParser()
         config_path = Path(config_path_str)
@@ -132,19 +283,41 @@ class HasCLI:
         self.ddl_dir = self.config.get("database", "ddl_dir")
         self.sql_file_dir = self.config.get("database", "sql_file_dir", fallback='data/sql/')
         self.archive_file_format = self.config.get("archive", "archive_file_format", fallback="archive_{time}.zip")
-        self.db_manager = DatabaseManager(self.db_path, self.archive_file_format)
-        # タブ補完の設定
+        # アーカイブの圧縮形式 (deflate[:N]/store/xz[:N]/zstd[:N]) と圧縮スレッド数 (0: 自動)
+        self.archive_codec = self.config.get("archive", "codec", fallback="deflate")
+        self.archive_workers = self.config.getint("archive", "workers", fallback=0) or None
+        # アーカイブの保存先 (file: アーカイブファイル, blob: 重複排除するblobストア)
+        self.archive_store = self.config.get("archive", "store", fallback="file")
+        self.blob_dir = self.config.get("archive", "blob_dir", fallback="data/blobs")
+        # 振替の照合 (match_transfers) の日付の許容幅と、load_csv の後に自動で照合するか
+        self.transfer_window_days = self.config.getfloat("database", "transfer_window_days",
+                                                         fallback=transfer_match.DEFAULT_WINDOW_DAYS)
+        self.auto_match_transfers = self.config.getboolean("database", "auto_match_transfers", fallback=True)
+        self.db_manager = self.new_db_manager()
+        self.profiler = profiler.CommandProfiler(self.llm_time)
+        # バックグラウンドジョブ (末尾に & を付けたコマンド) はワーカー専用の接続で実行する
+        self.jobs = jobs.JobManager(self._run_job, self._close_job_db)
+        self.job_db: Optional[DatabaseManager] = None
+        # ジョブ専用の仕訳エージェント (フォアグラウンドと同じエージェントを同時に使っても
+        # キャンセル要求・集計・new_rows が混ざらないようにする)
+        self.job_jornalizers = {}
+        # ジョブとして実行中の場合のキャンセル要求 (threading.Event)
+        self.cancel_event = None
+        # タブ補完の設定 (ID・エージェント・アカウント・テーブル名はDBから取得してキャッシュ)
+        self.completion_index = CompletionIndex(self.db_manager.completion_candidates)
+        index = self.completion_index
         self.completer = UniversalTabCompleter({
             "help": [],
             "tables": [],
             "balance": [],
-            "load_csv": [],
-            "rollback_csv": [],
-            "sum_log": [],
-            "ins_agent": [],
-            "del_account": [],
-            "del_agent": [],
-            "del_csvfile": [],
+            "load_csv": [{"completer": index.completer("unloaded_csvfiles")}],
+            "rollback_csv": [{"completer": index.completer("loaded_csvfiles")}],
+            "sum_log": [{"completer": index.completer("loaded_csvfiles")}],
+            "del_account": [{"completer": index.completer("account_ids")}],
+            "del_agent": [{"completer": index.completer("agent_ids")}],
+            "del_csvfile": [{"completer": index.completer("csvfiles")}],
+            "P": [{"completer": index.completer("tables")}],
+            "ins_account": [],
             "ins_agent": [
                 { "options":[]},
                 {
@@ -152,12 +325,15 @@ class HasCLI:
                 }
             ],
             "doSQL": [
+                {
+                    "completer": self.complete_sqlfiles,
+                },
                 {
                     "completer": self.complete_sqlfiles,
                 }
             ],
             "count": [
-                {"options": ["all", "accounts", "agents", "categories", "transactions", "tags", "csvfiles"]}
+                {"completer": lambda text: [c for c in ["all"] if c.startswith(text)] + index.match("tables", text)}
             ],
             "sum": [ 
                 {"options": ["day", "month", "year"]} 
@@ -168,22 +344,72 @@ class HasCLI:
             "sum_category": [ 
                 {"options": ["day", "month", "year"]} 
             ],
+            "pivot": [
+                {"options": list(PIVOT_DIMENSIONS)},
+                {"options": list(PIVOT_DIMENSIONS)},
+                {"options": list(PIVOT_MEASURES)}
+            ],
             "register": [
                 {
                     "completer": complete_files,
-                }
+                },
+                {"completer": index.completer("agents")}
             ],
             "journalize": [
-                { "options":[]},
+                {"completer": index.completer("agents")},
+                {
+                    # ファイル、またはアーカイブ済みのものを含むcsvfile ID
+                    "completer": lambda text: complete_files(text) + index.match("csvfiles", text),
+                }
+            ],
+            "parser_spec": [
+                {"completer": index.completer("agents")},
+                {"completer": lambda text: complete_files(text) + [c for c in ["--clear"] if c.startswith(text)]},
+            ],
+            "match_transfers": [{"options": ["1", "3", "7"]}],
+            "train_classifier": [{"options": ["0.8", "0.9", "0.95", "0.99"]}],
+            "pdf_extract": [
+                {"completer": lambda text: complete_files(text) + index.match("csvfiles", text)},
+            ],
+            "archive_csv": [{"completer": index.completer("csvfiles")}],
+            "extract": [{"completer": index.completer("archives")}],
+            "gc": [{"options": ["--dry-run"]}],
+            "verify_archive": [
+                {"completer": lambda text: [c for c in ["all"] if c.startswith(text)] + index.match("archives", text)},
+                {"options": ["--quick"]}
+            ],
+            "source": [
                 {
                     "completer": complete_files,
                 }
             ],
-            "archive_csv": [],
-            "extract": []
+            "format": [
+                {"options": OUTPUT_FORMATS}
+            ],
+            "stats": [
+                {"options": ["journalize"]}
+            ],
+            "jobs": [],
+            "wait": [{"completer": self.complete_job_ids}],
+            "cancel": [{"completer": self.complete_job_ids}],
+            "timing": [
+                {"options": ["on", "off"]},
+                {
+                    "completer": complete_files,
+                }
+            ]
         })
         self.setup_readline()
         
+    def new_db_manager(self) -> DatabaseManager:
+        """設定に従った DatabaseManager を作成 (未接続)"""
+        db_manager = DatabaseManager(self.db_path, self.archive_file_format,
+                                     self.archive_codec, self.archive_workers,
+                                     self.archive_store, self.blob_dir)
+        # timing on / --profile でコマンドごとのSQL・描画・LLM時間を計測する
+        db_manager.connection_factory = profiler.ProfilingConnection
+        return db_manager
+
     def setup_readline(self):
         """readlineの設定（コマンド履歴機能）"""
         # 履歴ファイルの読み込み
@@ -216,6 +442,8 @@ class HasCLI:
 
     def complete_sqlfiles(self, text: str) -> List[str]:
         """SQLファイル名の補完"""
+        if text.startswith('-'):
+            return [opt for opt in ["--plan"] if opt.startswith(text)]
         li = [ f for f in os.listdir(self.sql_file_dir) if f.startswith(text)]
         return [f for f in li if f.endswith('.sql')]
 
@@ -250,13 +478,296 @@ class HasCLI:
                     continue
                     
         return sorted(list(set(result)))  # Remove duplicates and sort
-        
+
+    def resolve_path(self, path: str) -> str:
+        """コマンドで指定されたパスを解決
+
+        デーモンで実行中は、相対パスをクライアントの作業ディレクトリ基準にする。
+
+        Args:
+            path: コマンドで指定されたパス
+
+        Returns:
+            解決したパス
+        """
+        if self.cwd is None or os.path.isabs(path):
+            return path
+        return os.path.join(self.cwd, path)
+
+    def split_redirect(self, parts: List[str]) -> Tuple[List[str], Optional[str]]:
+        """コマンド引数から出力先ファイルの指定 (> file) を取り出す
+
+        Args:
+            parts: コマンドを空白で分割したリスト
+
+        Returns:
+            (出力先指定を除いた引数リスト, 出力先ファイル名 または None)
+        """
+        for i, part in enumerate(parts):
+            if part == '>':
+                if i + 1 >= len(parts):
+                    raise ValueError("出力先ファイルが指定されていません")
+                return parts[:i] + parts[i + 2:], self.resolve_path(parts[i + 1])
+            if part.startswith('>') and len(part) > 1:
+                return parts[:i] + parts[i + 1:], self.resolve_path(part[1:])
+        return parts, None
+
+    def llm_time(self) -> float:
+        """仕訳エージェントのLLM呼び出しの累積時間 (秒)"""
+        return sum(tj.llm_time for tj in self.jornalizers.values())
+
+    def cmd_timing(self, mode: Optional[str], dump_dir: Optional[str] = None) -> bool:
+        """コマンドごとの計測 (プロファイル表示) の切り替え
+
+        Args:
+            mode: on/off (Noneの場合は現在の状態を表示)
+            dump_dir: 指定した場合はコマンドごとのcProfile結果を保存するディレクトリ
+        """
+        if mode is None:
+            state = "on" if self.profiler.enabled else "off"
+            dump = f" (cProfile: {self.profiler.dump_dir})" if self.profiler.dump_dir else ""
+            self.console.print(f"timing: {state}{dump}")
+            return True
+        if mode == "on":
+            self.profiler.enable(dump_dir)
+            self.console.print("[green]コマンドごとの計測を有効にしました[/green]")
+            if dump_dir:
+                self.console.print(f"[green]cProfileの結果を保存します: {dump_dir}[/green]")
+            return True
+        if mode == "off":
+            self.profiler.disable()
+            self.console.print("[green]コマンドごとの計測を無効にしました[/green]")
+            return True
+        self.console.print("使用法: timing [on [dump_dir]|off]", style="red", markup=False)
+        return False
+
+    def profile_command(self, command: str) -> bool:
+        """コマンドを計測しながら実行し、時間の内訳を表示
+
+        Args:
+            command: 実行するコマンド文字列
+
+        Returns:
+            bool: コマンドが正常に実行された場合True
+        """
+        success, prof = self.profiler.run(command, lambda: self.execute_command(command),
+                                          self.console, self.db_manager.conn)
+        query = prof.query
+        table = Table(title=f"プロファイル: {command}")
+        table.add_column("項目", style="cyan")
+        table.add_column("時間 (ms)", justify="right", style="green")
+        table.add_column("詳細", style="magenta")
+        table.add_row("SQL", f"{query.sql_time * 1000:,.1f}",
+                      f"{query.statements:,} 文 / {query.rows:,} 行取得 / VM {query.vm_steps:,}+ 命令")
+        table.add_row("描画 (rich)", f"{prof.render_time * 1000:,.1f}", "")
+        table.add_row("LLM", f"{prof.llm_time * 1000:,.1f}", "")
+        table.add_row("その他 (Python)", f"{prof.other_time * 1000:,.1f}", "")
+        table.add_row("合計", f"{prof.wall * 1000:,.1f}", prof.dump_file or "", style="yellow")
+        self.console.print(table)
+        return success
+
+    def _run_job(self, job: jobs.Job) -> bool:
+        """バックグラウンドジョブを実行 (ワーカースレッドから呼ばれる)
+
+        SQLiteの接続は作成したスレッドでしか使えないため、ワーカー専用の接続を
+        ワーカースレッドで開いて以降のジョブで使い回す。
+        """
+        if self.job_db is None:
+            job_db = self.new_db_manager()
+            res = job_db.connect()
+            if res is not None:
+                job.output.write(f"データベース接続エラー: {res}\n")
+                return False
+            self.job_db = job_db
+
+        # 出力・接続・仕訳エージェント・キャンセル要求を差し替えたコピーでコマンドを実行する
+        worker = copy.copy(self)
+        worker.console = Console(file=job.output, force_terminal=self.console.is_terminal,
+                                 width=self.console.width)
+        worker.db_manager = self.job_db
+        worker.jornalizers = self.job_jornalizers
+        worker.jobs = None
+        worker.cancel_event = job.cancel_event
+        worker.profiler = profiler.CommandProfiler(worker.llm_time)
+        job.interrupt = self.job_db.conn.interrupt
+        if job.cancel_event.is_set():
+            return False
+        return worker.execute_command(job.command)
+
+    def _close_job_db(self):
+        """ワーカー専用の接続を閉じる (ワーカースレッドから呼ばれる)"""
+        if self.job_db is not None:
+            self.job_db.disconnect()
+            self.job_db = None
+
+    def complete_job_ids(self, text: str) -> List[str]:
+        return [str(job.id) for job in self.jobs.running() if str(job.id).startswith(text)]
+
+    def submit_job(self, command: str) -> bool:
+        """コマンドをバックグラウンドジョブとして投入"""
+        if not command:
+            self.console.print("使用法: <command> &", style="red", markup=False)
+            return False
+        job = self.jobs.submit(command)
+        self.console.print(f"[{job.id}] {command}", markup=False)
+        return True
+
+    def report_jobs(self, show_output: bool = False):
+        """前回の表示以降に終了したジョブを表示
+
+        Args:
+            show_output: ジョブの出力も表示するか (コマンドモード・スクリプトモード用)
+        """
+        for job in self.jobs.pop_finished():
+            style = {jobs.DONE: "green", jobs.FAILED: "red"}.get(job.status, "yellow")
+            self.console.print(f"[{job.id}] {job.status} ({job.elapsed:.1f}s) {job.command}",
+                               style=style, markup=False)
+            if show_output:
+                self.console.file.write(job.output.getvalue())
+
+    def find_job(self, job_id: Optional[str]) -> Optional[jobs.Job]:
+        """ジョブIDからジョブを取得 (省略時は最後に投入したジョブ)"""
+        if job_id is None:
+            return self.jobs.get(self.jobs.next_id - 1)
+        if not job_id.isdigit() or self.jobs.get(int(job_id)) is None:
+            self.console.print(f"[red]エラー: ジョブが見つかりません: {job_id}[/red]")
+            return None
+        return self.jobs.get(int(job_id))
+
+    def cmd_jobs(self) -> bool:
+        """バックグラウンドジョブの一覧表示"""
+        if not self.jobs.jobs:
+            self.console.print("[yellow]ジョブはありません[/yellow]")
+            return True
+        table = Table(title="ジョブ一覧")
+        table.add_column("ID", style="cyan", justify="right")
+        table.add_column("状態", style="green")
+        table.add_column("実行時間 (s)", justify="right")
+        table.add_column("コマンド", style="magenta")
+        for job in self.jobs.jobs.values():
+            table.add_row(str(job.id), job.status, f"{job.elapsed:.1f}", job.command)
+        self.console.print(table)
+        return True
+
+    def cmd_wait(self, job_id: Optional[str]) -> bool:
+        """ジョブの終了を待って出力を表示 (Ctrl-Cで待機のみ中断)
+
+        Args:
+            job_id: ジョブID (省略時は最後に投入したジョブ)
+        """
+        job = self.find_job(job_id)
+        if job is None:
+            if job_id is None:
+                self.console.print("[yellow]ジョブはありません[/yellow]")
+            return False
+        try:
+            self.jobs.wait(job)
+        except KeyboardInterrupt:
+            self.console.print(f"\n[cyan]待機を中断しました (ジョブ {job.id} は実行を続けます)[/cyan]")
+            return False
+        self.console.file.write(job.output.getvalue())
+        # 終了状態を表示 (以降の終了通知には含めない)
+        self.report_jobs()
+        return job.status == jobs.DONE
+
+    def cmd_cancel(self, job_id: str) -> bool:
+        """ジョブのキャンセル
+
+        Args:
+            job_id: ジョブID
+        """
+        job = self.find_job(job_id)
+        if job is None:
+            return False
+        if not self.jobs.cancel(job):
+            self.console.print(f"[yellow]ジョブ {job.id} は既に終了しています ({job.status})[/yellow]")
+            return False
+        self.console.print(f"[green]ジョブ {job.id} にキャンセルを要求しました[/green]")
+        return True
+
+    def finish_jobs(self, show_output: bool = False):
+        """未完了のジョブの終了を待ってワーカーと仕訳エージェントのLLM呼び出しを停止 (Ctrl-Cで残りのジョブをキャンセル)
+
+        Args:
+            show_output: ジョブの出力も表示するか
+        """
+        pending = self.jobs.running()
+        if pending:
+            self.console.print(f"[cyan]バックグラウンドジョブの終了を待っています ({len(pending)} 件, Ctrl-Cでキャンセル)[/cyan]")
+        try:
+            for job in pending:
+                self.jobs.wait(job)
+        except KeyboardInterrupt:
+            for job in self.jobs.running():
+                self.jobs.cancel(job)
+        self.jobs.shutdown()
+        for tj in list(self.jornalizers.values()) + list(self.job_jornalizers.values()):
+            tj.close()
+        self.report_jobs(show_output)
+
+    def write_rows(self, f, fmt: str, names: List[str], batches, lineterminator: str = "\r\n") -> int:
+        """行データを tsv/csv/json (1行1オブジェクト) で書き出す
+
+        Args:
+            f: 出力先
+            fmt: tsv, csv, json
+            names: カラム名
+            batches: 行リストのイテラブル (fetchmanyの結果など)
+            lineterminator: tsv/csvの改行文字
+
+        Returns:
+            書き出した行数
+        """
+        count = 0
+        if fmt == "json":
+            for rows in batches:
+                f.writelines(json.dumps(dict(zip(names, row)), ensure_ascii=False) + "\n" for row in rows)
+                count += len(rows)
+        else:
+            writer = csv.writer(f, delimiter='\t' if fmt == 'tsv' else ',', lineterminator=lineterminator)
+            writer.writerow(names)
+            for rows in batches:
+                writer.writerows(rows)
+                count += len(rows)
+        return count
+
+    def emit_rows(self, names: List[str], rows) -> bool:
+        """表示形式が table 以外の場合に結果を標準出力へそのまま書き出す
+
+        Returns:
+            bool: 書き出した場合True (table形式の場合はFalseを返し、呼び出し側でテーブル表示する)
+        """
+        if self.output_format == "table":
+            return False
+        out = self.console.file
+        self.write_rows(out, self.output_format, names, [rows], lineterminator="\n")
+        out.flush()
+        return True
+
+    def cmd_format(self, fmt: Optional[str]) -> bool:
+        """表示形式の切り替え
+
+        Args:
+            fmt: table, tsv, csv, json (Noneの場合は現在の形式を表示)
+        """
+        if fmt is None:
+            self.console.print(f"format: {self.output_format}")
+            return True
+        if fmt not in OUTPUT_FORMATS:
+            self.console.print(f"[red]エラー: 不明な表示形式: {fmt} ({'/'.join(OUTPUT_FORMATS)})[/red]")
+            return False
+        self.output_format = fmt
+        self.console.print(f"[green]表示形式を {fmt} にしました[/green]")
+        return True
+
     def cmd_tables(self):
         """テーブル名のリスト表示"""
         err,results = self.db_manager.cmd_tables()
         if err:
             self.console.print(f"[red]エラー: {err}[/red]")
             return
+        if self.emit_rows(["テーブル名"], results):
+            return
 
         if results:
             table = Table(title="データベース内のテーブル")
@@ -278,6 +789,8 @@ class HasCLI:
         if err:
             self.console.print(f"[red]エラー: {err}[/red]")
             return
+        if self.emit_rows(["テーブル名", "件数"], results):
+            return
             
         if table_name.lower() =="all":
             result_table = Table(title="全テーブルの件数")
@@ -309,6 +822,8 @@ class HasCLI:
         if err is not None:
             self.console.print(f"[red]エラー '{err}' [/red]")
             return
+        if self.emit_rows([col[1] for col in columns], results):
+            return
         
         # データ行を追加
         if results:
@@ -338,6 +853,8 @@ class HasCLI:
             self.console.print(f"[red]エラー: {err}[/red]")
             return
         period_name = {"day":"日付","month":"年月","year":"年"}.get(period, "期間")
+        if self.emit_rows([period_name, "支出", "収入", "合計", "振替"], results):
+            return
         
         if results:
             table = Table(title=f"{period_name}別 取引サマリ")
@@ -373,6 +890,8 @@ class HasCLI:
             self.console.print(f"[red]エラー: {err}[/red]")
             return
         period_name = {"day":"日付","month":"年月","year":"年"}.get(period, "期間")
+        if self.emit_rows([period_name, "口座名", "支出", "収入", "合計", "振替", "残高"], results):
+            return
         
         if results:
             table = Table(title=f"アカウント別 {period_name}別 取引サマリ")
@@ -411,6 +930,8 @@ class HasCLI:
         if err is not None:
             self.console.print(f"[red]エラー: {err}[/red]")
             return
+        if self.emit_rows(["件数", "支出", "収入", "合計", "振替"], results):
+            return
         
         if results:
             table = Table(title=f"log_id={log_id} の取引サマリ")
@@ -447,6 +968,8 @@ class HasCLI:
             self.console.print(f"[red]エラー: {err}[/red]")
             return
         period_name = {"day":"日付","month":"年月","year":"年"}.get(period, "期間")
+        if self.emit_rows([period_name, "口座名", "カテゴリ", "支出", "収入", "合計", "振替", "残高"], results):
+            return
 
         if results:
             table = Table(title=f"アカウント-カテゴリ別 {period_name}別 取引サマリ")
@@ -475,7 +998,56 @@ class HasCLI:
         else:
             self.console.print("[yellow]データがありません[/yellow]")
 
-            
+    def cmd_pivot(self, rows: str, cols: str, measure: str = "total", number: Optional[int] = None,
+                  date_str: Optional[str] = None, outfile: Optional[str] = None):
+        """集計軸(行×列)のクロス集計表
+
+        Args:
+            rows: 行の集計軸 (category, type, account, day, month, year)
+            cols: 列の集計軸
+            measure: 集計値 (expense, income, total, transfer, balance, count)
+            number: 直近の期間数
+            date_str: 起点となる日付 (YYYY-MM-DD形式)
+            outfile: 出力先ファイル (.csv/.tsv/.json)。指定しない場合は画面に表示
+        """
+        err, pivot = self.db_manager.cmd_pivot(rows, cols, measure, number, date_str)
+        if err is not None:
+            self.console.print(f"{err}")
+            return
+        if pivot is None:
+            self.console.print("[yellow]データがありません[/yellow]")
+            return
+
+        if outfile:
+            suffix = Path(outfile).suffix.lower()
+            if suffix == '.csv':
+                pivot.to_csv(outfile, encoding='utf-8')
+            elif suffix == '.tsv':
+                pivot.to_csv(outfile, sep='\t', encoding='utf-8')
+            elif suffix == '.json':
+                pivot.to_json(outfile, orient='split', force_ascii=False)
+            else:
+                self.console.print(f"[red]エラー: 未対応の出力形式です: {outfile} (.csv/.tsv/.json)[/red]")
+                return
+            self.console.print(f"[green]{rows}×{cols} ({measure}) を出力しました: {outfile} ({len(pivot) - 1} 行 × {len(pivot.columns) - 1} 列)[/green]")
+            return
+
+        if self.emit_rows([rows] + [str(col) for col in pivot.columns],
+                          [(key, *values) for key, values in zip(pivot.index, pivot.to_numpy().tolist())]):
+            return
+
+        value_fmt = "{:,.0f}"
+        table = Table(title=f"{rows}×{cols} クロス集計 ({measure})")
+        table.add_column(rows, style="cyan", no_wrap=True)
+        for col in pivot.columns:
+            table.add_column(str(col), justify="right", style="yellow" if col == "合計" else None)
+        last = len(pivot.index) - 2  # 合計行の直前で区切り線を入れる
+        for i, (key, values) in enumerate(zip(pivot.index, pivot.to_numpy())):
+            table.add_row(str(key), *[value_fmt.format(v) if v else "0" for v in values],
+                          end_section=(i == last))
+        self.console.print(table)
+
+
     def cmd_balance(self, date_str: str):
         """指定日での残高の確認
         
@@ -487,6 +1059,8 @@ class HasCLI:
         if err is not None or target_date is None:
             self.console.print(f"[red]エラー: {err}[/red]")
             return
+        if self.emit_rows(["口座名", "支出", "収入", "残高"], results):
+            return
 
         if results:
             table = Table(title=f"{target_date} 時点の残高")
@@ -507,7 +1081,66 @@ class HasCLI:
         else:
             self.console.print("[yellow]データがありません[/yellow]")
             
-    def cmd_register(self, filename: str, agent_name: str, orginal_file: Optional[str] = None):
+    def cmd_stats(self, target: str, bank_name: Optional[str] = None, since: Optional[str] = None) -> bool:
+        """仕訳実行のメトリクス (journalize_metrics.jsonl) の集計表示
+
+        銀行・モデル・チャンクサイズごとにレイテンシのp50/p95、1行あたりのトークン数、
+        1秒あたりの処理行数を表示する。
+
+        Args:
+            target: 集計対象 (現在は journalize のみ)
+            bank_name: 銀行名 (省略時は全て)
+            since: 集計開始日 (YYYY-MM-DD形式)
+        """
+        if target != "journalize":
+            self.console.print(f"[red]エラー: 不明な集計対象: {target}[/red]")
+            return False
+        if since is not None and self.db_manager.strptime(since) is None:
+            self.console.print(f"[red]エラー: 日付の形式が正しくありません: {since}[/red]")
+            return False
+
+        file_config = self.config['file_config'] if 'file_config' in self.config else {}
+        path = journalize_metrics.metrics_path(file_config)
+        records = journalize_metrics.read_metrics(path, "chunk", bank_name, since)
+        if not records:
+            self.console.print(f"[yellow]データがありません ({path})[/yellow]")
+            return True
+
+        def fmt(val, spec):
+            return "-" if val is None else format(val, spec)
+
+        table = Table(title=f"仕訳メトリクス ({records[0]['time'][:10]}〜{records[-1]['time'][:10]})")
+        table.add_column("銀行", style="cyan")
+        table.add_column("モデル", style="magenta")
+        table.add_column("チャンク", justify="right")
+        table.add_column("実行数", justify="right")
+        table.add_column("行数 (入力/出力)", justify="right")
+        table.add_column("p50 (秒)", justify="right", style="green")
+        table.add_column("p95 (秒)", justify="right", style="green")
+        table.add_column("トークン/行", justify="right")
+        table.add_column("行/秒", justify="right", style="green")
+        table.add_column("リトライ/キャッシュ/ヘッジ", justify="right")
+        table.add_column("分類器", justify="right")
+        table.add_column("昇格率", justify="right")
+        for row in journalize_metrics.summarize_chunks(records):
+            table.add_row(
+                str(row["bank"]),
+                str(row["model"]),
+                str(row["chunk_size"]),
+                str(row["runs"]),
+                f"{row['rows_in']:,}/{row['rows_out']:,}",
+                fmt(row["p50"], ".2f"),
+                fmt(row["p95"], ".2f"),
+                fmt(row["tokens_per_row"], ",.0f"),
+                fmt(row["rows_per_sec"], ".2f"),
+                f"{row['retries']}/{row['cache_hits']}/{row['hedges']}",
+                fmt(row["bypass_rate"], ".0%"),
+                fmt(row["escalation_rate"], ".0%"),
+            )
+        self.console.print(table)
+        return True
+
+    def cmd_register(self, filename: str, agent_name: str, orginal_file: Optional[str] = None) -> bool:
         """ロード用のcsvファイルの登録
         
         Args:
@@ -520,16 +1153,18 @@ class HasCLI:
             if agent_id is None:
                 for mesg in mesgs:
                     self.console.print(f"[red]エラー: {mesg}[/red]")
-                return
+                return False
             for mesg in mesgs:
                 self.console.print(f"{mesg}")
 
             self.console.print(f"[green]CSVファイル '{filename}' を登録しました (ID: {agent_id})[/green]")
+            return True
             
         except Exception as e:
             self.console.print(f"[red]レジスタエラー: {e}[/red]")
+            return False
 
-    def cmd_del_agent(self, agent_id: str):
+    def cmd_del_agent(self, agent_id: str) -> bool:
         """エージェントテーブルのデータ削除
 
         Args:
@@ -540,15 +1175,17 @@ class HasCLI:
             mesg, res = self.db_manager.del_agent(agent_id_int)
             if res is None:
                 self.console.print(f"[red]エラー: {mesg}[/red]")
-                return
+                return False
             self.console.print(f"{mesg}")
 
             self.console.print(f"[green]エージェント'{agent_id}' を削除しました ({res})[/green]")
+            return True
             
         except Exception as e:
             self.console.print(f"[red]エラー: {e}[/red]")
+            return False
 
-    def cmd_del_csvfile(self, csvfile_id: str):
+    def cmd_del_csvfile(self, csvfile_id: str) -> bool:
         """エージェントテーブルのデータ削除
 
         Args:
@@ -559,14 +1196,16 @@ class HasCLI:
             mesg, res = self.db_manager.del_csvfile(csvfile_id_int)
             if res is None:
                 self.console.print(f"[red]エラー: {mesg}[/red]")
-                return
+                return False
             self.console.print(f"{mesg}")
             self.console.print(f"[green]csvfile '{csvfile_id}' を削除しました ({res})[/green]")
+            return True
             
         except Exception as e:
             self.console.print(f"[red]エラー: {e}[/red]")
+            return False
     
-    def cmd_ins_agent(self, name: str, prompt_file: str):
+    def cmd_ins_agent(self, name: str, prompt_file: str) -> bool:
         """エージェントの追加
         
         Args:
@@ -576,11 +1215,137 @@ class HasCLI:
         try:
             mesg, res = self.db_manager.insert_agent(name, prompt_file)
             self.console.print(f"{mesg}")
+            return res is not None
             
         except Exception as e:
             self.console.print(f"[red]エラー: {e}[/red]")
+            return False
     
-    def cmd_ins_account(self, name: str, account_type: str):
+    def cmd_parser_spec(self, agent_name: str, spec_file: Optional[str] = None) -> bool:
+        """エージェントのパーサー定義 (CSVの列の対応) の表示・設定・削除
+
+        Args:
+            agent_name: エージェント名
+            spec_file: パーサー定義のJSONファイル (省略時は表示、--clear で削除)
+        """
+        try:
+            if spec_file is None:
+                err, spec_json = self.db_manager.get_parser_spec(agent_name)
+                if err is not None:
+                    self.console.print(f"[red]エラー: {err}[/red]")
+                    return False
+                if not spec_json:
+                    self.console.print(f"[yellow]エージェント '{agent_name}' のパーサー定義は未設定です (LLMで行を解析します)[/yellow]")
+                    return True
+                self.console.print(json.dumps(json.loads(spec_json), ensure_ascii=False, indent=2), markup=False)
+                return True
+
+            if spec_file == "--clear":
+                spec_json = None
+            else:
+                with open(self.resolve_path(spec_file), 'r', encoding='utf-8') as f:
+                    spec_json = bank_parser.ParserSpec.from_json(f.read()).to_json()
+            mesg, agent_id = self.db_manager.set_parser_spec(agent_name, spec_json)
+            self.console.print(mesg)
+            return agent_id is not None
+
+        except (OSError, ValueError) as e:
+            self.console.print(f"[red]エラー: {e}[/red]")
+            return False
+
+    def cmd_match_transfers(self, window_str: Optional[str] = None) -> bool:
+        """振替の照合: 推定した振替の相手側を、相手口座の明細の取引と一括で紐付ける
+
+        両方の口座の明細をロードすると同じ振替が二重に計上されるため、金額と日付
+        (許容幅内) が一致する取引が1件だけの場合に推定した相手側を削除し、明細の取引を
+        同じ transfer_id にまとめる。候補が複数ある場合は曖昧として残す。
+
+        Args:
+            window_str: 日付の許容幅 (日数、省略時は [database] transfer_window_days)
+        """
+        try:
+            window_days = float(window_str) if window_str is not None else self.transfer_window_days
+        except ValueError:
+            self.console.print(f"[red]エラー: 日数が不正です: {window_str}[/red]")
+            return False
+        start = time.perf_counter()
+        err, result = self.db_manager.match_transfers(window_days)
+        if err is not None:
+            self.console.print(f"[red]エラー: {err}[/red]")
+            return False
+        elapsed = time.perf_counter() - start
+        rows = [(len(result.pairs), result.unmatched, result.ambiguous, round(elapsed, 3))]
+        if self.emit_rows(["照合済み", "相手なし", "曖昧", "時間 (秒)"], rows):
+            return True
+        self.console.print(f"[cyan]振替の照合 (±{window_days:g}日): [/cyan]"
+                           f"照合済み [green]{len(result.pairs)}[/green] / 相手なし {result.unmatched} / "
+                           f"曖昧 [yellow]{result.ambiguous}[/yellow] ({elapsed:.2f}秒)")
+        return True
+
+    def cmd_train_classifier(self, threshold_str: Optional[str] = None) -> bool:
+        """台帳の仕訳済みデータからカテゴリ分類器を学習してモデルファイルに保存
+
+        確信度がしきい値以上の行は journalize でLLMに問い合わせずに分類される。
+        学習データの一部 (5行に1行) で検証し、しきい値でのLLM省略率と正解率を表示する。
+
+        Args:
+            threshold_str: 検証に使う確信度のしきい値 (省略時は [classifier] threshold)
+        """
+        classifier_config = self.config['classifier'] if 'classifier' in self.config else {}
+        try:
+            threshold = float(threshold_str) if threshold_str is not None else classifier.threshold(classifier_config)
+        except ValueError:
+            self.console.print(f"[red]エラー: しきい値が不正です: {threshold_str}[/red]")
+            return False
+
+        start = time.perf_counter()
+        err, rows = self.db_manager.classifier_samples()
+        if err is not None:
+            self.console.print(f"[red]エラー: {err}[/red]")
+            return False
+        samples = [
+            classifier.Sample(f"{item or ''} {desc or ''}".strip(), amount or 0,
+                              classifier.Label(ctype, cname, transfer, tags or ""))
+            for item, desc, amount, ctype, cname, transfer, tags in rows
+        ]
+        if not samples:
+            self.console.print("[yellow]学習に使える仕訳済みの取引がありません[/yellow]")
+            return False
+
+        model, evaluation = classifier.train(samples, threshold)
+        path = classifier.model_file(classifier_config)
+        try:
+            model.save(path)
+        except OSError as e:
+            self.console.print(f"[red]エラー: {e}[/red]")
+            return False
+        elapsed = time.perf_counter() - start
+
+        def pct(value):
+            return "-" if value is None else f"{value:.1%}"
+
+        rows = [
+            ("学習行数", str(len(samples))),
+            ("ラベル数", str(len(model.labels))),
+            ("特徴数", str(len(model.vocabulary))),
+            ("検証行数", str(evaluation.samples)),
+            ("正解率", pct(evaluation.accuracy)),
+            ("しきい値", f"{threshold:g}"),
+            ("LLM省略率", pct(evaluation.bypass_rate)),
+            ("省略した行の正解率", pct(evaluation.bypass_accuracy)),
+            ("時間 (秒)", f"{elapsed:.2f}"),
+        ]
+        if self.emit_rows(["項目", "値"], rows):
+            return True
+        table = Table(title="カテゴリ分類器", caption=str(path))
+        table.add_column("項目", style="cyan")
+        table.add_column("値", justify="right", style="green")
+        for name, value in rows:
+            table.add_row(name, value)
+        self.console.print(table)
+        return True
+
+    def cmd_ins_account(self, name: str, account_type: str) -> bool:
         """アカウントの追加
         
         Args:
@@ -590,11 +1355,13 @@ class HasCLI:
         try:
             mesg, res = self.db_manager.insert_account(name, account_type)
             self.console.print(f"{mesg}")
+            return res is not None
             
         except Exception as e:
             self.console.print(f"[red]エラー: {e}[/red]")
+            return False
     
-    def cmd_del_account(self, account_id: str):
+    def cmd_del_account(self, account_id: str) -> bool:
         """アカウントの削除
         
         Args:
@@ -604,13 +1371,16 @@ class HasCLI:
             account_id_int = int(account_id)
             mesg, res = self.db_manager.del_account(account_id_int)
             self.console.print(f"{mesg}")
+            return res is not None
             
         except ValueError:
             self.console.print(f"[red]account_idは数値で指定してください: {account_id}[/red]")
+            return False
         except Exception as e:
             self.console.print(f"[red]エラー: {e}[/red]")
+            return False
             
-    def cmd_load_csv(self, csvfile_id: str):
+    def cmd_load_csv(self, csvfile_id: str) -> bool:
         """csvファイルのデータ読み込み実行
         
         Args:
@@ -623,7 +1393,7 @@ class HasCLI:
             err,result = self.db_manager.cmd_csvfiles(csvfile_id_int)
             if err is not None:
                 self.console.print(f"[red]エラー：csvfile_id '{csvfile_id}' が見つかりません。{err}[/red]")
-                return
+                return False
                 
             file_path, agent_name, loaded_date = result[0]
             
@@ -642,17 +1412,23 @@ class HasCLI:
                 self.console.print(f"  トランザクション数: {result.get('transactions_inserted', 0)}")
                 self.console.print(f"  タグ数: {result.get('tags_inserted', 0)}")
                 self.console.print(f"  ログID: {result.get('log_id', 'N/A')}")
+                if self.auto_match_transfers:
+                    return self.cmd_match_transfers()
+                return True
             else:
                 self.console.print(f"[red]CSVファイルのロードに失敗しました[/red]")
                 if result.get("error"):
                     self.console.print(f"  エラー: {result.get('error')}")
+                return False
                 
         except ValueError:
             self.console.print(f"[red]csvfile_idは数値で指定してください: {csvfile_id}[/red]")
+            return False
         except Exception as e:
             self.console.print(f"[red]ロードエラー: {e}[/red]")
+            return False
             
-    def cmd_rollback_csv(self, csvfile_id: str):
+    def cmd_rollback_csv(self, csvfile_id: str) -> bool:
         """指定したcsvfile_idでロードしたデータのロールバック
         
         Args:
@@ -665,48 +1441,138 @@ class HasCLI:
             if num_logs is None:
                 for mesg in mesgs:
                     self.console.print(f"[red]エラー: {mesg}[/red]")
-                return
+                return False
             for mesg in mesgs:
                 self.console.print(f"{mesg}")
 
             self.console.print(f"[green]ロールバックしました (ID: {csvfile_id})[/green]")
+            return True
 
         except ValueError as e:
             self.console.print(f"[red]csvfile_idは数値で指定してください: {csvfile_id}[/red]")
+            return False
         except Exception as e:
             self.console.print(f"[red]エラー: {e}[/red]")
+            return False
 
-    def cmd_journalize(self, bank_name: str, csvfile_path: str):
+    def cmd_journalize(self, bank_name: str, csvfile_path: str) -> bool:
         """指定したCSVファイルでロードしたデータの仕訳実行
 
         Args:
             bank_name: 銀行名
-            csvfile_path: CSVファイルのパス
+            csvfile_path: CSVファイルのパス、またはcsvfilesテーブルのID
+                (IDの場合は元ファイルをアーカイブから展開せずに読み込む)
         """
         try:
+            source = None
+            if csvfile_path.isdigit() and not Path(self.resolve_path(csvfile_path)).exists():
+                err, found = self.db_manager.csvfile_source(int(csvfile_path), original=True)
+                if found is None:
+                    self.console.print(f"[red]エラー: {err}[/red]")
+                    return False
+                csvfile_path, source = found
+                self.console.print(f"[cyan]元ファイルを読み込みます: {csvfile_path}[/cyan]")
+            else:
+                csvfile_path = self.resolve_path(csvfile_path)
+
             if bank_name not in self.jornalizers:
+                TransactionJournalizer = import_journalizer()
                 self.jornalizers[bank_name] = TransactionJournalizer(self.config, bank_name)
                 
             tj = self.jornalizers[bank_name]
 
-            output_csv, log_file = tj.process_file(csvfile_path)
+            # バックグラウンドジョブの場合は cancel でチャンクの区切りで中断する
+            tj.cancel_event = self.cancel_event
+            # パーサー定義 (agents.parser_spec) がある場合は行の解析をローカルで行い、LLMには分類のみ問い合わせる
+            _, spec_json = self.db_manager.get_parser_spec(bank_name)
+            tj.parser_spec = bank_parser.ParserSpec.from_json(spec_json) if spec_json else None
+            # 以前の明細と重複する行は、記録済みの仕訳結果 (journalized_rows) を再利用する
+            db_manager = self.db_manager
+            tj.seen_rows = lambda fingerprints: db_manager.get_journalized_rows(bank_name, fingerprints)[1]
+            cache_hits = tj.cache_hits
+            output_csv, log_file = tj.process_file(csvfile_path, source)
+            if tj.cache_hits > cache_hits:
+                self.console.print(f"[cyan]仕訳済みの行を再利用しました: {tj.cache_hits - cache_hits}行[/cyan]")
 
             mesg, num_logs = self.db_manager.register_agent(bank_name, str(tj.bank_prompt_file))
             if num_logs is None:
                 self.console.print(f"[red]エラー: {mesg}[/red]")
-                return
+                return False
             self.console.print(f"{mesg}")
 
+            if tj.new_rows:
+                mesg, _ = self.db_manager.save_journalized_rows(bank_name, tj.new_rows)
+                self.console.print(mesg)
+
+            # LLMで作成したパーサー定義を保存 (bootstrap_parser = true の場合)
+            if tj.parser_spec is not None and tj.parser_spec.to_json() != spec_json:
+                mesg, _ = self.db_manager.set_parser_spec(bank_name, tj.parser_spec.to_json())
+                self.console.print(mesg)
+
             mesg, num_logs = self.db_manager.register_csvfile(output_csv, bank_name,csvfile_path)
             if num_logs is None:
                 self.console.print(f"[red]エラー: {mesg}[/red]")
-                return
+                return False
             self.console.print(f"{mesg}")
+            return True
 
         except Exception as e:
             self.console.print(f"[red]エラー: {e}[/red]")
+            return False
+
+    def cmd_pdf_extract(self, targets: List[str]) -> bool:
+        """PDF明細の表抽出を実行してページキャッシュを作成 (journalize の前に実行しておく)
 
-    def cmd_archive_csv(self, csvfile_ids_str: str):
+        Args:
+            targets: PDFファイルのパス、またはcsvfilesテーブルのID (元ファイルをアーカイブから読み込む)
+        """
+        file_config = self.config['file_config'] if 'file_config' in self.config else {}
+        processing_config = self.config['processing'] if 'processing' in self.config else {}
+        extractor = pdf_extract.PdfTableExtractor(pdf_extract.cache_dir(file_config),
+                                                  int(processing_config.get('pdf_workers', 0)))
+        rows = []
+        success = True
+        for target in targets:
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                break
+            try:
+                if target.isdigit() and not Path(self.resolve_path(target)).exists():
+                    err, found = self.db_manager.csvfile_source(int(target), original=True)
+                    if found is None:
+                        self.console.print(f"[red]エラー: {err}[/red]")
+                        success = False
+                        continue
+                    path_str, source = found
+                    start = time.perf_counter()
+                    with source() as stream:
+                        result = extractor.extract(data=stream.read())
+                else:
+                    path_str = self.resolve_path(target)
+                    start = time.perf_counter()
+                    result = extractor.extract(path=Path(path_str))
+            except Exception as e:
+                self.console.print(f"[red]エラー: {target}: {e}[/red]")
+                success = False
+                continue
+            for warning in result.warnings:
+                self.console.print(f"[yellow]警告: {path_str}: {warning}[/yellow]")
+            rows.append((path_str, result.pages, result.cached, len(result.texts),
+                         round(time.perf_counter() - start, 3)))
+
+        if self.emit_rows(["ファイル", "ページ数", "キャッシュ済み", "表の数", "時間 (秒)"], rows):
+            return success
+        table = Table(title=f"PDF表抽出 (キャッシュ: {extractor.cache_dir})")
+        table.add_column("ファイル", style="cyan")
+        table.add_column("ページ数", justify="right")
+        table.add_column("キャッシュ済み", justify="right")
+        table.add_column("表の数", justify="right")
+        table.add_column("時間 (秒)", justify="right", style="green")
+        for path_str, pages, cached, tables, elapsed in rows:
+            table.add_row(path_str, str(pages), str(cached), str(tables), f"{elapsed:.2f}")
+        self.console.print(table)
+        return success
+
+    def cmd_archive_csv(self, csvfile_ids_str: str) -> bool:
         """CSVファイルをアーカイブする
         
         Args:
@@ -721,11 +1587,14 @@ class HasCLI:
                 
             if archive_id is None:
                 self.console.print(f"[red]アーカイブに失敗しました[/red]")
+                return False
+            return True
             
         except Exception as e:
             self.console.print(f"[red]エラー: {e}[/red]")
+            return False
 
-    def cmd_extract(self, archive_id: str):
+    def cmd_extract(self, archive_id: str) -> bool:
         """アーカイブからCSVファイルを復元する
         
         Args:
@@ -740,37 +1609,128 @@ class HasCLI:
                 
             if extracted_count is None:
                 self.console.print(f"[red]復元に失敗しました[/red]")
+                return False
+            return True
                 
         except ValueError:
             self.console.print(f"[red]archive_idは数値で指定してください: {archive_id}[/red]")
+            return False
         except Exception as e:
             self.console.print(f"[red]エラー: {e}[/red]")
+            return False
+
+    def cmd_verify_archive(self, target: str, quick: bool = False) -> bool:
+        """アーカイブの整合性を確認する (ファイルは書き出さない)
 
-    def cmd_doSQL(self, sqlfile: str, args: Tuple ):
+        Args:
+            target: アーカイブID (カンマ区切りやハイフン範囲指定可) または all
+            quick: zipのセントラルディレクトリのサイズ・CRCのみ確認
+        """
+        archive_ids = None
+        if target.lower() != "all":
+            archive_ids = self.parse_csvfile_ids(target)
+            if not archive_ids:
+                self.console.print(f"[red]archive_idは数値で指定してください: {target}[/red]")
+                return False
+        err, rows = self.db_manager.verify_archives(archive_ids, quick)
+        if err is not None:
+            self.console.print(err)
+            return False
+        ok = all(row[4] != "NG" for row in rows)
+        if self.emit_rows(["ID", "ファイル", "形式", "メンバー数", "結果", "詳細"], rows):
+            return ok
+        if not rows:
+            self.console.print("[yellow]アーカイブがありません[/yellow]")
+            return True
+
+        table = Table(title="アーカイブの整合性" + (" (quick)" if quick else ""))
+        table.add_column("ID", style="cyan", justify="right")
+        table.add_column("ファイル", style="magenta")
+        table.add_column("形式")
+        table.add_column("メンバー数", justify="right")
+        table.add_column("結果")
+        table.add_column("詳細", style="yellow")
+        styles = {"OK": "green", "NG": "red", "SKIP": "yellow"}
+        for archive_id, filename, codec, members, status, detail in rows:
+            table.add_row(str(archive_id), filename, codec, str(members),
+                          f"[{styles[status]}]{status}[/{styles[status]}]", detail)
+        self.console.print(table)
+        return ok
+
+    def cmd_gc(self, dry_run: bool = False) -> bool:
+        """参照されていないblobを削除する
+
+        Args:
+            dry_run: 削除せずに対象の件数とサイズだけ表示
+        """
+        mesgs, removed = self.db_manager.gc_blobs(dry_run)
+        for mesg in mesgs:
+            self.console.print(mesg)
+        return removed is not None
+
+    def load_sqlfile(self, sqlfile: str) -> Tuple[Optional[List[str]], str]:
+        """SQLファイルの読み込み（パスと更新時刻をキーにキャッシュ）
+
+        先頭行が '---col1,col2' の形式の場合はカラム名として扱う
+
+        Args:
+            sqlfile: SQLファイルのパス
+
+        Returns:
+            (カラム名のリスト または None, SQL文)
+        """
+        mtime = os.stat(sqlfile).st_mtime_ns
+        cached = self.sql_cache.get(sqlfile)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2]
+
+        with open(sqlfile, "r") as f:
+            lines = f.readlines()
+
+        if len(lines) > 1 and lines[0].startswith('---'):
+            columns = lines[0].strip().strip('-').strip().split(',')
+            sql = ''.join(lines[1:]).strip()
+        else:
+            columns = None
+            sql = ''.join(lines).strip()
+
+        self.sql_cache[sqlfile] = (mtime, columns, sql)
+        return columns, sql
+
+    def cmd_doSQL(self, sqlfile: str, args: Tuple, plan: bool = False, outfile: Optional[str] = None):
         """SQL文を実行
         Args:
-            sql: 実行するSQL文
+            sqlfile: 実行するSQLファイル
+            args: SQLのパラメータ
+            plan: Trueの場合は実行せずに EXPLAIN QUERY PLAN を表示
+            outfile: 出力先ファイル (.csv/.tsv/.jsonl)。指定した場合は結果を逐次書き出す
         """
         try:
             if not sqlfile or not os.path.exists(sqlfile):
                 self.console.print(f"[red]エラー: SQLファイル '{sqlfile}' が見つかりません[/red]")
                 return
 
-            with open(sqlfile, "r") as f:
-                sql = f.readlines()
-
-            if sql is None or len(sql) == 0:
+            columns, sql = self.load_sqlfile(sqlfile)
+            if not sql:
                 self.console.print(f"[red]エラー: SQL文が空です[/red]")
                 return
-            
-            if len(sql) > 1 and sql[0].startswith('---'):
-                columns = sql[0].strip().strip('-').strip().split(',')
-                sql = ''.join(sql[1:]).strip()
-            else:
-                columns = None
-                sql = ''.join(sql).strip()
 
+            if plan:
+                self.show_query_plan(sql, args)
+                return
+
+            if outfile:
+                self.export_query(sql, args, columns, outfile)
+                return
+
+            if self.output_format != "table":
+                self.stream_query(sql, args, columns)
+                return
+
+            # 同じSQL文字列はsqlite3の接続単位のステートメントキャッシュで再利用される
+            start = time.perf_counter()
             mesg,results = self.db_manager.execute_query(sql, args)
+            elapsed = time.perf_counter() - start
 
             if mesg is not None:
                 self.console.print(f"{mesg}")
@@ -790,11 +1750,159 @@ class HasCLI:
                     table.add_row(*[transform_value(row[i]) for i in range(len(row))])
 
                 self.console.print(table)
+            self.console.print(f"[cyan]{len(results):,} 行 ({elapsed:.3f} 秒)[/cyan]")
 
         except Exception as e:
             self.console.print(f"[red]エラー: {e}[/red]")
 
-    
+    def export_query(self, sql: str, args: Tuple, columns: Optional[List[str]], outfile: str,
+                     batch_size: int = 1000):
+        """SQLの実行結果をファイルへ逐次書き出す（fetchmanyで一定件数ずつ取得）
+
+        Args:
+            sql: 実行するSQL文
+            args: SQLのパラメータ
+            columns: SQLファイルのヘッダー行のカラム名 (Noneの場合はカーソルの列名を使用)
+            outfile: 出力先ファイル (.csv/.tsv/.jsonl)
+            batch_size: 一度に取得する行数
+        """
+        suffix = Path(outfile).suffix.lower()
+        if suffix not in ('.csv', '.tsv', '.jsonl'):
+            self.console.print(f"[red]エラー: 未対応の出力形式です: {outfile} (.csv/.tsv/.jsonl)[/red]")
+            return
+
+        start = time.perf_counter()
+        mesg, cursor = self.db_manager.execute_query_cursor(sql, args)
+        if mesg is not None or cursor is None:
+            self.console.print(f"{mesg}")
+            return
+
+        count = 0
+        try:
+            names = [d[0] for d in cursor.description or []]
+            if columns is not None and len(columns) == len(names):
+                names = columns
+
+            Path(outfile).parent.mkdir(parents=True, exist_ok=True)
+            with open(outfile, 'w', newline='', encoding='utf-8') as f:
+                fmt = "json" if suffix == '.jsonl' else suffix[1:]
+                count = self.write_rows(f, fmt, names, iter(lambda: cursor.fetchmany(batch_size), []))
+        finally:
+            cursor.close()
+
+        elapsed = time.perf_counter() - start
+        self.console.print(f"[green]{count:,} 行を出力しました: {outfile} ({elapsed:.3f} 秒)[/green]")
+
+    def stream_query(self, sql: str, args: Tuple, columns: Optional[List[str]], batch_size: int = 1000):
+        """SQLの実行結果を現在の表示形式 (tsv/csv/json) で標準出力へ逐次書き出す
+
+        Args:
+            sql: 実行するSQL文
+            args: SQLのパラメータ
+            columns: SQLファイルのヘッダー行のカラム名 (Noneの場合はカーソルの列名を使用)
+            batch_size: 一度に取得する行数
+        """
+        mesg, cursor = self.db_manager.execute_query_cursor(sql, args)
+        if mesg is not None or cursor is None:
+            self.console.print(f"{mesg}")
+            return
+        try:
+            names = [d[0] for d in cursor.description or []]
+            if columns is not None and len(columns) == len(names):
+                names = columns
+            out = self.console.file
+            self.write_rows(out, self.output_format, names, iter(lambda: cursor.fetchmany(batch_size), []),
+                            lineterminator="\n")
+            out.flush()
+        finally:
+            cursor.close()
+
+    def show_query_plan(self, sql: str, args: Tuple):
+        """EXPLAIN QUERY PLAN の結果をツリー状に表示
+
+        Args:
+            sql: 対象のSQL文
+            args: SQLのパラメータ
+        """
+        mesg, results = self.db_manager.explain_query(sql, args)
+        if mesg is not None:
+            self.console.print(f"{mesg}")
+            return
+
+        depth = {0: -1}
+        table = Table(title="クエリプラン")
+        table.add_column("id", justify="right", style="cyan")
+        table.add_column("parent", justify="right", style="cyan")
+        table.add_column("detail", no_wrap=False)
+        for node_id, parent, _, detail in results:
+            depth[node_id] = depth.get(parent, -1) + 1
+            style = "yellow" if "SCAN" in detail else None
+            table.add_row(str(node_id), str(parent), "  " * depth[node_id] + detail, style=style)
+        self.console.print(table)
+
+    def run_script(self, script_path: str, atomic: bool = False) -> bool:
+        """スクリプトファイルのコマンドを1つの接続で順に実行
+
+        空行と '#' で始まる行は無視する。exit/quit の行で終了する。
+
+        Args:
+            script_path: スクリプトファイルのパス
+            atomic: Trueの場合は全コマンドの書き込みを1トランザクションで実行し、
+                    いずれかが失敗した時点で中断してロールバックする
+
+        Returns:
+            bool: 全コマンドが正常に実行された場合True
+        """
+        if not os.path.exists(script_path):
+            self.console.print(f"[red]エラー: スクリプトファイル '{script_path}' が見つかりません[/red]")
+            return False
+
+        with open(script_path, 'r', encoding='utf-8') as f:
+            lines = [(n, line.strip()) for n, line in enumerate(f, 1)]
+        commands = [(n, line) for n, line in lines if line and not line.startswith('#')]
+
+        if atomic:
+            err = self.db_manager.begin_atomic()
+            if err is not None:
+                self.console.print(err)
+                return False
+
+        results = []
+        all_success = True
+        for line_no, command in commands:
+            if command.split()[0].lower() in ["exit", "quit"]:
+                break
+            self.console.print(f"[bold]{script_path}:{line_no}> {command}[/bold]")
+            start = time.perf_counter()
+            success = self.execute_command(command)
+            elapsed = time.perf_counter() - start
+            if atomic and self.db_manager.atomic_failed:
+                success = False
+            results.append((line_no, command, elapsed, success))
+            if not success:
+                all_success = False
+                if atomic:
+                    self.console.print(f"[red]{script_path}:{line_no} でエラーが発生したため中断します[/red]")
+                    break
+
+        if atomic:
+            if self.db_manager.end_atomic(commit=all_success):
+                self.console.print("[green]全コマンドの書き込みをコミットしました[/green]")
+            else:
+                self.console.print("[red]全コマンドの書き込みをロールバックしました (ファイル操作は元に戻りません)[/red]")
+
+        table = Table(title=f"{script_path} 実行結果")
+        table.add_column("行", justify="right", style="cyan")
+        table.add_column("コマンド", style="magenta")
+        table.add_column("時間 (秒)", justify="right", style="green")
+        table.add_column("結果", justify="center")
+        for line_no, command, elapsed, success in results:
+            table.add_row(str(line_no), command, f"{elapsed:.3f}",
+                          "[green]OK[/green]" if success else "[red]NG[/red]")
+        table.add_row("", "合計", f"{sum(r[2] for r in results):.3f}",
+                      f"{sum(1 for r in results if r[3])}/{len(commands)}", style="yellow")
+        self.console.print(table)
+        return all_success
 
     def save_history(self):
         """履歴を保存"""
@@ -822,6 +1930,24 @@ class HasCLI:
                 return False
                 
             cmd = parts[0].lower()
+
+            # 末尾の & はバックグラウンドジョブとして実行 (ジョブ内ではそのまま実行)
+            if command.strip().endswith("&"):
+                command = command.strip()[:-1].strip()
+                if self.jobs is not None:
+                    return self.submit_job(command)
+                parts = command.split()
+                if not parts:
+                    return False
+                cmd = parts[0].lower()
+
+            # 書き込みコマンドの後は補完候補を読み込み直す
+            if cmd in self.WRITE_COMMANDS:
+                self.completion_index.invalidate()
+
+            # timing on の間は計測しながら実行
+            if self.profiler.enabled and not self.profiler.active and cmd != "timing":
+                return self.profile_command(command)
             
             # 終了コマンド（非対話モードではスキップ）
             if cmd in ["exit", "quit"]:
@@ -882,6 +2008,18 @@ class HasCLI:
                     date_str = parts[3] if len(parts) > 3 else None
                     self.cmd_summary_category(parts[1], number, date_str)
 
+            # pivot コマンド
+            elif cmd == "pivot":
+                parts, outfile = self.split_redirect(parts)
+                if len(parts) < 3:
+                    self.console.print("使用法: pivot <rows> <cols> [measure] [number] [date] [> file]", style="red", markup=False)
+                    return False
+                else:
+                    measure = parts[3] if len(parts) > 3 else "total"
+                    number = int(parts[4]) if len(parts) > 4 else None
+                    date_str = parts[5] if len(parts) > 5 else None
+                    self.cmd_pivot(parts[1], parts[2], measure, number, date_str, outfile)
+
             # sum_log コマンド
             elif cmd == "sum_log":
                 if len(parts) < 2:
@@ -904,7 +2042,7 @@ class HasCLI:
                     self.console.print("[red]使用法: register <filename> <agent>[/red]")
                     return False
                 else:
-                    self.cmd_register(parts[1], parts[2])
+                    return self.cmd_register(self.resolve_path(parts[1]), parts[2])
                     
             # load_csv コマンド
             elif cmd == "load_csv":
@@ -912,7 +2050,7 @@ class HasCLI:
                     self.console.print("[red]使用法: load_csv <csvfile_id>[/red]")
                     return False
                 else:
-                    self.cmd_load_csv(parts[1])
+                    return self.cmd_load_csv(parts[1])
                     
             # rollback_csv コマンド
             elif cmd == "rollback_csv":
@@ -920,15 +2058,39 @@ class HasCLI:
                     self.console.print("[red]使用法: rollback_csv <csvfile_id>[/red]")
                     return False
                 else:
-                    self.cmd_rollback_csv(parts[1])
+                    return self.cmd_rollback_csv(parts[1])
 
             # journalize コマンド
             elif cmd == "journalize":
                 if len(parts) < 3:
-                    self.console.print("[red]使用法: journalize <bank_name> <csvfile_file>[/red]")
+                    self.console.print("[red]使用法: journalize <bank_name> <csvfile_file|csvfile_id>[/red]")
+                    return False
+                else:
+                    return self.cmd_journalize(parts[1], parts[2])
+
+            # parser_spec コマンド
+            elif cmd == "parser_spec":
+                if len(parts) < 2:
+                    self.console.print("使用法: parser_spec <agent_name> [<json_file>|--clear]", style="red", markup=False)
                     return False
                 else:
-                    self.cmd_journalize(parts[1], parts[2])
+                    return self.cmd_parser_spec(parts[1], parts[2] if len(parts) > 2 else None)
+
+            # match_transfers コマンド
+            elif cmd == "match_transfers":
+                return self.cmd_match_transfers(parts[1] if len(parts) > 1 else None)
+
+            # train_classifier コマンド
+            elif cmd == "train_classifier":
+                return self.cmd_train_classifier(parts[1] if len(parts) > 1 else None)
+
+            # pdf_extract コマンド
+            elif cmd == "pdf_extract":
+                if len(parts) < 2:
+                    self.console.print("[red]使用法: pdf_extract <pdf_file|csvfile_id> ...[/red]")
+                    return False
+                else:
+                    return self.cmd_pdf_extract(parts[1:])
 
             # del_agent コマンド
             elif cmd == "del_agent":
@@ -936,7 +2098,7 @@ class HasCLI:
                     self.console.print("[red]使用法: del_agent <agent_id>[/red]")
                     return False
                 else:
-                    self.cmd_del_agent(parts[1])
+                    return self.cmd_del_agent(parts[1])
 
             # del_csvfile コマンド
             elif cmd == "del_csvfile":
@@ -944,7 +2106,7 @@ class HasCLI:
                     self.console.print("[red]使用法: del_csvfile <csvfil_id>[/red]")
                     return False
                 else:
-                    self.cmd_del_csvfile(parts[1])
+                    return self.cmd_del_csvfile(parts[1])
             
             # ins_agent コマンド
             elif cmd == "ins_agent":
@@ -952,7 +2114,7 @@ class HasCLI:
                     self.console.print("[red]使用法: ins_agent <name> <prompt_file>[/red]")
                     return False
                 else:
-                    self.cmd_ins_agent(parts[1], parts[2])
+                    return self.cmd_ins_agent(parts[1], self.resolve_path(parts[2]))
             
             # ins_account コマンド
             elif cmd == "ins_account":
@@ -960,7 +2122,7 @@ class HasCLI:
                     self.console.print("[red]使用法: ins_account <name> <account_type>[/red]")
                     return False
                 else:
-                    self.cmd_ins_account(parts[1], parts[2])
+                    return self.cmd_ins_account(parts[1], parts[2])
             
             # del_account コマンド
             elif cmd == "del_account":
@@ -968,7 +2130,7 @@ class HasCLI:
                     self.console.print("[red]使用法: del_account <account_id>[/red]")
                     return False
                 else:
-                    self.cmd_del_account(parts[1])
+                    return self.cmd_del_account(parts[1])
 
             # archive_csv コマンド
             elif cmd == "archive_csv":
@@ -977,7 +2139,7 @@ class HasCLI:
                     self.console.print("[yellow]  例: archive_csv 1,3-5,7[/yellow]")
                     return False
                 else:
-                    self.cmd_archive_csv(parts[1])
+                    return self.cmd_archive_csv(parts[1])
 
             # extract コマンド
             elif cmd == "extract":
@@ -985,16 +2147,85 @@ class HasCLI:
                     self.console.print("[red]使用法: extract <archive_id>[/red]")
                     return False
                 else:
-                    self.cmd_extract(parts[1])
+                    return self.cmd_extract(parts[1])
+
+            # verify_archive コマンド
+            elif cmd == "verify_archive":
+                args = [p for p in parts[1:] if p != "--quick"]
+                if len(args) != 1:
+                    self.console.print("使用法: verify_archive <archive_ids>|all [--quick]", style="red", markup=False)
+                    return False
+                return self.cmd_verify_archive(args[0], "--quick" in parts[1:])
+
+            # gc コマンド
+            elif cmd == "gc":
+                if any(p != "--dry-run" for p in parts[1:]):
+                    self.console.print("使用法: gc [--dry-run]", style="red", markup=False)
+                    return False
+                return self.cmd_gc("--dry-run" in parts[1:])
+
+            # format コマンド
+            elif cmd == "format":
+                return self.cmd_format(parts[1].lower() if len(parts) > 1 else None)
+
+            # stats コマンド
+            elif cmd == "stats":
+                if len(parts) < 2:
+                    self.console.print("使用法: stats journalize [bank_name] [YYYY-MM-DD]", style="red", markup=False)
+                    return False
+                else:
+                    # 引数が1つの場合、日付形式なら集計開始日として扱う
+                    rest = parts[2:]
+                    if len(rest) == 1 and self.db_manager.strptime(rest[0]) is not None:
+                        rest = [None, rest[0]]
+                    bank_name = rest[0] if len(rest) > 0 else None
+                    since = rest[1] if len(rest) > 1 else None
+                    return self.cmd_stats(parts[1].lower(), bank_name, since)
+
+            # ジョブ管理コマンド
+            elif cmd == "jobs":
+                return self.cmd_jobs()
+
+            elif cmd == "wait":
+                return self.cmd_wait(parts[1] if len(parts) > 1 else None)
+
+            elif cmd == "cancel":
+                if len(parts) < 2:
+                    self.console.print("[red]使用法: cancel <job_id>[/red]")
+                    return False
+                return self.cmd_cancel(parts[1])
+
+            # timing コマンド
+            elif cmd == "timing":
+                mode = parts[1].lower() if len(parts) > 1 else None
+                dump_dir = self.resolve_path(parts[2]) if len(parts) > 2 else None
+                return self.cmd_timing(mode, dump_dir)
+
+            # source コマンド
+            elif cmd == "source":
+                atomic = "--atomic" in parts[1:]
+                files = [p for p in parts[1:] if p != "--atomic"]
+                if len(files) < 1:
+                    self.console.print("[red]使用法: source [--atomic] <script_file>[/red]")
+                    return False
+                else:
+                    return self.run_script(self.resolve_path(files[0]), atomic)
 
             elif cmd == "dosql":
+                parts, outfile = self.split_redirect(parts)
                 if len(parts) < 2:
-                    self.console.print("[red]使用法: dosql <sqlfile> [args ...][/red]")
+                    self.console.print("[red]使用法: dosql [--plan] <sqlfile> [args ...] [> file][/red]")
                     return False
                 else:
-                    sqlfile = self.sql_file_dir + parts[1]
+                    plan = parts[1] == "--plan"
+                    if plan:
+                        parts = parts[:1] + parts[2:]
+                    if len(parts) < 2:
+                        self.console.print("使用法: dosql --plan <sqlfile> [args ...]", style="red", markup=False)
+                        return False
+                    sqlfile = self.resolve_path(self.sql_file_dir + parts[1])
                     args = tuple(parts[2:]) if len(parts) > 2 else ()
-                    self.cmd_doSQL(sqlfile, args)        
+                    self.cmd_doSQL(sqlfile, args, plan, outfile)
                     
             else:
                 self.console.print(f"[red]不明なコマンド: {cmd}[/red]")
@@ -1019,19 +2250,46 @@ class HasCLI:
   sum <period> [num]                       - 取引サマリ (period: day/month/year)
   sum_account <period> [num [YYYY-MM-DD]]  - アカウント別サマリ
   sum_category <period> [num [YYYY-MM-DD]] - カテゴリ別サマリ
+  pivot <rows> <cols> [measure [num [YYYY-MM-DD]]] [> file]
+                                           - クロス集計 (軸: category/type/account/day/month/year,
+                                             値: expense/income/total/transfer/balance/count)
   balance YYYY-MM-DD                       - 指定日の残高確認
   register <file> <agent> [original_file]  - CSVファイル登録
-  load_csv <id>                            - CSVロード実行
+  load_csv <id>                            - CSVロード実行 (アーカイブ済みのファイルは展開せずに読み込む)
   sum_log <log_id>                         - 指定したcsvfile_idで登録された取引のサマリ合計表示
   rollback_csv <id>                        - CSVロールバック
   archive_csv <ids>                        - CSVファイルをアーカイブ (例: 1,3-5,7)
   extract <archive_id>                     - アーカイブからCSVファイルを復元
+  verify_archive <ids>|all [--quick]       - アーカイブの整合性確認 (SHA-256/サイズ/CRC,
+                                             --quick: zipのセントラルディレクトリのみ)
+  gc [--dry-run]                           - 参照されていないblobを削除 (store = blob)
   ins_agent <name> <prompt_file>           - エージェントの追加
   del_agent <agent_id>                     - エージェントテーブルのデータ削除
   ins_account <name> <account_type>        - アカウントの追加
   del_account <account_id>                 - アカウントの削除
   del_csvfile <csvfile_id>                 - csvfileテーブルのデータ削除
-  journalize <bank_name> <orgfile>         - orgfileの仕訳実行
+  journalize <bank_name> <orgfile|id>      - orgfileの仕訳実行 (IDの場合はアーカイブ済みでも展開せずに再仕訳)
+  parser_spec <agent> [<json>|--clear]     - パーサー定義 (CSVの列の対応) の表示・設定・削除
+                                             (設定時は日付・金額をローカルで解析し、LLMは分類のみ)
+  match_transfers [days]                   - 推定した振替の相手側を相手口座の明細の取引と照合して紐付け
+                                             (load_csv の後にも自動実行)
+  train_classifier [threshold]             - 仕訳済みの取引からカテゴリ分類器を学習
+                                             (確信度がしきい値以上の行はLLMに問い合わせない)
+  pdf_extract <pdf_file|id> ...            - PDF明細の表抽出 (ページ単位で並列実行しキャッシュ,
+                                             journalize はキャッシュ済みのページを再抽出しない)
+  source [--atomic] <script_file>          - スクリプトファイルのコマンドを順に実行
+                                             (--atomic: 全書き込みを1トランザクションで実行)
+  doSQL [--plan] <sqlfile> [args ...] [> file]
+                                           - SQLファイルの実行 (--plan: クエリプラン表示,
+                                             > file: .csv/.tsv/.jsonl へ逐次出力)
+  format [table|tsv|csv|json]              - 表示形式の切り替え (tsv/csv/json: 標準出力へそのまま出力)
+  stats journalize [bank] [YYYY-MM-DD]     - 仕訳実行のレイテンシ(p50/p95)・トークン数・処理速度の集計
+  <command> &                              - コマンドをバックグラウンドで実行 (例: journalize bank a.csv &)
+  jobs                                     - バックグラウンドジョブの一覧表示
+  wait [job_id]                            - ジョブの終了を待って出力を表示
+  cancel <job_id>                          - ジョブのキャンセル
+  timing [on [dump_dir]|off]               - コマンドごとのSQL/描画/LLM時間を表示
+                                             (dump_dir: cProfileの結果を保存)
   help                                     - ヘルプ表示
   exit/quit/Ctrl-D                         - 終了
 """
@@ -1053,16 +2311,43 @@ class HasCLI:
             command: 実行するコマンド
         """
         # データベース接続
+        start = time.perf_counter()
         res = self.db_manager.connect()
         if res is not None:
             self.console.print(f"[red]データベース接続エラー: {res}[/red]")
             sys.exit(1)
+        record_timing("db connect", start)
             
         # コマンド実行
+        start = time.perf_counter()
         success = self.execute_command(command)
+        record_timing(f"command: {command}", start)
         
         # 終了処理
+        self.finish_jobs(show_output=True)
         self.db_manager.disconnect()
+        if self.show_timings:
+            print_timings()
+        sys.exit(0 if success else 1)
+
+    def run_script_mode(self, script_path: str, atomic: bool = False):
+        """スクリプトモードでファイルのコマンドを実行して終了
+
+        Args:
+            script_path: スクリプトファイルのパス
+            atomic: 全書き込みを1トランザクションで実行するか
+        """
+        res = self.db_manager.connect()
+        if res is not None:
+            self.console.print(f"[red]データベース接続エラー: {res}[/red]")
+            sys.exit(1)
+
+        success = self.run_script(script_path, atomic)
+
+        self.finish_jobs(show_output=True)
+        self.db_manager.disconnect()
+        if self.show_timings:
+            print_timings()
         sys.exit(0 if success else 1)
 
     def run(self):
@@ -1087,6 +2372,9 @@ class HasCLI:
         # メインループ
         while True:
             try:
+                # 終了したバックグラウンドジョブの通知
+                self.report_jobs()
+
                 # プロンプト表示と入力取得
                 command = input("has-cli > ")
                 
@@ -1110,6 +2398,7 @@ class HasCLI:
                 
         # 終了処理
         self.save_history()
+        self.finish_jobs()
         self.db_manager.disconnect()
 
 
@@ -1129,6 +2418,21 @@ def main():
   python has-cli.py -c "count all"
   python has-cli.py -c "sum month 3"
   python has-cli.py -c "balance 2025-01-01"
+  python has-cli.py --format tsv -c "sum_category month 12" | sort -t$'\\t' -k4 -n
+
+  # 起動時間の内訳を表示
+  python has-cli.py --timings -c "count all"
+
+  # コマンドの時間の内訳 (SQL/描画/LLM) を表示し、cProfileの結果を ./prof に保存
+  python has-cli.py --profile ./prof -c "sum_category month 12"
+
+  # スクリプトモード (1つの接続で順に実行、--atomicで1トランザクション)
+  python has-cli.py -f monthly.has --atomic
+
+  # デーモンモード (起動中は -c のコマンドが自動的に転送される)
+  python has-cli.py --serve &
+  python has-cli.py -c "sum month 3"
+  python has-cli.py --stop
         """
     )
     parser.add_argument(
@@ -1136,6 +2440,19 @@ def main():
         type=str,
         help='実行するコマンドを指定 (非対話モード)'
     )
+    parser.add_argument(
+        '-f', '--file',
+        type=str,
+        help='スクリプトファイルのコマンドを1つの接続で順に実行 (非対話モード)'
+    )
+    parser.add_argument(
+        '--atomic',action='store_true',
+        help='-f 実行時に全コマンドの書き込みを1トランザクションで実行 (失敗時は全てロールバック)'
+    )
+    parser.add_argument(
+        '--format', choices=OUTPUT_FORMATS, default='table',
+        help='表示形式 (table: 表, tsv/csv/json: 標準出力へそのまま出力。パイプ処理向け)'
+    )
     parser.add_argument(
         '--config',
         type=str,
@@ -1146,12 +2463,59 @@ def main():
         '--initdb',action='store_true',
         help='データベースの初期化 '
     )
+    parser.add_argument(
+        '--timings',action='store_true',
+        help='起動処理(インポート・設定読み込み・DB接続)とコマンドの所要時間を表示'
+    )
+    
+    parser.add_argument(
+        '--profile', nargs='?', const='', metavar='DUMP_DIR',
+        help='コマンドごとのSQL・描画・LLM時間を表示 (DUMP_DIR指定時はcProfileの結果を保存)'
+    )
+
+    parser.add_argument(
+        '--serve',action='store_true',
+        help='デーモンモードで起動 (Unixソケットで -c のコマンドを受け付ける)'
+    )
+    parser.add_argument(
+        '--stop',action='store_true',
+        help='起動中のデーモンを停止'
+    )
+    parser.add_argument(
+        '--no-daemon',action='store_true',
+        help='デーモンが起動していても -c のコマンドをこのプロセスで実行'
+    )
     
     # 引数を解析
     args = parser.parse_args()
+
+    if args.stop or (args.command and not args.no_daemon and not args.serve and args.profile is None):
+        socket_path = cli_server.socket_path_from_config(args.config)
+        if args.stop:
+            if not cli_server.stop_server(socket_path):
+                print(f"デーモンは起動していません: {socket_path}", file=sys.stderr)
+                sys.exit(1)
+            sys.exit(0)
+        # デーモンが起動していればコマンドを転送して終了
+        start = time.perf_counter()
+        result = cli_server.forward_command(socket_path, args.command, args.format, args.config)
+        if result is not None:
+            record_timing(f"daemon: {args.command}", start)
+            if args.timings:
+                print_timings()
+            sys.exit(0 if result else 1)
     
+    # このプロセスでコマンドを実行する
+    load_modules()
+
     # CLIインスタンスを作成
+    start = time.perf_counter()
     cli = HasCLI(config_path_str=args.config)
+    record_timing("HasCLI init (config/readline)", start)
+    cli.show_timings = args.timings
+    cli.output_format = args.format
+    if args.profile is not None:
+        cli.profiler.enable(args.profile or None)
 
     if args.initdb:
         # データベースの初期化
@@ -1162,13 +2526,28 @@ def main():
         cli.console.print(f"[green]データベースを初期化しました: {cli.db_path}[/green]")
         sys.exit(0)
 
+    # デーモンモード
+    if args.serve:
+        res = cli.db_manager.connect()
+        if res is not None:
+            cli.console.print(f"[red]データベース接続エラー: {res}[/red]")
+            sys.exit(1)
+        code = cli_server.serve(cli, cli_server.socket_path_from_config(args.config), args.config)
+        cli.db_manager.disconnect()
+        sys.exit(code)
+
     # コマンドモードか対話モードかを判定
-    if args.command:
+    if args.file:
+        # スクリプトモード: ファイルのコマンドを順に実行して終了
+        cli.run_script_mode(args.file, args.atomic)
+    elif args.command:
         # コマンドモード: 指定されたコマンドを実行して終了
         cli.run_command_mode(args.command)
     else:
         # 対話モード: 通常の対話型インターフェースを起動
         cli.run()
+        if args.timings:
+            print_timings()
 
 
 if __name__ == "__main__":
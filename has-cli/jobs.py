@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+has-cli バックグラウンドジョブ
+==============================
+
+`journalize ... &` のように末尾に & を付けたコマンドをバックグラウンドで実行する。
+ジョブは1つのワーカースレッドで投入順に実行し (SQLiteの書き込みは1接続ずつのため)、
+対話シェルはその間もメインの接続でレポート等を実行できる。
+ジョブの出力はバッファに保存し、`wait <id>` で表示する。
+
+キャンセル:
+  - 待機中のジョブは実行せずに破棄する
+  - 実行中のジョブは cancel_event をセットし、ワーカーの接続で実行中のSQLを中断する
+    (仕訳はチャンクの区切りで中断する)
+"""
+
+import io
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+PENDING = "待機中"
+RUNNING = "実行中"
+DONE = "完了"
+FAILED = "失敗"
+CANCELLED = "キャンセル"
+
+
+class Job:
+    """バックグラウンドジョブ1件分の状態"""
+
+    def __init__(self, job_id: int, command: str):
+        self.id = job_id
+        self.command = command
+        self.status = PENDING
+        self.output = io.StringIO()
+        self.cancel_event = threading.Event()
+        # 実行中のSQLを中断する関数 (ワーカーの接続の interrupt)
+        self.interrupt: Optional[Callable[[], None]] = None
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.future: Optional[Future] = None
+
+    @property
+    def elapsed(self) -> float:
+        """実行時間 (秒)。未実行の場合は0"""
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def done(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+
+class JobManager:
+    """ジョブの投入・一覧・待機・キャンセル
+
+    Args:
+        runner: ワーカースレッドでジョブを実行する関数 (成功時True)
+        cleanup: 終了時にワーカースレッドで実行する関数 (ワーカーの接続を閉じる等)
+    """
+
+    def __init__(self, runner: Callable[[Job], bool], cleanup: Optional[Callable[[], None]] = None):
+        self.runner = runner
+        self.cleanup = cleanup
+        self.jobs: Dict[int, Job] = {}
+        self.next_id = 1
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.lock = threading.Lock()
+        self.unreported: List[Job] = []
+
+    def submit(self, command: str) -> Job:
+        """ジョブを投入"""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="has-cli-job")
+        job = Job(self.next_id, command)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        job.future = self.executor.submit(self._run, job)
+        return job
+
+    def _run(self, job: Job):
+        if job.cancel_event.is_set():
+            self._finish(job, CANCELLED)
+            return
+        job.status = RUNNING
+        job.started = time.time()
+        try:
+            success = self.runner(job)
+        except Exception as e:
+            job.output.write(f"エラー: {e}\n")
+            success = False
+        if job.cancel_event.is_set():
+            self._finish(job, CANCELLED)
+        else:
+            self._finish(job, DONE if success else FAILED)
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished = time.time()
+        job.interrupt = None
+        with self.lock:
+            self.unreported.append(job)
+
+    def get(self, job_id: int) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def running(self) -> List[Job]:
+        """未完了のジョブ"""
+        return [job for job in self.jobs.values() if not job.done]
+
+    def pop_finished(self) -> List[Job]:
+        """前回の呼び出し以降に終了したジョブ"""
+        with self.lock:
+            finished, self.unreported = self.unreported, []
+        return finished
+
+    def cancel(self, job: Job) -> bool:
+        """ジョブをキャンセル
+
+        Returns:
+            キャンセル要求を出せた場合True (終了済みの場合False)
+        """
+        if job.done:
+            return False
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            # 待機中のジョブは実行されない
+            self._finish(job, CANCELLED)
+            return True
+        if job.interrupt is not None:
+            job.interrupt()
+        return True
+
+    def wait(self, job: Job, timeout: Optional[float] = None) -> bool:
+        """ジョブの終了を待つ (Ctrl-C で待機を中断できるよう短い間隔で待つ)
+
+        Returns:
+            終了した場合True
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while not job.done:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def shutdown(self):
+        """ワーカースレッドを終了 (未完了のジョブは終了まで待つ)"""
+        if self.executor is not None:
+            if self.cleanup is not None:
+                self.executor.submit(self.cleanup)
+            self.executor.shutdown(wait=True)
+            self.executor = None
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Journalize Metrics
+==================
+
+JSONL metrics stream for journalize runs. One record is appended per chunk
+("event": "chunk") and per processed file ("event": "run"), beside the
+journalizer log files (file_config.log_format) unless file_config.metrics_file
+is set. The CLI `stats journalize` command aggregates these records.
+
+This module only uses the standard library so that the CLI can read metrics
+without importing the LLM stack.
+"""
+
+import datetime
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional
+
+DEFAULT_LOG_FORMAT = "./output/journalize_{time}.log"
+METRICS_FILE_NAME = "journalize_metrics.jsonl"
+
+
+def metrics_path(file_config: Mapping[str, str]) -> Path:
+    """Return the metrics file path for a [file_config] section"""
+    if file_config.get('metrics_file'):
+        return Path(file_config['metrics_file'])
+    log_format = file_config.get('log_format', DEFAULT_LOG_FORMAT)
+    return Path(log_format).parent / METRICS_FILE_NAME
+
+
+class MetricsWriter:
+    """Append metrics records to a JSONL file"""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def write(self, event: str, **fields: Any):
+        record = {"event": event, "time": datetime.datetime.now().isoformat(timespec="seconds")}
+        record.update(fields)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def read_metrics(path: Path, event: str, bank: Optional[str] = None,
+                 since: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Read metrics records
+
+    Args:
+        path: Metrics file path
+        event: Record type ("chunk" or "run")
+        bank: Only records of this bank if given
+        since: Only records at or after this date (YYYY-MM-DD) if given
+
+    Returns:
+        List of records (lines that cannot be parsed are skipped)
+    """
+    if not path.exists():
+        return []
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("event") != event:
+                continue
+            if bank is not None and record.get("bank") != bank:
+                continue
+            if since is not None and record.get("time", "") < since:
+                continue
+            records.append(record)
+    return records
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Linear-interpolated percentile (q: 0-100)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    lower = int(pos)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (pos - lower)
+
+
+def summarize_chunks(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Aggregate chunk records per (bank, model, chunk_size)
+
+    Returns:
+        One dict per group with runs, chunks, rows_in, rows_out, p50/p95 latency,
+        tokens per row, rows per second, retries, cache hits, the rows the
+        local classifier answered (classified, bypass_rate), the hedged
+        LLM requests (hedges) and the share of rows the cascade's fast model
+        sent to the main model (escalation_rate)
+    """
+    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    for record in records:
+        key = (record.get("bank"), record.get("model"), record.get("chunk_size"))
+        groups.setdefault(key, []).append(record)
+
+    summary = []
+    for (bank, model, chunk_size), group in sorted(groups.items(), key=lambda kv: [str(k) for k in kv[0]]):
+        latencies = [r.get("latency", 0.0) for r in group]
+        rows_in = sum(r.get("rows_in", 0) for r in group)
+        tokens = sum(r.get("prompt_tokens", 0) + r.get("completion_tokens", 0) for r in group)
+        classified = sum(r.get("classified", 0) for r in group)
+        cascade_rows = sum(r.get("cascade_rows", 0) for r in group)
+        total_latency = sum(latencies)
+        summary.append({
+            "bank": bank,
+            "model": model,
+            "chunk_size": chunk_size,
+            "runs": len({r.get("run_id") for r in group}),
+            "chunks": len(group),
+            "rows_in": rows_in,
+            "rows_out": sum(r.get("rows_out", 0) for r in group),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "tokens_per_row": tokens / rows_in if rows_in else None,
+            "rows_per_sec": rows_in / total_latency if total_latency else None,
+            "retries": sum(r.get("retries", 0) for r in group),
+            "cache_hits": sum(r.get("cache_hits", 0) for r in group),
+            "classified": classified,
+            "bypass_rate": classified / rows_in if rows_in else None,
+            "hedges": sum(r.get("hedges", 0) for r in group),
+            "escalation_rate": sum(r.get("escalated", 0) for r in group) / cascade_rows if cascade_rows else None,
+        })
+    return summary
+
+
+def cascade_summary(stats: Mapping[str, float]) -> Dict[str, Any]:
+    """Escalation rate and estimated savings of a cascade run
+
+    Without the cascade, the main model would have journalized every row sent
+    to the fast model. Its tokens are estimated as the fast model's tokens,
+    and its time as the fast model's completion tokens at the main model's
+    seconds per completion token in this run (unknown if nothing was
+    escalated). tokens_saved is the main-model tokens not spent; latency_saved
+    subtracts the time of both tiers.
+
+    Args:
+        stats: Counters of the run (TransactionJournalizer.cascade_stats)
+    """
+    rows = int(stats["rows"])
+    latency_saved = None
+    if stats["strong_completion_tokens"]:
+        seconds_per_token = stats["strong_time"] / stats["strong_completion_tokens"]
+        latency_saved = round(stats["fast_completion_tokens"] * seconds_per_token
+                              - stats["fast_time"] - stats["strong_time"], 3)
+    return {
+        "cascade_rows": rows,
+        "escalated": int(stats["escalated"]),
+        "escalation_rate": round(stats["escalated"] / rows, 4) if rows else None,
+        "fast_tokens": int(stats["fast_tokens"]),
+        "strong_tokens": int(stats["strong_tokens"]),
+        "tokens_saved": int(stats["fast_tokens"] - stats["strong_tokens"]),
+        "latency_saved": latency_saved,
+    }
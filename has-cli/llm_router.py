@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+LLM Request Routing
+===================
+
+Routes the journalizer's LLM requests over one or more chat model backends
+([llm] backends), with hedged requests to cut tail latency.
+
+Each backend keeps its last WINDOW latencies and outcomes. A request goes
+to the best backend: backends that failed COOLDOWN_FAILURES times in a row
+are skipped for COOLDOWN seconds, the others are ranked by their median
+latency weighted by their error rate (a backend without history is tried
+first, so every backend gets measured).
+
+If the request has not answered by the backend's p95 latency (hedge_after
+seconds until MIN_SAMPLES latencies are known), a duplicate request is sent
+to the next backend (the same one if there is only one) and the first
+response is used. The slower request is not cancelled (the client calls
+are blocking, so clients should have a request timeout); its latency still
+feeds the statistics and its tokens are counted (take_discarded_usage). A
+failed request is retried on the next backend; the error is raised when all
+have failed. close() stops the request threads once the running requests
+have ended.
+"""
+
+import contextvars
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Latencies / outcomes kept per backend
+WINDOW = 100
+# Latencies needed before a backend's p95 is used as its hedge delay
+MIN_SAMPLES = 10
+# Hedge delay (seconds) of a backend without enough latencies
+DEFAULT_HEDGE_AFTER = 20.0
+# Weight of the error rate in the ranking (median latency * (1 + ERROR_PENALTY * error rate))
+ERROR_PENALTY = 4.0
+# A backend failing this many times in a row is skipped for COOLDOWN seconds
+COOLDOWN_FAILURES = 3
+COOLDOWN = 60.0
+
+
+class Backend:
+    """A chat model client and its recent latencies and outcomes"""
+
+    def __init__(self, name: str, client: Any):
+        self.name = name
+        self.client = client
+        self.latencies: Deque[float] = deque(maxlen=WINDOW)
+        self.outcomes: Deque[bool] = deque(maxlen=WINDOW)
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.calls = 0
+
+    def record(self, latency: float, ok: bool):
+        self.calls += 1
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.append(latency)
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= COOLDOWN_FAILURES:
+                self.cooldown_until = time.monotonic() + COOLDOWN
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Latency quantile (None without latencies)"""
+        if not self.latencies:
+            return None
+        if len(self.latencies) == 1:
+            return self.latencies[0]
+        return statistics.quantiles(self.latencies, n=100, method="inclusive")[round(q * 100) - 1]
+
+    def hedge_delay(self, hedge_after: float) -> float:
+        if len(self.latencies) < MIN_SAMPLES:
+            return hedge_after
+        return self.quantile(0.95) or hedge_after
+
+    def rank_key(self, now: float) -> Tuple[bool, float]:
+        median = self.quantile(0.5) or 0.0
+        return now < self.cooldown_until, median * (1 + ERROR_PENALTY * self.error_rate)
+
+
+class LLMRouter:
+    """Send requests to the best backend, hedging slow requests
+
+    Args:
+        backends: Backends in configured order (the order breaks ties)
+        hedge: Send a duplicate request when a request passes its hedge delay
+        hedge_after: Hedge delay of backends without enough latency history
+    """
+
+    def __init__(self, backends: List[Backend], hedge: bool = True, hedge_after: float = DEFAULT_HEDGE_AFTER):
+        if not backends:
+            raise ValueError("no LLM backend configured")
+        self.backends = backends
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.lock = threading.Lock()
+        # Requests sent as hedges, hedges answering first, and retries on another backend after an error
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        # Input / output tokens of responses that lost to a hedge, until taken by take_discarded_usage
+        self.discarded_tokens = [0, 0]
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(backends) + 2, thread_name_prefix="llm")
+
+    @property
+    def name(self) -> str:
+        return "+".join(backend.name for backend in self.backends)
+
+    def ranked(self) -> List[Backend]:
+        """Backends, best first"""
+        now = time.monotonic()
+        with self.lock:
+            return sorted(self.backends, key=lambda backend: backend.rank_key(now))
+
+    def _call(self, backend: Backend, messages: List[Any]) -> Any:
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = backend.client.invoke(messages)
+            ok = True
+            return response
+        finally:
+            with self.lock:
+                backend.record(time.perf_counter() - start, ok)
+
+    def _submit(self, backend: Backend, messages: List[Any], pending: Dict[Future, Backend]) -> Future:
+        # Run in a copy of the caller's context (LangSmith tracing is set with context variables)
+        future = self.executor.submit(contextvars.copy_context().run, self._call, backend, messages)
+        pending[future] = backend
+        return future
+
+    def _discarded(self, future: Future):
+        """Done callback of a request whose response is not used: count its tokens"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        usage = getattr(future.result(), "usage_metadata", None) or {}
+        with self.lock:
+            self.discarded_tokens[0] += usage.get("input_tokens", 0)
+            self.discarded_tokens[1] += usage.get("output_tokens", 0)
+
+    def take_discarded_usage(self) -> Tuple[int, int]:
+        """Input and output tokens of the discarded responses since the last call"""
+        with self.lock:
+            usage = tuple(self.discarded_tokens)
+            self.discarded_tokens = [0, 0]
+        return usage  # type: ignore[return-value]
+
+    def close(self):
+        """Stop the request threads (requests not started are cancelled, running ones are not waited for)"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def invoke(self, messages: List[Any]) -> Tuple[Any, Backend]:
+        """Send a request and return the first response and the backend that answered it
+
+        Raises:
+            The error of the last request when every backend has failed
+        """
+        queue = self.ranked()
+        pending: Dict[Future, Backend] = {}
+        current = queue.pop(0)
+        primary = self._submit(current, messages, pending)
+        deadline = time.monotonic() + current.hedge_delay(self.hedge_after)
+        hedged = not self.hedge
+        last_error: Optional[BaseException] = None
+        while True:
+            timeout = None if hedged else max(deadline - time.monotonic(), 0.0)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                backend = queue.pop(0) if queue else current
+                self._submit(backend, messages, pending)
+                hedged = True
+                with self.lock:
+                    self.hedges += 1
+                continue
+
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if future is not primary:
+                    with self.lock:
+                        self.hedge_wins += 1
+                for other in pending:
+                    other.add_done_callback(self._discarded)
+                return response, backend
+
+            if not pending:
+                if not queue:
+                    raise last_error  # type: ignore[misc]
+                current = queue.pop(0)
+                primary = self._submit(current, messages, pending)
+                deadline = time.monotonic() + current.hedge_delay(self.hedge_after)
+                hedged = not self.hedge
+                with self.lock:
+                    self.failovers += 1
+
+    def summary(self) -> List[str]:
+        """One line of statistics per backend"""
+        lines = []
+        with self.lock:
+            for backend in self.backends:
+                p50, p95 = backend.quantile(0.5), backend.quantile(0.95)
+                lines.append(f"{backend.name}: calls={backend.calls} errors={backend.error_rate:.0%} "
+                             f"p50={p50 or 0:.2f}s p95={p95 or 0:.2f}s")
+            lines.append(f"hedges={self.hedges} (won {self.hedge_wins}) failovers={self.failovers}")
+        return lines
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+PDF Table Extraction
+====================
+
+Page-level table extraction for PDF statements (PyMuPDF find_tables()),
+used by the journalizer's _read_pdf_file and the CLI `pdf_extract` command.
+
+Pages are extracted in a process pool (find_tables() is pure-Python heavy
+and holds the GIL), each worker opening the document once for its share of
+the pages. The text of every page is cached on disk, keyed by the SHA-256
+of the PDF content and the page number:
+
+  CACHE_DIR/v<EXTRACTOR_VERSION>/<sha256[:2]>/<sha256>/meta.json    page count
+  CACHE_DIR/v<EXTRACTOR_VERSION>/<sha256[:2]>/<sha256>/<page>.json  tables of a page
+
+so retries and re-journalizations of the same statement skip extraction
+(and do not even need PyMuPDF when every page is cached). Bumping
+EXTRACTOR_VERSION invalidates the cache when the text format changes.
+
+Workers are started with "spawn": the CLI runs background jobs and LLM
+requests in threads, and forking a multithreaded process can copy locks
+held by those threads into the child.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+DEFAULT_LOG_FORMAT = "./output/journalize_{time}.log"
+CACHE_DIR_NAME = "pdf_cache"
+
+# Version of the extracted text format (part of the cache key)
+EXTRACTOR_VERSION = 1
+
+# Documents with at most this many uncached pages are extracted in-process
+INLINE_PAGES = 2
+
+
+class ExtractResult(NamedTuple):
+    """Tables of a PDF, in page order"""
+    texts: List[str]
+    pages: int
+    cached: int
+    warnings: List[str]
+
+
+def cache_dir(file_config: Mapping[str, str]) -> Path:
+    """Return the page cache directory for a [file_config] section"""
+    if file_config.get('pdf_cache_dir'):
+        return Path(file_config['pdf_cache_dir'])
+    log_format = file_config.get('log_format', DEFAULT_LOG_FORMAT)
+    return Path(log_format).parent / CACHE_DIR_NAME
+
+
+def _fitz():
+    try:
+        import fitz  # pymupdf # type: ignore
+    except ImportError:
+        raise ImportError("pymupdf is required for PDF processing. Please install with: pip install pymupdf")
+    return fitz
+
+
+def _open_document(source: Union[str, bytes]):
+    fitz = _fitz()
+    if isinstance(source, bytes):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+
+def _page_tables(page, page_num: int) -> List[str]:
+    """Text of each table on a page (cells joined with |, one row per line)"""
+    text_list = []
+    for table_num, table in enumerate(page.find_tables()):
+        text = f"---------- Page {page_num + 1} --- Table {table_num + 1} -------------\n"
+        for row in table.extract():
+            if row and any(cell for cell in row if cell and cell.strip()):
+                clean_row = [str(cell).strip().replace("\n", "") for cell in row]
+                if clean_row:
+                    text += "|".join(clean_row) + "\n"
+        text_list.append(text.strip())
+    return text_list
+
+
+def _extract_pages(source: Union[str, bytes], page_nums: List[int]) -> List[Tuple[int, List[str], Optional[str]]]:
+    """Extract the tables of some pages (runs in a worker process)
+
+    Returns:
+        (page number, table texts, warning or None) per page
+    """
+    results = []
+    document = _open_document(source)
+    try:
+        for page_num in page_nums:
+            try:
+                results.append((page_num, _page_tables(document[page_num], page_num), None))
+            except Exception as e:
+                results.append((page_num, [], f"Table extraction failed on page {page_num + 1}: {e}"))
+    finally:
+        document.close()
+    return results
+
+
+def _write_json(path: Path, value):
+    """Write a cache file atomically (a cache file is either complete or absent)"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix=f"{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with open(fd, 'w', encoding='utf-8') as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def _read_json(path: Path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class PdfTableExtractor:
+    """Extract the tables of PDF files, page by page, with an on-disk cache
+
+    Args:
+        cache_dir: Page cache directory (None disables the cache)
+        workers: Number of worker processes (0: CPU count)
+    """
+
+    def __init__(self, cache_dir: Optional[Path], workers: int = 0):
+        self.cache_dir = cache_dir
+        self.workers = workers or os.cpu_count() or 1
+
+    def _doc_dir(self, digest: str) -> Optional[Path]:
+        if self.cache_dir is None:
+            return None
+        return self.cache_dir / f"v{EXTRACTOR_VERSION}" / digest[:2] / digest
+
+    def extract(self, path: Optional[Path] = None, data: Optional[bytes] = None) -> ExtractResult:
+        """Extract the tables of a PDF given as a file or as its content
+
+        Cached pages are read from the cache; the others are extracted
+        (in parallel if there are more than INLINE_PAGES) and cached.
+        """
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        doc_dir = self._doc_dir(hashlib.sha256(data).hexdigest())
+
+        meta = _read_json(doc_dir / "meta.json") if doc_dir else None
+        if meta is None:
+            document = _open_document(data)
+            try:
+                page_count = document.page_count
+            finally:
+                document.close()
+            if doc_dir:
+                _write_json(doc_dir / "meta.json", {"pages": page_count})
+        else:
+            page_count = meta["pages"]
+
+        pages: Dict[int, List[str]] = {}
+        if doc_dir:
+            for page_num in range(page_count):
+                cached = _read_json(doc_dir / f"{page_num}.json")
+                if cached is not None:
+                    pages[page_num] = cached
+        cached_count = len(pages)
+
+        missing = [page_num for page_num in range(page_count) if page_num not in pages]
+        warnings = []
+        for page_num, texts, warning in self._extract_missing(path, data, missing):
+            pages[page_num] = texts
+            if warning:
+                # Failed pages are not cached, so they are retried next time
+                warnings.append(warning)
+            elif doc_dir:
+                _write_json(doc_dir / f"{page_num}.json", texts)
+
+        texts = [text for page_num in range(page_count) for text in pages[page_num]]
+        return ExtractResult(texts, page_count, cached_count, warnings)
+
+    def _extract_missing(self, path: Optional[Path], data: bytes,
+                         missing: List[int]) -> List[Tuple[int, List[str], Optional[str]]]:
+        if not missing:
+            return []
+        # Workers open the file themselves when there is one, instead of receiving the content
+        source: Union[str, bytes] = str(path) if path is not None else data
+        workers = min(self.workers, len(missing))
+        if workers <= 1 or len(missing) <= INLINE_PAGES:
+            return _extract_pages(source, missing)
+        # Interleave the pages so that every worker gets a similar mix
+        batches = [missing[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(_extract_pages, source, batch) for batch in batches]
+            return [result for future in futures for result in future.result()]
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+has-cli コマンドプロファイラ
+============================
+
+`timing on` / `--profile` で有効化し、コマンドごとに以下を計測する。
+
+  - 実行時間 (wall)
+  - SQL時間: カーソルの execute/fetch に掛かった時間
+  - SQL文の数とSQLite VMの命令数 (sqlite3 の trace / progress コールバック)
+  - 取得行数: fetchone/fetchmany/fetchall で取得した行数
+  - 描画時間: console.print (rich) に掛かった時間
+  - LLM時間: 仕訳エージェントの LLM 呼び出しに掛かった時間
+
+dump_dir を指定した場合はコマンドごとの cProfile の結果を .prof ファイルとして保存する
+(`python -m pstats <file>` で関数単位の内訳を確認できる)。
+"""
+
+import cProfile
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional, Tuple
+
+# progress コールバックを呼び出すVM命令数の間隔
+PROGRESS_STEPS = 1000
+
+
+class QueryStats:
+    """1コマンド分のSQL計測値"""
+
+    def __init__(self):
+        self.sql_time = 0.0
+        self.statements = 0
+        self.vm_steps = 0
+        self.rows = 0
+
+    def on_trace(self, statement: str):
+        self.statements += 1
+
+    def on_progress(self) -> int:
+        self.vm_steps += PROGRESS_STEPS
+        return 0
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """計測中 (connection.stats が設定されている間) のみ実行・取得時間を集計するカーソル"""
+
+    def execute(self, *args):
+        stats = self.connection.stats
+        if stats is None:
+            return super().execute(*args)
+        start = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            stats.sql_time += time.perf_counter() - start
+
+    def executemany(self, *args):
+        stats = self.connection.stats
+        if stats is None:
+            return super().executemany(*args)
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            stats.sql_time += time.perf_counter() - start
+
+    def fetchone(self):
+        stats = self.connection.stats
+        if stats is None:
+            return super().fetchone()
+        start = time.perf_counter()
+        row = super().fetchone()
+        stats.sql_time += time.perf_counter() - start
+        if row is not None:
+            stats.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        stats = self.connection.stats
+        if stats is None:
+            return super().fetchmany(*args)
+        start = time.perf_counter()
+        rows = super().fetchmany(*args)
+        stats.sql_time += time.perf_counter() - start
+        stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        stats = self.connection.stats
+        if stats is None:
+            return super().fetchall()
+        start = time.perf_counter()
+        rows = super().fetchall()
+        stats.sql_time += time.perf_counter() - start
+        stats.rows += len(rows)
+        return rows
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """ProfilingCursor を生成する接続 (sqlite3.connect の factory に指定する)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats: Optional[QueryStats] = None
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        # Connection.execute は cursor() を経由しないため明示的に ProfilingCursor を使う
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def start_stats(self) -> QueryStats:
+        """計測を開始"""
+        self.stats = QueryStats()
+        self.set_trace_callback(self.stats.on_trace)
+        self.set_progress_handler(self.stats.on_progress, PROGRESS_STEPS)
+        return self.stats
+
+    def stop_stats(self) -> Optional[QueryStats]:
+        """計測を終了して結果を返す"""
+        stats, self.stats = self.stats, None
+        self.set_trace_callback(None)
+        self.set_progress_handler(None, PROGRESS_STEPS)
+        return stats
+
+
+class CommandProfile:
+    """1コマンド分の計測結果"""
+
+    def __init__(self, command: str):
+        self.command = command
+        self.wall = 0.0
+        self.render_time = 0.0
+        self.llm_time = 0.0
+        self.query = QueryStats()
+        self.dump_file: Optional[str] = None
+
+    @property
+    def other_time(self) -> float:
+        """SQL・描画・LLM以外の時間 (Pythonの処理など)"""
+        return max(self.wall - self.query.sql_time - self.render_time - self.llm_time, 0.0)
+
+
+class CommandProfiler:
+    """コマンド実行を計測するプロファイラ
+
+    Args:
+        llm_clock: LLM呼び出しの累積時間 (秒) を返す関数
+    """
+
+    def __init__(self, llm_clock: Callable[[], float]):
+        self.llm_clock = llm_clock
+        self.enabled = False
+        self.dump_dir: Optional[Path] = None
+        self.active = False
+        self.count = 0
+
+    def enable(self, dump_dir: Optional[str] = None):
+        self.enabled = True
+        self.dump_dir = Path(dump_dir) if dump_dir else None
+        if self.dump_dir is not None:
+            self.dump_dir.mkdir(parents=True, exist_ok=True)
+
+    def disable(self):
+        self.enabled = False
+        self.dump_dir = None
+
+    def run(self, command: str, func: Callable[[], Any], console, conn) -> Tuple[Any, CommandProfile]:
+        """funcを計測しながら実行
+
+        Args:
+            command: コマンド文字列 (表示・ダンプファイル名用)
+            func: 実行する処理
+            console: 描画時間を計測する rich.Console
+            conn: SQLを計測する接続 (ProfilingConnection 以外の場合はSQLは計測しない)
+
+        Returns:
+            (funcの戻り値, 計測結果)
+        """
+        profile = CommandProfile(command)
+        profiling_conn = isinstance(conn, ProfilingConnection)
+        if profiling_conn:
+            conn.start_stats()
+
+        # console.print をインスタンス属性で差し替えて描画時間を集計する
+        original_print = console.print
+
+        def timed_print(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original_print(*args, **kwargs)
+            finally:
+                profile.render_time += time.perf_counter() - start
+
+        console.print = timed_print
+        cprof = cProfile.Profile() if self.dump_dir is not None else None
+        llm_start = self.llm_clock()
+        self.active = True
+        start = time.perf_counter()
+        try:
+            if cprof is not None:
+                result = cprof.runcall(func)
+            else:
+                result = func()
+        finally:
+            profile.wall = time.perf_counter() - start
+            self.active = False
+            profile.llm_time = self.llm_clock() - llm_start
+            del console.print
+            if profiling_conn:
+                profile.query = conn.stop_stats() or profile.query
+
+        if cprof is not None and self.dump_dir is not None:
+            name = re.sub(r"[^0-9A-Za-z_.-]+", "_", command)[:40].strip("_") or "command"
+            dump_file = self.dump_dir / f"{self.count + 1:03d}_{name}.prof"
+            cprof.dump_stats(dump_file)
+            profile.dump_file = str(dump_file)
+
+        self.count += 1
+        return result, profile
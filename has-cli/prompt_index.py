@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Bank Prompt Index
+=================
+
+Selects the existing bank prompts (prompts_format files, e.g. tr_*.txt) shown
+as examples when the journalizer asks the LLM to write the prompt of a new
+bank.
+
+Instead of inlining every prompt, the prompts most similar to the new file's
+format analysis are chosen: at most top_k of them, and no more than
+token_budget tokens in total. Similarity is the TF-IDF cosine of
+character bigrams of the NFKC-normalized text, which works for the Japanese
+column names and descriptions the prompts and the analysis share.
+
+The index (term counts and token count of each prompt) is kept in
+INDEX_FILE_NAME next to the prompts and updated only for files whose size or
+mtime changed, so onboarding a bank reads just the selected prompts. File
+contents are also cached in memory for the life of the process.
+
+Tokens are counted with the tiktoken encoding of the journalizer's model.
+Without tiktoken, or for a model tiktoken does not know (e.g. Claude), a
+character-based estimate is used. The index records which counter produced
+its token counts and is rebuilt when the counter changes.
+"""
+
+import json
+import math
+import os
+import tempfile
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+INDEX_FILE_NAME = ".prompt_index.json"
+INDEX_VERSION = 2
+
+DEFAULT_TOP_K = 3
+DEFAULT_TOKEN_BUDGET = 4000
+
+# Most frequent terms kept per prompt
+MAX_TERMS = 500
+
+# Contents of prompt files read by this process: path -> (mtime_ns, size, text)
+_contents: Dict[str, Tuple[int, int, str]] = {}
+
+
+class PromptExample(NamedTuple):
+    """A prompt selected as an example"""
+    name: str
+    text: str
+    tokens: int
+    score: float
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: one per non-ASCII character, one per four ASCII characters"""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + math.ceil((len(text) - non_ascii) / 4)
+
+
+@lru_cache(maxsize=None)
+def token_counter(model: Optional[str] = None) -> Tuple[str, Callable[[str], int]]:
+    """Name and function of the token counter for model
+
+    The model's tiktoken encoding; estimate_tokens when tiktoken is not installed,
+    does not know the model or cannot load its encoding.
+    """
+    if tiktoken is None or not model:
+        return "estimate", estimate_tokens
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except (KeyError, ValueError, OSError):
+        return "estimate", estimate_tokens
+    # Special-token text in a prompt is counted as ordinary text
+    return f"tiktoken:{encoding.name}", lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def terms(text: str) -> Counter:
+    """Character bigram counts of the normalized text (whitespace-only bigrams dropped)"""
+    text = " ".join(unicodedata.normalize("NFKC", text).lower().split())
+    return Counter(text[i:i + 2] for i in range(len(text) - 1) if text[i:i + 2].strip())
+
+
+def _read(path: Path, stat: os.stat_result) -> str:
+    key = str(path)
+    cached = _contents.get(key)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read().strip()
+    _contents[key] = (stat.st_mtime_ns, stat.st_size, text)
+    return text
+
+
+class PromptIndex:
+    """Index of the prompt files matching a glob pattern
+
+    Args:
+        pattern: Prompt file pattern, e.g. Path("./prompts/tr_*.txt")
+    """
+
+    def __init__(self, pattern: Path, model: Optional[str] = None):
+        self.directory = pattern.parent
+        self.pattern = pattern.name
+        self.index_file = self.directory / INDEX_FILE_NAME
+        self.warnings: List[str] = []
+        self.tokenizer, self.count_tokens = token_counter(model)
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get("version") == INDEX_VERSION and index.get("tokenizer") == self.tokenizer:
+                return index["entries"]
+        except (OSError, ValueError, AttributeError, KeyError):
+            pass
+        return {}
+
+    def _save(self, entries: Dict[str, dict]):
+        fd, tmp_name = tempfile.mkstemp(prefix=f"{self.index_file.name}.", suffix=".tmp", dir=self.directory)
+        try:
+            with open(fd, 'w', encoding='utf-8') as f:
+                json.dump({"version": INDEX_VERSION, "tokenizer": self.tokenizer, "entries": entries}, f,
+                          ensure_ascii=False)
+            os.replace(tmp_name, self.index_file)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+    def refresh(self) -> Dict[str, dict]:
+        """Return the index entries by file name, re-reading only new or changed files"""
+        entries = self._load()
+        current = {}
+        changed = False
+        for path in sorted(self.directory.glob(self.pattern)):
+            if path.name == INDEX_FILE_NAME:
+                continue
+            try:
+                stat = path.stat()
+                entry = entries.get(path.name)
+                if entry is None or (entry["mtime_ns"], entry["size"]) != (stat.st_mtime_ns, stat.st_size):
+                    text = _read(path, stat)
+                    entry = {
+                        "mtime_ns": stat.st_mtime_ns,
+                        "size": stat.st_size,
+                        "tokens": self.count_tokens(text),
+                        "terms": dict(terms(text).most_common(MAX_TERMS)),
+                    }
+                    changed = True
+                current[path.name] = entry
+            except (OSError, UnicodeDecodeError) as e:
+                self.warnings.append(f"Could not index prompt file {path}: {e}")
+        if changed or len(current) != len(entries):
+            try:
+                self._save(current)
+            except OSError as e:
+                self.warnings.append(f"Could not save prompt index {self.index_file}: {e}")
+        return current
+
+    def select(self, query: str, exclude: Optional[str] = None, top_k: int = DEFAULT_TOP_K,
+               token_budget: int = DEFAULT_TOKEN_BUDGET) -> List[PromptExample]:
+        """Select the prompts most similar to query
+
+        Args:
+            query: Text describing the new file (format analysis and data sample)
+            exclude: File name to leave out (the prompt being created)
+            top_k: Maximum number of prompts
+            token_budget: Maximum tokens of the selected prompts; prompts
+                that do not fit in what is left are skipped
+
+        Returns:
+            The selected prompts, most similar first
+        """
+        entries = {name: entry for name, entry in self.refresh().items() if name != exclude}
+        if not entries or top_k <= 0:
+            return []
+
+        df: Counter = Counter()
+        for entry in entries.values():
+            df.update(entry["terms"].keys())
+        idf = {term: math.log((len(entries) + 1) / (count + 1)) + 1 for term, count in df.items()}
+
+        def vector(counts: Dict[str, int]) -> Dict[str, float]:
+            weights = {term: count * idf[term] for term, count in counts.items() if term in idf}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            return {term: w / norm for term, w in weights.items()}
+
+        query_vector = vector(terms(query))
+        ranked = sorted(
+            ((sum(w * query_vector.get(term, 0.0) for term, w in vector(entry["terms"]).items()), name)
+             for name, entry in entries.items()),
+            key=lambda scored: (-scored[0], scored[1]))
+
+        selected = []
+        remaining = token_budget
+        for score, name in ranked:
+            if len(selected) >= top_k:
+                break
+            tokens = entries[name]["tokens"]
+            if tokens > remaining:
+                continue
+            path = self.directory / name
+            try:
+                text = _read(path, path.stat())
+            except (OSError, UnicodeDecodeError) as e:
+                self.warnings.append(f"Could not read prompt file {path}: {e}")
+                continue
+            selected.append(PromptExample(name, text, tokens, score))
+            remaining -= tokens
+        return selected
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Source File Reader
+==================
+
+Single-pass, streaming line reader for the CSV exports fed to journalize.
+
+The encoding is detected from a leading byte sample:
+  - UTF-8 BOM              -> utf-8-sig
+  - valid UTF-8            -> utf-8
+  - otherwise Shift_JIS    -> cp932 (the Windows superset of Shift_JIS that
+                              Japanese banks actually export, including
+                              NEC/IBM extension characters such as ① or 髙)
+
+The file is then decoded incrementally in BLOCK_SIZE blocks and yielded line
+by line, so memory use does not depend on the file size. A file whose sample
+is plain ASCII is read as UTF-8; if a later block turns out not to be UTF-8
+while everything before it was ASCII, decoding switches to cp932 (both are
+ASCII supersets, so the lines already yielded are the same either way).
+
+line_fingerprint() identifies a line across files: overlapping exports of the
+same account repeat rows, and journalize reuses the output of rows it has
+already journalized (journalized_rows table).
+"""
+
+import codecs
+import hashlib
+import re
+import unicodedata
+from typing import IO, Iterator, Optional
+
+# Bytes inspected to detect the encoding
+SAMPLE_SIZE = 64 * 1024
+
+# Read block size
+BLOCK_SIZE = 1024 * 1024
+
+# Version of the line normalization (part of the fingerprint)
+FINGERPRINT_VERSION = 1
+
+
+def _decodes(sample: bytes, encoding: str) -> bool:
+    """Whether sample is valid in encoding (a character cut at the end is allowed)"""
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def sniff_encoding(sample: bytes) -> str:
+    """Detect the encoding of a file from its leading bytes
+
+    Returns:
+        "utf-8-sig", "utf-8" or "cp932"; "utf-8" if no candidate fits, so
+        that reading the file reports the decode error
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if _decodes(sample, "utf-8"):
+        return "utf-8"
+    if _decodes(sample, "cp932"):
+        return "cp932"
+    return "utf-8"
+
+
+def line_fingerprint(line: str) -> str:
+    """SHA-256 of a normalized line
+
+    Lines differing only in width (NFKC), quoting or spacing around fields
+    have the same fingerprint.
+    """
+    text = unicodedata.normalize("NFKC", line).replace('"', "")
+    text = re.sub(r"\s*([,\t|])\s*", r"\1", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    return hashlib.sha256(f"v{FINGERPRINT_VERSION}:{text}".encode("utf-8")).hexdigest()
+
+
+class SourceReader:
+    """Read the lines of a binary stream, detecting its encoding
+
+    Args:
+        stream: Binary stream positioned at the start of the file
+        encoding: Encoding to use instead of detecting it
+
+    The encoding attribute is known after the first block is read (it may
+    still change from utf-8 to cp932 as described in the module docstring).
+    """
+
+    def __init__(self, stream: IO[bytes], encoding: Optional[str] = None):
+        self.stream = stream
+        self.forced = encoding is not None
+        self.encoding = encoding
+
+    def lines(self) -> Iterator[str]:
+        """Yield the lines of the file without line terminators (like str.splitlines)"""
+        block = self.stream.read(max(SAMPLE_SIZE, BLOCK_SIZE))
+        if self.encoding is None:
+            self.encoding = sniff_encoding(block[:SAMPLE_SIZE])
+        decoder = codecs.getincrementaldecoder(self.encoding)()
+        ascii_only = not self.forced
+        pending = ""
+        while block:
+            try:
+                text = decoder.decode(block)
+            except UnicodeDecodeError:
+                if not (ascii_only and self.encoding == "utf-8"):
+                    raise
+                self.encoding = "cp932"
+                decoder = codecs.getincrementaldecoder(self.encoding)()
+                text = decoder.decode(block)
+            ascii_only = ascii_only and block.isascii()
+            lines = (pending + text).splitlines(keepends=True)
+            # The last line may continue in the next block (also a trailing \r, whose \n may follow)
+            pending = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+            yield from "".join(lines).splitlines()
+            block = self.stream.read(BLOCK_SIZE)
+        pending += decoder.decode(b"", final=True)
+        yield from pending.splitlines()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Synthetic Ledger Generator
+==========================
+
+Generates realistic journalized data for measuring db_lib at scale:
+
+  csv: journalized CSV files (one per month, same columns as the journalizer
+       output) that can be registered and loaded with load_csv
+  db:  a database initialized from data/ddl and filled directly with bulk
+       inserts (accounts, categories, tags, transfers, transactions, csvfiles,
+       data_logs) in the same shape load_csv_file produces, for 10^6-10^7 rows
+
+Usage:
+  python synth_ledger.py db  ./bench.sqlite --rows 1000000
+  python synth_ledger.py csv ./synth_csv    --rows 100000 --years 2
+"""
+
+import argparse
+import csv
+import math
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from init_db import init_database
+
+CSV_HEADERS = ["date", "account", "type", "category", "transfer",
+               "amount", "item_name", "tags", "desc", "memo"]
+
+DEFAULT_DDL_DIR = Path(__file__).resolve().parent.parent / "data" / "ddl"
+
+# (name, account_type)
+ACCOUNT_BASES = [
+    ("メイン銀行", "銀行口座"), ("サブ銀行", "銀行口座"), ("ネット銀行", "銀行口座"),
+    ("クレジットカードA", "クレジットカード"), ("クレジットカードB", "クレジットカード"),
+    ("現金", "現金"), ("電子マネー", "電子マネー"), ("証券口座", "証券口座"),
+]
+
+# (name, type, median amount, item names)
+CATEGORY_BASES = [
+    ("食費", "expense", 1200, ["スーパー", "コンビニ", "ベーカリー", "弁当屋"]),
+    ("外食", "expense", 2500, ["レストラン", "カフェ", "居酒屋", "ファストフード"]),
+    ("日用品", "expense", 1500, ["ドラッグストア", "ホームセンター", "100円ショップ"]),
+    ("交通費", "expense", 600, ["JR", "地下鉄", "バス", "タクシー"]),
+    ("住居費", "expense", 85000, ["家賃", "管理費"]),
+    ("水道光熱費", "expense", 8000, ["電力会社", "ガス会社", "水道局"]),
+    ("通信費", "expense", 6000, ["携帯電話", "インターネット"]),
+    ("医療費", "expense", 3000, ["クリニック", "薬局", "歯科"]),
+    ("趣味・娯楽", "expense", 4000, ["書店", "映画館", "ゲームストア"]),
+    ("衣服", "expense", 6000, ["衣料品店", "靴店"]),
+    ("教育", "expense", 10000, ["学習塾", "オンライン講座"]),
+    ("保険", "expense", 12000, ["生命保険", "損害保険"]),
+    ("給与", "income", 300000, ["給与振込"]),
+    ("賞与", "income", 500000, ["賞与振込"]),
+    ("利息", "income", 50, ["普通預金利息"]),
+    ("その他収入", "income", 5000, ["ポイント還元", "払戻"]),
+]
+
+TAG_BASES = ["固定費", "変動費", "家族", "仕事", "旅行", "ポイント", "要確認", "立替", "サブスク", "特別費"]
+
+
+def make_master(n_accounts: int, n_categories: int, n_tags: int) -> Tuple[List[Tuple[str, str]], List[Tuple], List[str]]:
+    """Build account, category and tag masters of the requested sizes
+
+    Names beyond the built-in bases get a numeric suffix.
+    """
+    accounts = []
+    for i in range(n_accounts):
+        name, account_type = ACCOUNT_BASES[i % len(ACCOUNT_BASES)]
+        accounts.append((name if i < len(ACCOUNT_BASES) else f"{name}{i // len(ACCOUNT_BASES) + 1}", account_type))
+    categories = []
+    for i in range(n_categories):
+        name, cat_type, median, items = CATEGORY_BASES[i % len(CATEGORY_BASES)]
+        suffix = "" if i < len(CATEGORY_BASES) else str(i // len(CATEGORY_BASES) + 1)
+        categories.append((name + suffix, cat_type, median, items))
+    tags = [TAG_BASES[i % len(TAG_BASES)] + ("" if i < len(TAG_BASES) else str(i // len(TAG_BASES) + 1))
+            for i in range(n_tags)]
+    return accounts, categories, tags
+
+
+def generate_rows(n_rows: int, accounts: List[Tuple[str, str]], categories: List[Tuple], tags: List[str],
+                  start: datetime, days: int, transfer_ratio: float = 0.05, tag_ratio: float = 0.2,
+                  seed: int = 1) -> Iterator[Dict[str, str]]:
+    """Yield journalized rows in date order
+
+    Expenses are more frequent than income, amounts are log-normal around the
+    category median, and a share of rows are transfers between accounts
+    (card payments, withdrawals, charges).
+
+    Args:
+        n_rows: Number of rows
+        accounts, categories, tags: Masters from make_master
+        start: First transaction date
+        days: Number of days the rows are spread over
+        transfer_ratio: Share of transfer rows
+        tag_ratio: Share of rows with tags
+        seed: Random seed
+    """
+    rng = random.Random(seed)
+    expense_cats = [c for c in categories if c[1] == "expense"] or categories
+    income_cats = [c for c in categories if c[1] == "income"] or categories
+    transfer_cat = ("振替", "transfer", 30000, ["カード引落", "ATM引出", "チャージ"])
+    seconds = days * 86400
+
+    for i in range(n_rows):
+        when = start + timedelta(seconds=int(seconds * i / max(n_rows, 1)) + rng.randrange(60))
+        account = rng.choice(accounts)[0]
+        r = rng.random()
+        transfer = ""
+        if r < transfer_ratio and len(accounts) > 1:
+            cat_name, cat_type, median, items = transfer_cat
+            transfer = rng.choice([a[0] for a in accounts if a[0] != account])
+            sign = -1
+        elif r < transfer_ratio + 0.08:
+            cat_name, cat_type, median, items = rng.choice(income_cats)
+            sign = 1
+        else:
+            cat_name, cat_type, median, items = rng.choice(expense_cats)
+            sign = -1
+        amount = sign * max(1, round(median * math.exp(rng.gauss(0, 0.6))))
+        row_tags = ""
+        if tags and rng.random() < tag_ratio:
+            row_tags = "[" + "|".join(rng.sample(tags, min(len(tags), rng.randint(1, 2)))) + "]"
+        yield {
+            "date": when.strftime("%Y-%m-%d %H:%M:%S"),
+            "account": account,
+            "type": cat_type,
+            "category": cat_name,
+            "transfer": transfer,
+            "amount": str(amount),
+            "item_name": rng.choice(items),
+            "tags": row_tags,
+            "desc": "",
+            "memo": "",
+        }
+
+
+def write_csv_files(out_dir: Path, rows: Iterator[Dict[str, str]], prefix: str = "synth") -> List[Path]:
+    """Write rows to one journalized CSV file per month
+
+    Returns:
+        Paths of the written files
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths: List[Path] = []
+    month = None
+    csvfile = None
+    writer = None
+    try:
+        for row in rows:
+            if row["date"][:7] != month:
+                if csvfile is not None:
+                    csvfile.close()
+                month = row["date"][:7]
+                path = out_dir / f"{prefix}_{month.replace('-', '')}.csv"
+                csvfile = open(path, 'w', newline='', encoding='utf-8')
+                writer = csv.DictWriter(csvfile, fieldnames=CSV_HEADERS)
+                writer.writeheader()
+                paths.append(path)
+            writer.writerow(row)  # type: ignore[union-attr]
+    finally:
+        if csvfile is not None:
+            csvfile.close()
+    return paths
+
+
+def build_database(db_path: Path, ddl_dir: Path, rows: Iterator[Dict[str, str]],
+                   accounts: List[Tuple[str, str]], categories: List[Tuple], tags: List[str],
+                   agent_name: str = "synth", batch_size: int = 50000) -> Dict[str, int]:
+    """Create a database and bulk insert rows the way load_csv_file would
+
+    Each calendar month becomes one loaded csvfiles record with its data_logs
+    entry; transfer rows become a transfers record and two transactions.
+
+    Returns:
+        Row counts per table
+    """
+    init_database(db_path_arg=str(db_path), ddl_path_arg=str(ddl_dir))
+    conn = sqlite3.connect(str(db_path))
+    conn.execute("PRAGMA synchronous = OFF")
+    cur = conn.cursor()
+
+    cur.executemany("INSERT INTO accounts (name, account_type) VALUES (?, ?)", accounts)
+    account_ids = {name: aid for aid, name in cur.execute("SELECT id, name FROM accounts").fetchall()}
+    cur.executemany("INSERT INTO categories (name, type) VALUES (?, ?)", [(c[0], c[1]) for c in categories])
+    cur.execute("INSERT INTO categories (name, type) VALUES ('振替', 'transfer')")
+    category_ids = {(name, cat_type): cid for cid, name, cat_type in
+                    cur.execute("SELECT id, name, type FROM categories").fetchall()}
+    cur.executemany("INSERT INTO tags (name) VALUES (?)", [(t,) for t in tags])
+    tag_ids = {name: tid for tid, name in cur.execute("SELECT id, name FROM tags").fetchall()}
+    cur.execute("INSERT INTO agents (name, prompt_file) VALUES (?, '')", (agent_name,))
+    agent_id = cur.lastrowid
+
+    counts = {"transactions": 0, "transfers": 0, "transaction_tags": 0, "csvfiles": 0}
+    transactions: List[Tuple] = []
+    transaction_tags: List[Tuple[int, int]] = []
+    transfers: List[Tuple[int, str]] = []
+    transaction_id = 0
+    transfer_id = 0
+    log_id = 0
+    month = None
+    transfer_day = None
+    transfer_count = 0
+
+    def flush():
+        cur.executemany("INSERT INTO transfers (id, name) VALUES (?, ?)", transfers)
+        cur.executemany(
+            "INSERT INTO transactions (id, account_id, category_id, log_id, transfer_id, amount, "
+            "item_name, description, transaction_date, memo) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            transactions)
+        cur.executemany("INSERT INTO transaction_tags (transaction_id, tag_id) VALUES (?, ?)", transaction_tags)
+        transfers.clear()
+        transactions.clear()
+        transaction_tags.clear()
+
+    for row in rows:
+        if row["date"][:7] != month:
+            month = row["date"][:7]
+            loaded = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            cur.execute("INSERT INTO csvfiles (name, agent_id, loaded_date) VALUES (?, ?, ?)",
+                        (f"synth_{month.replace('-', '')}.csv", agent_id, loaded))
+            cur.execute("INSERT INTO data_logs (csvfile_id, update_date) VALUES (?, ?)", (cur.lastrowid, loaded))
+            log_id = cur.lastrowid
+            counts["csvfiles"] += 1
+
+        account_id = account_ids[row["account"]]
+        category_id = category_ids[(row["category"], row["type"])]
+        amount = float(row["amount"])
+        row_tags = [tag_ids[t] for t in row["tags"].strip("[]").split("|") if t]
+        legs = [(account_id, amount)]
+        tid = None
+        if row["transfer"]:
+            # Same naming as transferNameClass: YYYYMMDD_<n>
+            day = row["date"][:10]
+            if day != transfer_day:
+                transfer_day, transfer_count = day, 0
+            transfer_id += 1
+            tid = transfer_id
+            transfers.append((tid, f"{day.replace('-', '')}_{transfer_count}"))
+            transfer_count += 1
+            legs.append((account_ids[row["transfer"]], -amount))
+            counts["transfers"] += 1
+        for leg_account, leg_amount in legs:
+            transaction_id += 1
+            transactions.append((transaction_id, leg_account, category_id, log_id, tid, leg_amount,
+                                 row["item_name"], None, row["date"], None))
+            transaction_tags.extend((transaction_id, tag_id) for tag_id in row_tags)
+        if len(transactions) >= batch_size:
+            flush()
+
+    flush()
+    conn.commit()
+    counts["transactions"] = transaction_id
+    counts["transaction_tags"] = cur.execute("SELECT COUNT(*) FROM transaction_tags").fetchone()[0]
+    cur.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    return counts
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='合成家計簿データ (仕訳済みCSV / DB) の生成')
+    parser.add_argument('mode', choices=['csv', 'db'], help='csv: 月ごとの仕訳済みCSV, db: 直接DBを生成')
+    parser.add_argument('output', type=str, help='出力先 (csv: ディレクトリ, db: DBファイル)')
+    parser.add_argument('--rows', type=int, default=100000, help='取引行数 (デフォルト: 100000)')
+    parser.add_argument('--accounts', type=int, default=8, help='口座数 (デフォルト: 8)')
+    parser.add_argument('--categories', type=int, default=16, help='カテゴリ数 (デフォルト: 16)')
+    parser.add_argument('--tags', type=int, default=10, help='タグ数 (デフォルト: 10)')
+    parser.add_argument('--transfer-ratio', type=float, default=0.05, help='振替の割合 (デフォルト: 0.05)')
+    parser.add_argument('--start', type=str, default='2015-01-01', help='開始日 (デフォルト: 2015-01-01)')
+    parser.add_argument('--years', type=float, default=10, help='期間 (年, デフォルト: 10)')
+    parser.add_argument('--seed', type=int, default=1, help='乱数シード (デフォルト: 1)')
+    parser.add_argument('--ddl-dir', type=str, default=str(DEFAULT_DDL_DIR), help='DDLディレクトリ (db のみ)')
+    args = parser.parse_args(argv)
+
+    accounts, categories, tags = make_master(args.accounts, args.categories, args.tags)
+    rows = generate_rows(args.rows, accounts, categories, tags,
+                         start=datetime.strptime(args.start, "%Y-%m-%d"), days=max(1, int(args.years * 365)),
+                         transfer_ratio=args.transfer_ratio, seed=args.seed)
+    start = time.perf_counter()
+    if args.mode == 'csv':
+        paths = write_csv_files(Path(args.output), rows)
+        print(f"{len(paths)} files, {args.rows:,} rows -> {args.output} ({time.perf_counter() - start:.1f} s)")
+    else:
+        output = Path(args.output)
+        if output.exists():
+            print(f"エラー: ファイルが既に存在します: {output}", file=sys.stderr)
+            return 1
+        counts = build_database(output, Path(args.ddl_dir), rows, accounts, categories, tags)
+        summary = ", ".join(f"{k} {v:,}" for k, v in counts.items())
+        print(f"{output}: {summary} ({time.perf_counter() - start:.1f} s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
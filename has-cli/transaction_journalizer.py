@@ -12,12 +12,22 @@ import datetime
 import json
 import logging
 import os
+import time
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Any, TypedDict,Generator
+import itertools
+from typing import IO, Callable, ContextManager, Dict, Iterable, Iterator, List, Optional, Tuple, Any, TypedDict,Generator
 from pydantic import SecretStr
 from dotenv import load_dotenv
 
 import pandas as pd
+
+from journalize_metrics import MetricsWriter, cascade_summary, metrics_path
+from pdf_extract import PdfTableExtractor, cache_dir as pdf_cache_dir
+from source_reader import SourceReader, line_fingerprint
+from bank_parser import ParserSpec, ParsedRow
+import classifier
+import prompt_index
+import llm_router
 try:
     from langchain_openai import ChatOpenAI  # type: ignore
 
@@ -38,14 +48,33 @@ try:
 except ImportError:
     from langchain.prompts import PromptTemplate # type: ignore
 
+# Default confidence below which a row of the cascade's fast model is sent to the main model
+DEFAULT_CASCADE_THRESHOLD = 0.8
+# Default per-request timeout (seconds) of the OpenAI client ([llm] request_timeout);
+# without one, a hung request would keep a router thread (and the CLI exit) waiting
+DEFAULT_OPENAI_TIMEOUT = 60.0
+CASCADE_STATS = ("rows", "escalated", "fast_tokens", "fast_completion_tokens", "fast_time",
+                 "strong_tokens", "strong_completion_tokens", "strong_time")
+JOURNALIZE_TYPES = ("income", "expense", "transfer")
+
 # Define state schema for langgraph
+# Opens the content of an input file that is not read from disk (e.g. an archive member)
+SourceOpener = Callable[[], ContextManager[IO[bytes]]]
+
+
 class StateSchema(TypedDict):
     file_path: str
+    source: Optional[SourceOpener]
     bank_name: str
+    run_id: str
     timestamp: datetime.datetime
     #raw_data: Optional[str]
     #parsed_data: Optional[List[Dict[str, Any]]]
-    chunked_data: Optional[List[str]]
+    # Chunks are produced lazily while journalizing (CSV files are streamed)
+    chunked_data: Optional[Iterable[str]]
+    chunk_count: int
+    # Rows are parsed with parser_spec (CSV with a spec) instead of by the LLM
+    use_spec: bool
     journalized_data: Optional[List[Dict[str, Any]]]
     output_file: Optional[str]
 
@@ -89,11 +118,6 @@ except ImportError:
     
     END = "END"
 
-try:
-    import fitz  # pymupdf # type: ignore
-except ImportError:
-    fitz = None
-
 # Constants
 #PROMPTS_DIR = Path("prompts")
 #OUTPUT_DIR = Path("out")
@@ -128,6 +152,9 @@ else:
 
 class TransactionJournalizer:
     """Main AI Agent for transaction journalizing"""
+
+    # Leading chunks shown to the LLM when a bank prompt has to be created
+    PROMPT_SAMPLE_CHUNKS = 10
     
     def __init__(self, config, bank_name: str):
         self.bank_name = bank_name
@@ -136,6 +163,7 @@ class TransactionJournalizer:
         file_config = config['file_config'] if 'file_config' in config else {}
         llm_config = config['llm'] if 'llm' in config else {}
         processing_config = config['processing'] if 'processing' in config else {}
+        classifier_config = config['classifier'] if 'classifier' in config else {}
 
         self.llm = self._initialize_llm(llm_config)
 
@@ -149,21 +177,95 @@ class TransactionJournalizer:
         self.system_prompt = self._load_system_prompt(system_prompt_file)
         self.bank_prompt_file = Path(self.prompts_format.format(name=self.bank_name))
         self.bank_prompt = None  # Will be loaded lazily when processing file
+        # Existing bank prompts shown as examples when a new bank prompt is created: the most
+        # similar ones to the file format, within a count and an (estimated) token budget
+        self.prompt_examples = int(processing_config.get('prompt_examples', prompt_index.DEFAULT_TOP_K))
+        self.prompt_example_tokens = int(processing_config.get('prompt_example_tokens', prompt_index.DEFAULT_TOKEN_BUDGET))
 
         # processing parameters
         self.chunk_size = int(processing_config.get('chunk_size', 10))
+        # PDF tables are extracted in a process pool and cached per page (see pdf_extract.py)
+        self.pdf_extractor = PdfTableExtractor(pdf_cache_dir(file_config),
+                                               int(processing_config.get('pdf_workers', 0)))
+        # Column mapping of the bank's CSV (agents.parser_spec, set by the CLI). With a spec,
+        # rows are parsed locally and the LLM is only asked for the categorization fields.
+        self.parser_spec: Optional[ParserSpec] = None
+        # Ask the LLM once for a parser spec when the agent has none
+        self.bootstrap_parser = str(processing_config.get('bootstrap_parser', 'false')).lower() in ('true', 'yes', '1', 'on')
+
+        # Cumulative LLM call time (seconds), count and token usage, read by the
+        # CLI profiler and the per-chunk metrics
+        self.llm_time = 0.0
+        self.llm_calls = 0
+        # Backend that answered the last LLM call (see llm_router.py)
+        self.last_backend: Optional[str] = None
+        # Cascade counters of the current run (rows sent to the fast model, rows escalated,
+        # and tokens / seconds per tier), see journalize_metrics.cascade_summary
+        self.cascade_stats: Dict[str, float] = dict.fromkeys(CASCADE_STATS, 0)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # Rows answered without an LLM call (reported as cache_hits in the metrics)
+        self.cache_hits = 0
+        # Output of lines this agent journalized before (journalized_rows table, keyed by
+        # line_fingerprint): a function set by the CLI that looks up fingerprints and returns
+        # {fingerprint: JSON list of rows}. Lines found are not journalized again (cache_hits).
+        self.reuse_rows = str(processing_config.get('reuse_rows', 'true')).lower() in ('true', 'yes', '1', 'on')
+        self.seen_rows: Optional[Callable[[List[str]], Dict[str, str]]] = None
+        # Output of the lines journalized by the last run, by fingerprint (saved by the CLI)
+        self.new_rows: Dict[str, str] = {}
+        # Local category classifier (train_classifier); rows it predicts with a confidence
+        # of at least classifier_threshold are not sent to the LLM (reported as classified)
+        self.classifier_file = classifier.model_file(classifier_config)
+        self.classifier_threshold = classifier.threshold(classifier_config)
+        self.classifier_enabled = str(classifier_config.get('enabled', 'true')).lower() in ('true', 'yes', '1', 'on')
+        self.classifier: Optional[classifier.NaiveBayesClassifier] = None
+        self.classifier_mtime: Optional[float] = None
+        self.classified = 0
+        self.metrics = MetricsWriter(metrics_path(file_config))
+        # threading.Event set by the CLI to cancel a background run between chunks
+        self.cancel_event = None
         
         # Setup langgraph workflow
         self.workflow = self._create_workflow()
 
 
-    def _initialize_llm(self, llm_config: Dict[str, str] ):
-        """Initialize LLM based on configuration"""
-        provider = llm_config.get('provider', 'openai')
-        
-        if provider.lower() == 'openai':
+    def _initialize_llm(self, llm_config: Dict[str, str]) -> llm_router.LLMRouter:
+        """Initialize the LLM backends ([llm] backends, or the single provider) and their router
+
+        With [llm] cascade_backends, the cascade router (fast model) is set up as well.
+        """
+        router = self._create_router(llm_config.get('backends') or llm_config.get('provider', 'openai'), llm_config)
+        self.model_name = router.name
+        # Two-tier cascade: the fast model journalizes first; rows it is not confident about
+        # (cascade_threshold) or that are not valid are sent again to the models above
+        self.cascade: Optional[llm_router.LLMRouter] = None
+        self.cascade_threshold = float(llm_config.get('cascade_threshold', DEFAULT_CASCADE_THRESHOLD))
+        if llm_config.get('cascade_backends'):
+            self.cascade = self._create_router(llm_config['cascade_backends'], llm_config)
+            self.model_name = f"{self.cascade.name}>{router.name}"
+        return router
+
+    def _create_router(self, backends_str: str, llm_config: Dict[str, str]) -> llm_router.LLMRouter:
+        """Create the router of comma-separated "provider:model" backends"""
+        backends = []
+        for entry in [entry.strip() for entry in backends_str.split(',') if entry.strip()]:
+            # "provider:model"; without a model, the provider's *_model setting is used
+            backend_provider, _, model = entry.partition(':')
+            client, model = self._create_chat_model(backend_provider.strip().lower(), model.strip(), llm_config)
+            backends.append(llm_router.Backend(model, client))
+
+        return llm_router.LLMRouter(
+            backends,
+            hedge=str(llm_config.get('hedge', 'true')).lower() in ('true', 'yes', '1', 'on'),
+            hedge_after=float(llm_config.get('hedge_after', llm_router.DEFAULT_HEDGE_AFTER)),
+        )
+
+    def _create_chat_model(self, provider: str, model: str, llm_config: Dict[str, str]) -> Tuple[Any, str]:
+        """Create the chat model of a backend and return it with its model name"""
+        request_timeout = llm_config.get('request_timeout')
+        if provider == 'openai':
             api_key = llm_config.get('openai_api_key')
-            model = llm_config.get('openai_model', 'gpt-4')
+            model = model or llm_config.get('openai_model', 'gpt-4')
             if ChatOpenAI is None:
                 raise ImportError("ChatOpenAI could not be imported. Please check your langchain installation.")
             if api_key is None:
@@ -171,11 +273,12 @@ class TransactionJournalizer:
             return ChatOpenAI(
                 api_key=SecretStr(api_key),
                 model=model,
-                temperature=0.1
-            )
-        elif provider.lower() == 'anthropic':
+                temperature=0.1,
+                timeout=float(request_timeout) if request_timeout else DEFAULT_OPENAI_TIMEOUT
+            ), model
+        elif provider == 'anthropic':
             api_key = llm_config.get('anthropic_api_key')
-            model = llm_config.get('anthropic_model', 'claude-3-sonnet-20240229')
+            model = model or llm_config.get('anthropic_model', 'claude-3-sonnet-20240229')
             if ChatAnthropic is None:
                 raise ImportError("ChatAnthropic could not be imported. Please check your langchain installation.")
             if api_key is None:
@@ -184,14 +287,46 @@ class TransactionJournalizer:
                 api_key=SecretStr(api_key),
                 model_name=model,
                 temperature=0.1,
-                timeout=30,
+                timeout=float(request_timeout) if request_timeout else 30,
                 stop=None,
                 max_retries=3
-            )
+            ), model
         else:
             raise ValueError(f"Unsupported LLM provider: {provider}")
 
 
+    def _invoke_llm(self, messages: List[Any], project_name: str, router: Optional[llm_router.LLMRouter] = None) -> Any:
+        """Invoke the LLM through the router (traced with LangSmith when configured) and record its latency
+
+        Args:
+            router: Router to use (default: the main models)
+        """
+        router = router or self.llm
+        start = time.perf_counter()
+        try:
+            if langsmith_client:
+                with tracing_v2_enabled(client=langsmith_client, project_name=project_name):
+                    response, backend = router.invoke(messages)
+            else:
+                response, backend = router.invoke(messages)
+        finally:
+            self.llm_time += time.perf_counter() - start
+            self.llm_calls += 1
+        self.last_backend = backend.name
+
+        usage = getattr(response, "usage_metadata", None) or {}
+        # Tokens of hedged requests whose responses were not used are billed as well
+        discarded_input, discarded_output = router.take_discarded_usage()
+        self.prompt_tokens += usage.get("input_tokens", 0) + discarded_input
+        self.completion_tokens += usage.get("output_tokens", 0) + discarded_output
+        return response
+
+    def close(self):
+        """Stop the request threads of the LLM routers"""
+        self.llm.close()
+        if self.cascade is not None:
+            self.cascade.close()
+
     def _setup_logger(self, log_format: str) -> logging.Logger:
         """Setup logging configuration"""
         log_file = log_format.format(time=self.init_timestamp)
@@ -245,11 +380,11 @@ class TransactionJournalizer:
         """Create new bank-specific prompt using LLM with enhanced context"""
         self.logger.info(f"Generating new bank prompt for {self.bank_name} with transaction file context")
         
-        # Collect existing prompt files as reference examples
-        existing_prompts = self._collect_existing_prompts()
-        
         # Analyze transaction file format
         file_analysis = self._analyze_transaction_file_format(file_path, raw_data)
+
+        # Collect the existing prompt files most similar to this format as reference examples
+        existing_prompts = self._collect_existing_prompts(file_analysis)
         
         # Create enhanced prompt creation template
         prompt_creation_template = """
@@ -320,11 +455,7 @@ class TransactionJournalizer:
         ]
         
 
-        if langsmith_client:
-            with tracing_v2_enabled(client=langsmith_client, project_name="journalize_agent1"):
-                response = self.llm.invoke(messages)
-        else:
-            response = self.llm.invoke(messages)
+        response = self._invoke_llm(messages, "journalize_agent1")
         new_prompt = response.content
         
         # Save the new prompt
@@ -334,22 +465,28 @@ class TransactionJournalizer:
         self.logger.info(f"Enhanced bank prompt created for {self.bank_name}")
         return str(new_prompt)
 
-    def _collect_existing_prompts(self) -> str:
-        """Collect existing prompt files as reference examples"""
+    def _collect_existing_prompts(self, file_analysis: Dict[str, str]) -> str:
+        """Collect the existing prompt files most similar to the file format as reference examples
+
+        At most prompt_examples files within prompt_example_tokens (see prompt_index.py).
+        """
         existing_prompts = []
-        glob_files = Path(self.prompts_format.format(name="*"))
+        # Token counts use the encoding of the main model (the first configured backend)
+        index = prompt_index.PromptIndex(Path(self.prompts_format.format(name="*")), model=self.llm.backends[0].name)
+        query = "\n".join([file_analysis["file_format"], file_analysis["structure_analysis"],
+                           file_analysis["data_sample"]])
 
         try:
-            for prompt_file in glob_files.parent.glob(glob_files.name):
-                if prompt_file.name != Path(self.bank_prompt_file).name:  # Exclude current bank
-                    try:
-                        with open(prompt_file, 'r', encoding='utf-8') as f:
-                            content = f.read().strip()
-                            existing_prompts.append(f"### {prompt_file.name}\n```\n{content}\n```\n")
-                    except Exception as e:
-                        self.logger.warning(f"Could not read prompt file {prompt_file}: {e}")
+            examples = index.select(query, exclude=Path(self.bank_prompt_file).name,  # Exclude current bank
+                                    top_k=self.prompt_examples, token_budget=self.prompt_example_tokens)
+            for example in examples:
+                existing_prompts.append(f"### {example.name}\n```\n{example.text}\n```\n")
+            self.logger.info("Prompt examples: " + (", ".join(
+                f"{example.name} (score {example.score:.3f}, {example.tokens} tokens)" for example in examples) or "none"))
         except Exception as e:
             self.logger.warning(f"Could not collect existing prompts: {e}")
+        for warning in index.warnings:
+            self.logger.warning(warning)
         
         if existing_prompts:
             return "\n".join(existing_prompts)
@@ -441,11 +578,7 @@ class TransactionJournalizer:
             HumanMessage(content=prompt_creation_template.format(bank_name=self.bank_name))
         ]
         
-        if langsmith_client:
-            with tracing_v2_enabled(client=langsmith_client, project_name="journalize_agent2"):
-                response = self.llm.invoke(messages)
-        else:
-            response = self.llm.invoke(messages)
+        response = self._invoke_llm(messages, "journalize_agent2")
         new_prompt = response.content
         
         # Save the new prompt
@@ -463,12 +596,21 @@ class TransactionJournalizer:
             self.logger.info("Parsing transaction data...")
             
             file_path = state["file_path"]
-            chunked_data = self._read_transaction_file(file_path)
+            chunked_data = iter(self._read_transaction_file(file_path, state.get("source")))
             
-            # Load bank prompt with transaction file context if not already loaded
-            raw_data = "".join(chunked_data)
-            if self.bank_prompt is None:
-                self.bank_prompt = self._load_or_create_bank_prompt_with_context(file_path, raw_data)
+            # Load bank prompt (and bootstrap a parser spec) with transaction file context if needed
+            # (from the leading chunks only; they are put back in front of the stream)
+            is_csv = Path(file_path).suffix.lower() == '.csv'
+            need_spec = is_csv and self.parser_spec is None and self.bootstrap_parser
+            if self.bank_prompt is None or need_spec:
+                sample = list(itertools.islice(chunked_data, self.PROMPT_SAMPLE_CHUNKS))
+                raw_data = "\n".join(sample)
+                if self.bank_prompt is None:
+                    self.bank_prompt = self._load_or_create_bank_prompt_with_context(file_path, raw_data)
+                if need_spec:
+                    self.parser_spec = self._bootstrap_parser_spec(file_path, raw_data)
+                chunked_data = itertools.chain(sample, chunked_data)
+            state["use_spec"] = is_csv and self.parser_spec is not None
             
             #state["raw_data"] = raw_data
             #state["parsed_data"] = self._parse_raw_data(raw_data)
@@ -484,10 +626,38 @@ class TransactionJournalizer:
             journalized_data = []
             
             #for chunk in self._chunk_data(parsed_data):
-            for chunk in state["chunked_data"]:
-                parse_chunk = self._parse_raw_data(chunk) 
-                result = self._journalize_chunk(parse_chunk)
+            for chunk_no, chunk in enumerate(state["chunked_data"], 1):
+                if self.cancel_event is not None and self.cancel_event.is_set():
+                    self.logger.info(f"Cancelled before chunk {chunk_no}")
+                    raise RuntimeError("journalize cancelled")
+                before = (self.llm_calls, self.prompt_tokens, self.completion_tokens, self.cache_hits, self.classified,
+                          self._hedge_count(), self.cascade_stats["rows"], self.cascade_stats["escalated"])
+                self.last_backend = None
+                start = time.perf_counter()
+                rows_in, result = self._journalize_lines(chunk.split("\n"), state["use_spec"])
+                self.metrics.write(
+                    "chunk",
+                    run_id=state["run_id"],
+                    bank=self.bank_name,
+                    model=self.model_name,
+                    chunk_size=self.chunk_size,
+                    chunk=chunk_no,
+                    rows_in=rows_in,
+                    rows_out=len(result),
+                    prompt_tokens=self.prompt_tokens - before[1],
+                    completion_tokens=self.completion_tokens - before[2],
+                    latency=round(time.perf_counter() - start, 3),
+                    # A cascade escalation is a second request, not a retry
+                    retries=max(self.llm_calls - before[0] - 1 - (self.cascade_stats["escalated"] > before[7]), 0),
+                    cache_hits=self.cache_hits - before[3],
+                    classified=self.classified - before[4],
+                    backend=self.last_backend,
+                    hedges=self._hedge_count() - before[5],
+                    cascade_rows=self.cascade_stats["rows"] - before[6],
+                    escalated=self.cascade_stats["escalated"] - before[7],
+                )
                 journalized_data.extend(result)
+                state["chunk_count"] = chunk_no
             
             state["journalized_data"] = journalized_data
             return state
@@ -523,74 +693,47 @@ class TransactionJournalizer:
         
         return workflow.compile()
     
-    def _read_transaction_file(self, file_path: str) -> List[str]:
-        """Read transaction file (PDF or CSV)"""
+    def _read_transaction_file(self, file_path: str, source: Optional[SourceOpener] = None) -> Iterable[str]:
+        """Read transaction file (PDF or CSV)
+
+        The file type is taken from file_path; if source is given the content
+        is read from it instead of from file_path.
+        """
         file_path_obj = Path(file_path)
         
         if file_path_obj.suffix.lower() == '.pdf':
-            return self._read_pdf_file(file_path_obj)
+            return self._read_pdf_file(file_path_obj, source)
         elif file_path_obj.suffix.lower() == '.csv':
-            return self._read_csv_file(file_path_obj)
+            return self._read_csv_file(file_path_obj, source)
         else:
             raise ValueError(f"Unsupported file type: {file_path_obj.suffix}")
 
-    def _read_pdf_file(self, file_path: Path) -> List[str]:
-        """Read PDF file and extract text using pymupdf"""
-        if fitz is None:
-            raise ImportError("pymupdf is required for PDF processing. Please install with: pip install pymupdf")
-            
+    def _read_pdf_file(self, file_path: Path, source: Optional[SourceOpener] = None) -> List[str]:
+        """Read PDF file and extract tables using pymupdf (pages in parallel, cached by content hash)"""
         try:
-            # Open PDF document
-            pdf_document = fitz.open(str(file_path))
-            text_list = []
-            
-            for page_num in range(pdf_document.page_count):
-                #text += f"------------- Page {page_num + 1} -------------\n"
-                page = pdf_document[page_num]
-                
-                # Try to extract tables first (more accurate for bank statements)
-                try:
-                    tables = page.find_tables() # type: ignore
-                    if tables:
-                        table_num = 0
-                        for table in tables:
-                            text = f"---------- Page {page_num + 1} --- Table {table_num + 1} -------------\n"
-                            # Extract table data
-                            table_data = table.extract()
-                            for row in table_data:
-                                if row and any(cell for cell in row if cell and cell.strip()):
-                                    # Join non-empty cells with comma
-                                    #clean_row = [str(cell).strip().replace("\n","") for cell in row if cell and str(cell).strip()]
-                                    clean_row = [str(cell).strip().replace("\n","") for cell in row ]
-                                    if clean_row:
-                                        text += "|".join(clean_row) + "\n"
-                            text_list.append(text.strip())
-                            table_num += 1
-                except Exception as table_error:
-                    self.logger.warning(f"Table extraction failed on page {page_num + 1}: {table_error}")
-                
-                # Extract regular text (fallback or supplement)
-                #page_text = page.get_text()
-                #if page_text.strip():
-                #    text += page_text + "\n"
-            pdf_document.close()
-            return text_list
+            if source is not None:
+                with source() as stream:
+                    result = self.pdf_extractor.extract(data=stream.read())
+            else:
+                result = self.pdf_extractor.extract(path=file_path)
+            for warning in result.warnings:
+                self.logger.warning(warning)
+            self.logger.info(f"PDF tables extracted: {result.pages} pages ({result.cached} cached)")
+            return result.texts
             
         except Exception as e:
             self.logger.error(f"Error reading PDF file {file_path}: {e}")
             raise
 
-    def _read_csv_file(self, file_path: Path) -> List[str]:
-        """Read CSV file"""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                string_data = file.read()
-                return [e for e in self._chunk_data(string_data.splitlines()) ]
-        except UnicodeDecodeError:
-            # Try with different encoding
-            with open(file_path, 'r', encoding='shift_jis') as file:
-                string_data = file.read()
-                return [e for e in self._chunk_data(string_data.splitlines()) ]
+    def _read_csv_file(self, file_path: Path, source: Optional[SourceOpener] = None) -> Iterator[str]:
+        """Read CSV file as chunks, lazily in a single pass (encoding detected from the first bytes)"""
+        with (source() if source is not None else open(file_path, 'rb')) as stream:
+            reader = SourceReader(stream, self.parser_spec.encoding if self.parser_spec else None)
+            lines = reader.lines()
+            first = next(lines, None)
+            self.logger.info(f"Reading {file_path} (encoding: {reader.encoding})")
+            if first is not None:
+                yield from self._chunk_data(itertools.chain([first], lines))
 
     def _parse_raw_data(self, raw_data: str) -> List[Dict[str, Any]]:
         """Parse raw data into structured format"""
@@ -605,17 +748,137 @@ class TransactionJournalizer:
         
         return parsed_data
 
-    def _chunk_data(self, data: List[str], chunk_arg: Optional[int] = None) -> Generator[str, None, None]:
-        """Chunk data for processing"""
+    def _chunk_data(self, data: Iterable[str], chunk_arg: Optional[int] = None) -> Generator[str, None, None]:
+        """Chunk lines for processing (one line per row in each chunk)"""
         chunk_size = self.chunk_size if chunk_arg is None else chunk_arg
-        for i in range(0, len(data), chunk_size):
-            yield "".join(data[i:i + chunk_size])
+        lines = iter(data)
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                break
+            yield "\n".join(chunk)
     
-    def _journalize_chunk(self, chunk: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Journalize a chunk of transactions"""
-        
+    def _journalize_lines(self, lines: List[str], use_spec: bool) -> Tuple[int, List[Dict[str, Any]]]:
+        """Journalize the lines of a chunk, reusing the output of lines journalized before
+
+        Only lines not seen before (by their line_fingerprint) are parsed and
+        journalized; their output is kept in new_rows. The output follows the
+        order of the lines.
+
+        A line is kept in new_rows only when the LLM answered it: its rows were
+        returned (with categories on the spec path) or it was marked as not a
+        transaction. Lines left unanswered by a failed or incomplete response are
+        not recorded, so they are journalized again next time.
+
+        Returns:
+            (number of input rows, journalized rows)
+        """
+        lines = [line.strip() for line in lines]
+        fingerprints = [line_fingerprint(line) if line else None for line in lines]
+        outputs: Dict[int, List[Dict[str, Any]]] = {}
+        if self.reuse_rows:
+            known = self._seen_outputs([fp for fp in fingerprints if fp])
+            outputs = {n: known[fp] for n, fp in enumerate(fingerprints) if fp in known}
+        self.cache_hits += len(outputs)
+        pending = [n for n, line in enumerate(lines) if line and n not in outputs]
+
+        unattributed: List[Dict[str, Any]] = []
+        if use_spec:
+            parsed = [(n, self.parser_spec.parse_lines([lines[n]])) for n in pending]
+            rows = [(n, found[0]) for n, found in parsed if found]
+            # Lines the spec does not parse (headers, totals) have no rows
+            new: Optional[Dict[int, List[Dict[str, Any]]]] = {n: [] for n, found in parsed if not found}
+            unanswered = []
+            categorized, answered = self._categorize_chunk([row for _, row in rows])
+            for (n, _), item, ok in zip(rows, categorized, answered):
+                if ok:
+                    new[n] = [item]
+                else:
+                    # Output without a category, and not recorded
+                    unanswered.append(n)
+                    unattributed.append(item)
+            rows_in = len(rows) + sum(1 for items in outputs.values() if items)
+        else:
+            items = self._parse_raw_data("\n".join(lines[n] for n in pending))
+            result = self._journalize_chunk(items) if self.cascade is None else self._cascade_chunk(items)
+            if result is None:
+                result = []
+            new = self._group_by_line(result, pending)
+            if new is None:
+                # Rows that cannot be traced to a line are output as they are, and not reused
+                self.logger.warning("Journalized rows without line numbers; the lines are not recorded for reuse")
+                unattributed = [{k: v for k, v in item.items() if k != "line"} for item in result
+                                if not item.get("skip")]
+                unanswered = []
+            else:
+                unanswered = [n for n in pending if n not in new]
+            rows_in = sum(1 for line in lines if line)
+        if unanswered:
+            self.logger.warning(f"{len(unanswered)} lines were not journalized and are not recorded for reuse: "
+                                + ", ".join(lines[n][:40] for n in unanswered[:5]))
+
+        for n, items in (new or {}).items():
+            self.new_rows[fingerprints[n]] = json.dumps(items, ensure_ascii=False)
+            outputs[n] = items
+        return rows_in, [item for n in sorted(outputs) for item in outputs[n]] + unattributed
+
+    def _seen_outputs(self, fingerprints: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Output of the lines journalized before, by fingerprint (this run first, then seen_rows)"""
+        found = {fp: self.new_rows[fp] for fp in fingerprints if fp in self.new_rows}
+        missing = list({fp for fp in fingerprints if fp not in found})
+        if missing and self.seen_rows is not None:
+            found.update(self.seen_rows(missing))
+        outputs = {}
+        for fp, text in found.items():
+            try:
+                outputs[fp] = json.loads(text)
+            except ValueError:
+                self.logger.warning(f"Ignoring invalid journalized row record: {fp}")
+        return outputs
+
+    def _group_by_line(self, result: List[Dict[str, Any]], pending: List[int]) -> Optional[Dict[int, List[Dict[str, Any]]]]:
+        """Group the rows of _journalize_chunk by the line they came from
+
+        Args:
+            result: Rows with the 1-based line number of the chunk in "line"
+                (or {"line": n, "skip": true} for a line that is not a transaction)
+            pending: Line indexes of the chunk lines
+
+        Returns:
+            Line index -> rows of the answered lines (skipped lines map to []; lines
+            without rows are left out), or None if a row has no valid line number
+        """
+        grouped: Dict[int, List[Dict[str, Any]]] = {}
+        for item in result:
+            line = item.get("line")
+            if not isinstance(line, int) or not 1 <= line <= len(pending):
+                return None
+            rows = grouped.setdefault(pending[line - 1], [])
+            if not item.get("skip"):
+                rows.append({k: v for k, v in item.items() if k != "line"})
+        return grouped
+
+    def _journalize_chunk(self, chunk: List[Dict[str, Any]], router: Optional[llm_router.LLMRouter] = None,
+                          with_confidence: bool = False) -> Optional[List[Dict[str, Any]]]:
+        """Journalize a chunk of transactions
+
+        The lines are numbered in the prompt and each row names its line in "line";
+        lines that are not transactions are returned as {"line": n, "skip": true}.
+
+        Args:
+            router: Router to use (default: the main models)
+            with_confidence: Also ask for the confidence of each row (0-1) in "confidence"
+
+        Returns:
+            The rows, or None if the response could not be parsed
+        """
+        if not chunk:
+            return []
+
         # Prepare data for LLM
-        chunk_text = "\n".join([item["raw_line"] for item in chunk])
+        chunk_text = "\n".join([f"[{i}] {item['raw_line']}" for i, item in enumerate(chunk, 1)])
+        confidence_field = '\n      "confidence": この行の仕訳の確信度（0〜1の数値）,' if with_confidence else ""
+        skip_confidence = ', "confidence": 確信度' if with_confidence else ""
         
         # Create prompt
         prompt = f"""
@@ -623,7 +886,7 @@ class TransactionJournalizer:
 
 {self.bank_prompt}
 
-以下の取引データを分析し、JSON形式で仕訳してください：
+以下の取引データを分析し、JSON形式で仕訳してください（各行の先頭の[番号]は行番号で、取引データには含みません）：
 
 {chunk_text}
 
@@ -631,6 +894,7 @@ class TransactionJournalizer:
 {{
   "transactions": [
     {{
+      "line": 取引データの行番号（数値）,{confidence_field}
       "date": "YYYY-MM-DD HH:MM:SS",
       "account": "口座名",
       "type": "income/expense/transfer",
@@ -644,6 +908,7 @@ class TransactionJournalizer:
     }}
   ]
 }}
+取引ではない行（見出し・合計など）は {{"line": 行番号, "skip": true{skip_confidence}}} だけを出力してください。
 """
         
         messages = [
@@ -651,34 +916,266 @@ class TransactionJournalizer:
             HumanMessage(content=prompt)
         ]
         
-        if langsmith_client:
-            with tracing_v2_enabled(client=langsmith_client, project_name="journalize_agent3"):
-                response = self.llm.invoke(messages)
-        else:
-            response = self.llm.invoke(messages)
+        response = self._invoke_llm(messages, "journalize_agent3", router)
         
         try:
-            # Extract JSON from markdown code blocks if present
-            content = str(response.content).strip()
-            if content.startswith('```json'):
-                # Find the JSON content between ```json and ```
-                start = content.find('```json') + 7
-                end = content.find('```', start)
-                if end != -1:
-                    content = content[start:end].strip()
-            elif content.startswith('```'):
-                # Handle generic code blocks
-                start = content.find('```') + 3
-                end = content.find('```', start)
-                if end != -1:
-                    content = content[start:end].strip()
-                    
-            result = json.loads(content)
-            return result.get("transactions", [])
-        except json.JSONDecodeError as e:
+            result = self._response_json(response).get("transactions")
+        except (json.JSONDecodeError, AttributeError) as e:
+            self.logger.error(f"JSON decode error: {e}")
+            self.logger.error(f"Response content: {response.content}")
+            return None
+        if not isinstance(result, list) or not all(isinstance(item, dict) for item in result):
+            self.logger.error(f"Unexpected response: {response.content}")
+            return None
+        return result
+
+    def _response_json(self, response: Any) -> Any:
+        """Parse the JSON of an LLM response (inside a markdown code block if present)"""
+        content = str(response.content).strip()
+        if content.startswith('```json'):
+            # Find the JSON content between ```json and ```
+            start = content.find('```json') + 7
+            end = content.find('```', start)
+            if end != -1:
+                content = content[start:end].strip()
+        elif content.startswith('```'):
+            # Handle generic code blocks
+            start = content.find('```') + 3
+            end = content.find('```', start)
+            if end != -1:
+                content = content[start:end].strip()
+        return json.loads(content)
+
+    def _load_classifier(self):
+        """Load the classifier model, again when train_classifier has rewritten it"""
+        if not self.classifier_enabled or not self.classifier_file.exists():
+            self.classifier = None
+            return
+        mtime = self.classifier_file.stat().st_mtime
+        if self.classifier is None or mtime != self.classifier_mtime:
+            try:
+                self.classifier = classifier.NaiveBayesClassifier.load(self.classifier_file)
+                self.classifier_mtime = mtime
+                self.logger.info(f"Classifier loaded: {self.classifier_file} ({len(self.classifier.labels)} labels)")
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Classifier not used: {e}")
+                self.classifier = None
+
+    def _classify(self, row: ParsedRow) -> Optional[classifier.Label]:
+        """Label of a row if the classifier is confident enough (rows without an account always go to the LLM)"""
+        if self.classifier is None or not row.account:
+            return None
+        label, confidence = self.classifier.predict(f"{row.item_name} {row.desc}", row.amount)
+        return label if confidence >= self.classifier_threshold else None
+
+    def _categorize_chunk(self, rows: List[ParsedRow]) -> Tuple[List[Dict[str, Any]], List[bool]]:
+        """Journalize rows parsed with the parser spec, asking the LLM only for the categorization
+
+        Rows the classifier labels confidently are not sent to the LLM.
+
+        Returns:
+            (journalized rows, whether each row got a categorization)
+        """
+        if not rows:
+            return [], []
+        labels = [self._classify(row) for row in rows]
+        self.classified += sum(label is not None for label in labels)
+        answers = {i: {"type": label.type, "category": label.category, "transfer": label.transfer or "None",
+                       "tags": label.tags}
+                   for i, label in enumerate(labels, 1) if label is not None}
+        pending = [(i, row) for i, row in enumerate(rows, 1) if labels[i - 1] is None]
+        if pending:
+            answers.update(self._request_categories(pending) if self.cascade is None
+                           else self._cascade_categories(pending))
+
+        result = []
+        answered = []
+        for i, row in enumerate(rows, 1):
+            answer = answers.get(i)
+            if not isinstance(answer, dict) or not answer.get("category"):
+                self.logger.warning(f"No categorization for row {i}: {row.item_name}")
+                answer = {}
+            answered.append(bool(answer))
+            result.append({
+                "date": row.date,
+                "account": row.account or answer.get("account", ""),
+                "type": answer.get("type") or ("income" if row.amount > 0 else "expense"),
+                "category": answer.get("category", ""),
+                "transfer": answer.get("transfer", "None"),
+                "amount": row.amount,
+                "item_name": row.item_name,
+                "tags": answer.get("tags", ""),
+                "desc": row.desc,
+                "memo": row.memo,
+            })
+        return result, answered
+
+    def _request_categories(self, rows: List[Tuple[int, ParsedRow]], router: Optional[llm_router.LLMRouter] = None,
+                            with_confidence: bool = False) -> Dict[int, Dict[str, Any]]:
+        """Ask the LLM for the categorization fields of numbered rows
+
+        Args:
+            router: Router to use (default: the main models)
+            with_confidence: Also ask for the confidence of each row (0-1) in "confidence"
+
+        Returns:
+            Row number -> answer (type, category, transfer, tags and account if asked)
+        """
+        ask_account = self.parser_spec is None or self.parser_spec.account is None
+        # One compact line per row: number|date|amount|item_name|desc
+        rows_text = "\n".join(f"{i}|{row.date[:10]}|{row.amount}|{row.item_name}|{row.desc}"
+                               for i, row in rows)
+        account_field = '"account": "口座名", ' if ask_account else ""
+        confidence_field = ', "confidence": 分類の確信度（0〜1の数値）' if with_confidence else ""
+
+        prompt = f"""
+{self.bank_prompt}
+
+以下の取引（番号|日付|金額|取引先|説明）を分類し、JSON形式で出力してください。
+日付・金額・取引先は解析済みのため出力不要です：
+
+{rows_text}
+
+出力形式：
+{{"transactions": [{{"i": 番号, {account_field}"type": "income/expense/transfer", "category": "カテゴリ名", "transfer": "振替先口座名またはNone", "tags": "タグ（カンマ区切り）"{confidence_field}}}]}}
+"""
+        messages = [
+            SystemMessage(content=self.system_prompt),
+            HumanMessage(content=prompt)
+        ]
+        response = self._invoke_llm(messages, "journalize_agent3", router)
+        try:
+            return {item.get("i"): item for item in self._response_json(response).get("transactions", [])
+                    if isinstance(item, dict)}
+        except (json.JSONDecodeError, AttributeError) as e:
             self.logger.error(f"JSON decode error: {e}")
             self.logger.error(f"Response content: {response.content}")
+            return {}
+
+    def _tier_call(self, tier: str, call: Callable[[], Any]) -> Any:
+        """Run an LLM request of a cascade tier ("fast" or "strong"), adding its tokens and time to cascade_stats"""
+        before = (self.prompt_tokens + self.completion_tokens, self.completion_tokens, self.llm_time)
+        try:
+            return call()
+        finally:
+            self.cascade_stats[f"{tier}_tokens"] += self.prompt_tokens + self.completion_tokens - before[0]
+            self.cascade_stats[f"{tier}_completion_tokens"] += self.completion_tokens - before[1]
+            self.cascade_stats[f"{tier}_time"] += self.llm_time - before[2]
+
+    def _confident(self, item: Any, required: Tuple[str, ...]) -> bool:
+        """Whether a row of the fast model can be kept: a dict with a valid type, the required
+        fields (or a line marked as not a transaction) and a confidence of at least cascade_threshold"""
+        if not isinstance(item, dict):
+            return False
+        if item.get("skip") is not True:
+            if item.get("type") not in JOURNALIZE_TYPES or any(item.get(key) in (None, "") for key in required):
+                return False
+        confidence = item.get("confidence")
+        return (isinstance(confidence, (int, float)) and not isinstance(confidence, bool)
+                and confidence >= self.cascade_threshold)
+
+    def _cascade_chunk(self, chunk: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Journalize a chunk with the cascade: the fast model first, then the main models for
+        the lines with a row that is not confident or valid (or without rows)
+
+        Returns:
+            Rows as _journalize_chunk returns them ("line" numbers the lines of chunk)
+        """
+        if not chunk:
             return []
+        self.cascade_stats["rows"] += len(chunk)
+        fast = self._tier_call("fast", lambda: self._journalize_chunk(chunk, self.cascade, with_confidence=True))
+
+        by_line: Dict[int, List[Dict[str, Any]]] = {line: [] for line in range(1, len(chunk) + 1)}
+        for item in fast or []:
+            line = item.get("line") if isinstance(item, dict) else None
+            if line not in by_line or isinstance(line, bool):
+                # Rows that cannot be traced to a line: the whole chunk goes to the main models
+                by_line = {line: [] for line in by_line}
+                break
+            by_line[line].append(item)
+        escalate = [line for line, items in by_line.items()
+                    if not items or not all(self._confident(item, ("date", "category", "amount")) for item in items)]
+
+        result = [{k: v for k, v in item.items() if k != "confidence"}
+                  for line, items in by_line.items() if line not in escalate for item in items]
+        if escalate:
+            self.cascade_stats["escalated"] += len(escalate)
+            strong = self._tier_call("strong", lambda: self._journalize_chunk([chunk[line - 1] for line in escalate]))
+            for item in strong or []:
+                line = item.get("line")
+                if isinstance(line, int) and 1 <= line <= len(escalate):
+                    item = {**item, "line": escalate[line - 1]}
+                else:
+                    item = {k: v for k, v in item.items() if k != "line"}
+                result.append(item)
+        return result
+
+    def _cascade_categories(self, rows: List[Tuple[int, ParsedRow]]) -> Dict[int, Dict[str, Any]]:
+        """_request_categories with the cascade: rows the fast model is not confident about are
+        asked again to the main models"""
+        self.cascade_stats["rows"] += len(rows)
+        fast = self._tier_call("fast", lambda: self._request_categories(rows, self.cascade, with_confidence=True))
+        required = ("category",) + (("account",) if self.parser_spec is None or self.parser_spec.account is None else ())
+        answers = {i: {k: v for k, v in fast[i].items() if k != "confidence"}
+                   for i, _ in rows if self._confident(fast.get(i), required)}
+        escalate = [(i, row) for i, row in rows if i not in answers]
+        if escalate:
+            self.cascade_stats["escalated"] += len(escalate)
+            answers.update(self._tier_call("strong", lambda: self._request_categories(escalate)))
+        return answers
+
+    def _hedge_count(self) -> int:
+        """Hedged requests of all routers"""
+        return self.llm.hedges + (self.cascade.hedges if self.cascade is not None else 0)
+
+    def _bootstrap_parser_spec(self, file_path: str, raw_data: str) -> Optional[ParserSpec]:
+        """Ask the LLM once for the parser spec of this bank's CSV layout
+
+        The spec is accepted only if it parses rows of the sample; otherwise
+        the rows keep being parsed by the LLM.
+        """
+        self.logger.info(f"Bootstrapping parser spec for {self.bank_name}")
+        file_analysis = self._analyze_transaction_file_format(file_path, raw_data)
+        sample_lines = raw_data.split("\n")[:20]
+        prompt = f"""
+取引先「{self.bank_name}」のCSVファイルの列の対応を、以下のJSON形式で出力してください。
+列番号は0始まりです。
+
+## ファイル分析
+{file_analysis['structure_analysis']}
+
+## データサンプル
+{chr(10).join(sample_lines)}
+
+## 出力形式
+{{
+  "date": 日付の列番号, "date_format": "strptime形式 (例: %Y/%m/%d)",
+  "time": 時刻の列番号またはnull, "time_format": "strptime形式 (例: %H:%M)",
+  "amount": 符号付き金額の列番号またはnull, "sign": 1または-1 (支払いが正の数で記載される場合は-1),
+  "debit": 出金の列番号またはnull, "credit": 入金の列番号またはnull,
+  "item": [取引先・摘要の列番号], "desc": [説明の列番号], "memo": [メモの列番号],
+  "account": "口座名 (ファイル全体で1つの場合) またはnull"
+}}
+JSONのみを出力してください。
+"""
+        messages = [
+            SystemMessage(content=self.system_prompt),
+            HumanMessage(content=prompt)
+        ]
+        response = self._invoke_llm(messages, "parser_spec_agent")
+        try:
+            spec = {key: value for key, value in self._response_json(response).items() if value is not None}
+            parser_spec = ParserSpec(spec)
+        except (json.JSONDecodeError, AttributeError, ValueError) as e:
+            self.logger.warning(f"Parser spec rejected: {e}")
+            return None
+        parsed = parser_spec.parse_lines(sample_lines)
+        if not parsed:
+            self.logger.warning(f"Parser spec rejected (no rows of the sample parsed): {parser_spec.to_json()}")
+            return None
+        self.logger.info(f"Parser spec created ({len(parsed)} sample rows parsed): {parser_spec.to_json()}")
+        return parser_spec
 
     def _generate_csv_output(self, journalized_data: List[Dict[str, Any]], timestamp: datetime.datetime, filename: str) -> str:
         """Generate CSV output file"""
@@ -707,17 +1204,30 @@ class TransactionJournalizer:
         self.logger.info(f"CSV output generated: {output_file}")
         return str(output_file)
     
-    def process_file(self, file_path: str) -> Tuple[str, str]:
-        """Process transaction file and return output paths"""
-        self.logger.info(f"Processing file: {file_path}")
+    def process_file(self, file_path: str, source: Optional[SourceOpener] = None) -> Tuple[str, str]:
+        """Process transaction file and return output paths
+
+        Args:
+            file_path: Transaction file (names the output even when source is given)
+            source: Opens the file content, for files read from an archive
+        """
+        self.logger.info(f"Processing file: {file_path}" + (" (from archive)" if source is not None else ""))
+        self._load_classifier()
+        self.new_rows = {}
+        self.cascade_stats = dict.fromkeys(CASCADE_STATS, 0)
         timestamp = datetime.datetime.now()
+        start = time.perf_counter()
         
         # Initial state
         initial_state: StateSchema = {
             "file_path": file_path,
+            "source": source,
             "bank_name": self.bank_name,
+            "run_id": f"{self.bank_name}_{timestamp.strftime('%Y%m%d%H%M%S%f')}",
             "timestamp": timestamp,
             "chunked_data": None,
+            "chunk_count": 0,
+            "use_spec": False,
             "journalized_data": None,
             "output_file": None
         }
@@ -736,5 +1246,25 @@ class TransactionJournalizer:
         
         if output_csv is None:
             raise RuntimeError("Processing failed, no output CSV generated.")
+        cascade = cascade_summary(self.cascade_stats) if self.cascade is not None else {}
+        self.metrics.write(
+            "run",
+            run_id=initial_state["run_id"],
+            bank=self.bank_name,
+            model=self.model_name,
+            chunk_size=self.chunk_size,
+            file=file_path,
+            chunks=final_state["chunk_count"],
+            rows_out=len(final_state["journalized_data"] or []),
+            elapsed=round(time.perf_counter() - start, 3),
+            **cascade,
+        )
+        for line in self.llm.summary() + (self.cascade.summary() if self.cascade is not None else []):
+            self.logger.info(f"LLM {line}")
+        if cascade.get("cascade_rows"):
+            self.logger.info(
+                f"Cascade: {cascade['cascade_rows']} rows, escalated {cascade['escalated']} "
+                f"({cascade['escalation_rate']:.0%}), estimated main-model tokens saved {cascade['tokens_saved']}, "
+                f"latency saved {cascade['latency_saved']}s")
         self.logger.info(f"Processing completed. Output CSV: {output_csv}")
         return output_csv, log_file
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Transfer Matching
+=================
+
+Links the two legs of a transfer when both statements have been loaded.
+
+load_csv records a transfer inferred from one statement (a card payment in
+the bank export, an ATM withdrawal) as the real row plus an inferred
+counter-leg in the other account (transactions.ref_transaction_id points to
+the real row). When the other account's statement is loaded too, the same
+money then appears twice in that account: once as the inferred leg and once
+as its own real row. match() pairs each inferred leg with the real row it
+duplicates, so that the inferred leg can be dropped and the real row linked
+under the transfer.
+
+Candidates are legs of the same account with the same amount whose dates are
+within the window. Both lists are sorted by (account, amount, date) - the
+order of the idx_transactions_account_amount_date index - and merged, with a
+sliding date window inside each (account, amount) group, so matching is
+linear in the number of legs.
+
+A real row that is itself a transfer (its inferred leg elsewhere) is only a
+candidate if it points back at the account of the inferred leg's real row.
+A pair is linked only when each leg is the other's only candidate; the rest
+are reported as ambiguous and left for review.
+"""
+
+from itertools import groupby
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+DEFAULT_WINDOW_DAYS = 3
+
+
+class Leg(NamedTuple):
+    """A transaction taking part in matching
+
+    For an inferred leg, counter_* describe the real row it was inferred
+    from; for a real row, its own inferred leg (None if it is not a transfer).
+    """
+    id: int
+    account_id: int
+    amount: float
+    day: float              # julianday of the transaction date
+    category_id: int
+    transfer_id: Optional[int]
+    counter_id: Optional[int]
+    counter_account_id: Optional[int]
+
+
+class MatchResult(NamedTuple):
+    """Pairs of (inferred leg, real row) to link, and counts of the other inferred legs"""
+    pairs: List[Tuple[Leg, Leg]]
+    unmatched: int
+    ambiguous: int
+
+
+def _key(leg: Leg) -> Tuple[int, float]:
+    return leg.account_id, leg.amount
+
+
+def _window_candidates(inferred: List[Leg], real: Sequence[Leg], window_days: float,
+                       candidates: Dict[int, List[Leg]], claims: Dict[int, List[Leg]]):
+    """Collect candidates within one (account, amount) group, both sorted by day"""
+    lo = 0
+    for leg in inferred:
+        while lo < len(real) and real[lo].day < leg.day - window_days:
+            lo += 1
+        k = lo
+        while k < len(real) and real[k].day <= leg.day + window_days:
+            row = real[k]
+            if row.counter_account_id is None or row.counter_account_id == leg.counter_account_id:
+                candidates[leg.id].append(row)
+                claims[row.id].append(leg)
+            k += 1
+
+
+def match(inferred: Sequence[Leg], real: Sequence[Leg], window_days: float = DEFAULT_WINDOW_DAYS) -> MatchResult:
+    """Match inferred legs to real rows
+
+    Args:
+        inferred: Inferred legs sorted by (account_id, amount, day)
+        real: Real rows sorted by (account_id, amount, day)
+        window_days: Maximum distance between the dates of a pair
+
+    Returns:
+        The pairs to link. When both rows of a transfer were inferred from
+        their own statements, each one's inferred leg matches the other row;
+        only one of the two mirror pairs is returned (linking it removes
+        both inferred legs).
+    """
+    candidates: Dict[int, List[Leg]] = {leg.id: [] for leg in inferred}
+    claims: Dict[int, List[Leg]] = {row.id: [] for row in real}
+
+    j = 0
+    for key, group in groupby(inferred, _key):
+        while j < len(real) and _key(real[j]) < key:
+            j += 1
+        k = j
+        while k < len(real) and _key(real[k]) == key:
+            k += 1
+        _window_candidates(list(group), real[j:k], window_days, candidates, claims)
+        j = k
+
+    pairs = []
+    consumed = set()
+    for leg in inferred:
+        found = candidates[leg.id]
+        if leg.id not in consumed and len(found) == 1 and len(claims[found[0].id]) == 1:
+            row = found[0]
+            pairs.append((leg, row))
+            consumed.add(leg.id)
+            if row.counter_id is not None:
+                # The mirror pair (the row's own inferred leg and this leg's real row)
+                consumed.add(row.counter_id)
+
+    left = [leg for leg in inferred if leg.id not in consumed]
+    ambiguous = sum(1 for leg in left if candidates[leg.id])
+    return MatchResult(pairs, len(left) - ambiguous, ambiguous)